@@ -0,0 +1,793 @@
+# python bench.py [name ...] [--save JSON] [--compare JSON] [--threshold F]
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+
+from mcl.machine_types import i32, intp, memref
+from mcl.ndarray import Array, DType, Int32, deferred
+from mcl.dialects import LoopNestAPI
+from mcl import vm
+
+
+def _time(stmt, number) -> float:
+    """Best-of-5 time per call in nanoseconds."""
+    best = min(timeit.repeat(stmt, number=number, repeat=5))
+    return best / number * 1e9
+
+
+def bench_machine_op(number=100_000):
+    data = memref.alloc((intp(64), intp(64)), i32)
+    idx = (intp(3), intp(5))
+    val = i32(7)
+    a, b = intp(3), intp(5)
+
+    cases = {
+        "int_add": lambda: a + b,
+        "int_lt": lambda: a < b,
+        "memref_load": lambda: data.load(idx, i32),
+        "memref_store": lambda: data.store(idx, val),
+    }
+    resolved = {
+        "int_add": (vm.specialize_machine_op("int_add", intp, intp, intp),
+                    (a, b)),
+        "int_lt": (vm.specialize_machine_op("int_lt", bool, intp, intp),
+                   (a, b)),
+        "memref_load": (vm.specialize_machine_op(
+                            "memref_load", i32, memref, tuple),
+                        (data, idx)),
+        "memref_store": (vm.specialize_machine_op(
+                             "memref_store", None, memref, tuple, i32),
+                         (data, idx, val)),
+    }
+
+    modes = ["table", "specialized", "unchecked"]
+    print(f"{'op':<14}" + "".join(f"{m:>13}" for m in modes)
+          + f"{'resolved':>13}   (ns/call)")
+    for name, fn in cases.items():
+        row = []
+        for mode in modes:
+            with vm.dispatch_mode(mode):
+                row.append(_time(fn, number))
+        op, args = resolved[name]
+        row.append(_time(lambda: op(*args), number))
+        print(f"{name:<14}" + "".join(f"{t:>13.1f}" for t in row))
+
+
+def bench_buffer_lookup(number=200_000):
+    """Resolve a view to its owner's buffer on each element access.
+
+    "field hash" replays the lookup memrefs had before buffer ids: walk the
+    owner chain, then hash the owner by its fields.
+    """
+    memsys = vm.get_memory_system()
+    data = memref.alloc((intp(64), intp(64)), i32)
+    row = data.view((intp(64),), (intp(4),), intp(256))
+    m = vm._get_machine_value(row.view((intp(8),), (intp(8),), intp(264)))
+
+    def fields(r):
+        owner = r.owner and fields(r.owner)
+        return (r.shape, r.strides, r.datatype, r.itemsize, r.size, owner,
+                r.offset)
+
+    by_fields = {fields(m.handle()): memsys._buffer(m)}
+
+    def field_hash():
+        r = m
+        while r.owner is not None:
+            r = r.owner
+        return by_fields[fields(r)]
+
+    val = i32(7)
+    cases = {
+        "buffer id": lambda: memsys._buffer(m),
+        "field hash": field_hash,
+        "read (view)": lambda: memsys.read(m, (3,)),
+        "write (view)": lambda: memsys.write(m, (3,), val),
+    }
+    times = {name: _time(fn, number) for name, fn in cases.items()}
+    for name, t in times.items():
+        print(f"{name:<14}{t:>10.1f} ns")
+    saved = times["field hash"] - times["buffer id"]
+    print(f"saved per access: {saved:.1f} ns "
+          f"({saved / (times['read (view)'] + saved):.0%} of a read)")
+
+
+def bench_struct(n=10_000_000):
+    """Construct and read n Int32 structs, as scalar Array reads do."""
+    v = i32(7)
+
+    def construct():
+        for _ in range(n):
+            Int32(value=v)
+
+    def read():
+        x = Int32(value=v)
+        for _ in range(n):
+            x.value
+
+    for name, fn in {"construct": construct, "read .value": read}.items():
+        t0 = time.perf_counter()
+        fn()
+        t = time.perf_counter() - t0
+        print(f"{name:<14}{t:>8.2f} s{t / n * 1e9:>10.1f} ns/struct  ({n})")
+
+
+# bench_objects on the tree before machine values were slotted and small
+# intp values interned; every machine value was a new object then.
+_OBJECTS_BEFORE = {
+    "bytes": {"i32": 80.0, "intp (large)": 80.0, "intp (small)": 80.0,
+              "Int32": 40.0},
+    # workload: (machine values allocated, peak KiB)
+    "workloads": {
+        "test_array": (189, 10.2),
+        "test_array_slice_getitem": (2729, 71.4),
+        "test_array_slice_setitem": (463, 15.6),
+        "test_array_fancy_getitem": (1667, 65.2),
+        "test_array_copy": (238, 9.6),
+        "test_array_elementwise": (523, 34.8),
+        "test_array_reductions": (7307, 87.2),
+    },
+}
+
+
+def bench_objects(n=100_000):
+    """Memory per machine value and struct, and machine value allocations of
+    the test.py workloads, next to the figures recorded before slotting and
+    interning (`_OBJECTS_BEFORE`).
+    """
+    import importlib.util
+    import os
+
+    raw = list(range(10**6, 10**6 + n))
+    cases = {
+        "i32": lambda: [i32(v) for v in raw],
+        "intp (large)": lambda: [intp(v) for v in raw],
+        "intp (small)": lambda: [intp(v % 64) for v in raw],
+        "Int32": lambda: [Int32(value=v) for v in raw],
+    }
+    print(f"{'object':<16}{'bytes before':>14}{'bytes/object':>14}")
+    for name, fn in cases.items():
+        tracemalloc.start()
+        base, _ = tracemalloc.get_traced_memory()
+        objs = fn()
+        used, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # minus the list's own pointer per element
+        before = _OBJECTS_BEFORE["bytes"][name]
+        print(f"{name:<16}{before:>14.1f}{(used - base) / n - 8:>14.1f}")
+        del objs
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test.py")
+    spec = importlib.util.spec_from_file_location("mcl_test", path)
+    tests = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(tests)
+    workloads = [
+        "test_array", "test_array_slice_getitem", "test_array_slice_setitem",
+        "test_array_fancy_getitem", "test_array_copy",
+        "test_array_elementwise", "test_array_reductions",
+    ]
+
+    # Count the machine values each workload constructs, and how many of
+    # them are new objects rather than interned ones.
+    meta = type(i32)
+    call = meta.__call__
+    counts = [0, 0]
+
+    def counting_call(cls, value):
+        counts[0] += 1
+        if not (cls.__mcl_interned__ is not None and type(value) is int
+                and vm._INTERN_MIN <= value <= vm._INTERN_MAX):
+            counts[1] += 1
+        return call(cls, value)
+
+    print(f"{'workload':<28}{'values':>10}{'alloc before':>14}"
+          f"{'allocated':>11}{'KiB before':>12}{'peak KiB':>10}")
+    meta.__call__ = counting_call
+    try:
+        for name in workloads:
+            counts[:] = [0, 0]
+            tracemalloc.start()
+            with contextlib.redirect_stdout(io.StringIO()):
+                getattr(tests, name)()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            (allocs, kib) = _OBJECTS_BEFORE["workloads"][name]
+            print(f"{name:<28}{counts[0]:>10}{allocs:>14}{counts[1]:>11}"
+                  f"{kib:>12.1f}{peak / 1024:>10.1f}")
+    finally:
+        meta.__call__ = call
+
+
+def bench_bulk_load(n=256):
+    shape = (intp(n), intp(n))
+    data = memref.alloc(shape, i32)
+    zero = (intp(0), intp(0))
+    (s0, s1) = data.strides
+    transposed = data.view(shape, (s1, s0), intp(0))
+    indices = [((i * 7) % n, i % n) for i in range(n * n)]
+
+    def per_element():
+        for i in range(n):
+            for j in range(n):
+                data.load((intp(i), intp(j)), i32)
+
+    cases = {
+        "per-element load": per_element,
+        "load_block contiguous": lambda: data.load_block(zero, shape),
+        "load_block strided": lambda: transposed.load_block(zero, shape),
+        "gather": lambda: data.gather(indices),
+    }
+    for name, fn in cases.items():
+        t = _time(fn, 1) / 1e6
+        print(f"{name:<24}{t:>10.2f} ms  ({n}x{n} i32)")
+
+
+def bench_memsys(n=256, backends=("python", "numpy")):
+    """The test.py workloads on an n x n array, per MemorySystem backend."""
+    shape = (intp(n), intp(n))
+    zero = (intp(0), intp(0))
+
+    def fill(ary):
+        for i in range(n):
+            for j in range(n):
+                ary[i, j] = i32(i + j)
+
+    def read(ary):
+        for i in range(n):
+            for j in range(n):
+                ary[i, j]
+
+    rows = {}
+    for backend in backends:
+        prev = vm.set_memory_system(vm.make_memory_system(backend))
+        try:
+            ary = Array(dtype=DType(Int32), data=memref.alloc(shape, i32))
+            dst = Array(dtype=DType(Int32), data=memref.alloc(shape, i32))
+            (s0, s1) = ary.strides
+            transposed = ary.data.view(shape, (s1, s0), intp(0))
+            cases = {
+                "fill per element": lambda: fill(ary),
+                "read per element": lambda: read(ary),
+                "slice setitem": lambda: dst.__setitem__(
+                    slice(0, n // 8), ary[slice(0, n // 8)]),
+                "slice setitem overlap": lambda: ary.__setitem__(
+                    slice(1, n), ary[slice(0, n - 1)]),
+                "scalar fill column": lambda: dst.__setitem__(
+                    (slice(None), 3), i32(7)),
+                "copy": lambda: ary.copy(),
+                "load_block strided": lambda: transposed.load_block(
+                    zero, shape),
+            }
+            for name, fn in cases.items():
+                rows.setdefault(name, []).append(_time(fn, 1) / 1e6)
+        finally:
+            vm.set_memory_system(prev)
+
+    print(f"{'case':<22}" + "".join(f"{b:>12}" for b in backends)
+          + f"   (ms, {n}x{n} i32)")
+    for name, row in rows.items():
+        print(f"{name:<22}" + "".join(f"{t:>12.2f}" for t in row))
+
+
+def bench_accounting(n=20_000):
+    """memref.alloc of a small buffer, with and without allocation sites."""
+    print(f"{'record_sites':<14}{'us/alloc':>10}")
+    memsys = vm.get_memory_system()
+    shape = (intp(4), intp(4))
+    for record in (False, True):
+        memsys.record_sites = record
+        try:
+            t = _time(lambda: memref.alloc(shape, i32), n) / 1e3
+        finally:
+            memsys.record_sites = False
+        print(f"{record!s:<14}{t:>10.2f}")
+
+
+def bench_npy(mib=256):
+    """Array.save and Array.load of a `mib` MiB i32 array."""
+    import tempfile
+
+    n = mib * 2**20 // 4 // 1024
+    ary = Array(dtype=DType(Int32),
+                data=memref.alloc((intp(n), intp(1024)), i32))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = f"{tmp}/a.npy"
+        cases = {
+            "save": lambda: ary.save(path),
+            "load mmap": lambda: Array.load(path),
+            "load copy": lambda: Array.load(path, mmap=False),
+        }
+        for name, fn in cases.items():
+            t0 = time.perf_counter()
+            fn()
+            t = (time.perf_counter() - t0) * 1e3
+            print(f"{name:<12}{t:>10.1f} ms  ({mib} MiB)")
+
+
+def bench_export(n=1000):
+    """Handing an n x n i32 Array to NumPy: zero-copy vs per element."""
+    import numpy as np
+
+    shape = (intp(n), intp(n))
+    ary = Array(dtype=DType(Int32), data=memref.alloc(shape, i32))
+    ext = np.zeros((n, n), dtype=np.int32)
+
+    def per_element():
+        # first 8 rows only; scaled to the full array below
+        for i in range(8):
+            for j in range(n):
+                ext[i, j] = vm._get_machine_value(ary[i, j].value)
+
+    cases = {
+        "np.asarray(ary)": (lambda: np.asarray(ary), 1),
+        "memoryview(ary)": (lambda: memoryview(ary), 1),
+        "memref.from_buffer": (lambda: memref.from_buffer(ext), 1),
+        "per-element copy": (per_element, n / 8),
+    }
+    for name, (fn, scale) in cases.items():
+        t = _time(fn, 1) / 1e3 * scale
+        print(f"{name:<22}{t:>14.1f} us  ({n}x{n} i32)")
+
+
+def bench_reshape(n=1000):
+    """Transpose, reshape and reverse an n x n i32 Array: views vs copies."""
+    shape = (intp(n), intp(n))
+    ary = Array(dtype=DType(Int32), data=memref.alloc(shape, i32))
+    t = ary.T
+    cases = {
+        "transpose (view)": lambda: ary.T,
+        "reshape (view)": lambda: ary.reshape(intp(-1)),
+        "reverse rows (view)": lambda: ary[slice(None, None, -1)],
+        "copy (contiguous)": lambda: ary.copy(),
+        "ravel transposed (copy)": lambda: t.ravel(),
+    }
+    for name, fn in cases.items():
+        t_us = _time(fn, 3) / 1e3
+        print(f"{name:<26}{t_us:>12.1f} us  ({n}x{n} i32)")
+
+
+def bench_view_copy(gib=1.0, cols=4096):
+    """Copy small slices out of a multi-GB array.
+
+    The old copy duplicated the whole owner buffer; "whole owner" shows that
+    cost for reference.
+    """
+    rows = int(gib * 2**30) // (cols * 4)
+    ary = Array(dtype=DType(Int32),
+                data=memref.alloc((intp(rows), intp(cols)), i32))
+    cases = {
+        "16 rows (contiguous)": ary[slice(100, 116)],
+        "64x64 block (strided)": ary[slice(100, 164), slice(100, 164)],
+        "column (strided)": ary[slice(None), 7],
+        "whole owner": ary,
+    }
+    print(f"owner: {rows}x{cols} i32 = {rows * cols * 4 / 2**30:.2f} GiB")
+    print(f"{'case':<24}{'time ms':>10}{'peak MiB':>12}")
+    for name, view in cases.items():
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        view.copy()
+        t = (time.perf_counter() - t0) * 1e3
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{name:<24}{t:>10.3f}{peak / 2**20:>12.3f}")
+
+
+def bench_elementwise(n=1000, backends=("python", "numpy")):
+    """a + b on n x n i32 arrays against raw buffer speed (a memcpy)."""
+    shape = (intp(n), intp(n))
+    print(f"{'case':<22}" + "".join(f"{b:>12}" for b in backends)
+          + f"   (ms, {n}x{n} i32)")
+    rows = {}
+    for backend in backends:
+        prev = vm.set_memory_system(vm.make_memory_system(backend))
+        try:
+            a = Array(dtype=DType(Int32), data=memref.alloc(shape, i32))
+            b = Array(dtype=DType(Int32), data=memref.alloc(shape, i32))
+            out = Array(dtype=DType(Int32), data=memref.alloc(shape, i32))
+            row = b[0]
+            k = 32
+
+            def per_index():
+                # first k rows only; scaled to the full array below
+                for i in range(k):
+                    for j in range(n):
+                        out[i, j] = a[i, j].value + b[i, j].value
+
+            cases = {
+                "memcpy (a.copy)": lambda: a.copy(),
+                "a + b": lambda: a.apply("int_add", b, out=out),
+                "a + row (broadcast)": lambda: a.apply(
+                    "int_add", row, out=out),
+                "a < b": lambda: a.apply("int_lt", b, out=out),
+                "per-index loop": lambda: per_index(),
+            }
+            for name, fn in cases.items():
+                t = _time(fn, 1) / 1e6
+                if name == "per-index loop":
+                    t *= n / k
+                rows.setdefault(name, []).append(t)
+        finally:
+            vm.set_memory_system(prev)
+    for name, row in rows.items():
+        print(f"{name:<22}" + "".join(f"{t:>12.2f}" for t in row))
+
+
+def bench_lazy(n=1000, backends=("python", "numpy")):
+    """a + b * c on n x n i32 arrays: eager temporaries vs one fused pass."""
+    shape = (intp(n), intp(n))
+    print(f"{'backend':<10}{'eager ms':>10}{'peak MiB':>10}"
+          f"{'fused ms':>10}{'peak MiB':>10}   ({n}x{n} i32)")
+    for backend in backends:
+        prev = vm.set_memory_system(vm.make_memory_system(backend))
+        try:
+            a, b, c, out = (
+                Array(dtype=DType(Int32), data=memref.alloc(shape, i32))
+                for _ in range(4)
+            )
+
+            def eager():
+                out[slice(None)] = a + b * c
+
+            def fused():
+                with deferred():
+                    out[slice(None)] = a + b * c
+
+            row = []
+            for fn in (eager, fused):
+                tracemalloc.start()
+                t = _time(fn, 1) / 1e6
+                peak = tracemalloc.get_traced_memory()[1] / 2**20
+                tracemalloc.stop()
+                row += [t, peak]
+        finally:
+            vm.set_memory_system(prev)
+        print(f"{backend:<10}" + "".join(f"{x:>10.1f}" for x in row))
+
+
+def bench_profiling(n=64):
+    """A per-element loop on n x n i32 arrays with profiling off and on."""
+    from mcl import profiling
+
+    shape = (intp(n), intp(n))
+    a, b, out = (Array(dtype=DType(Int32), data=memref.alloc(shape, i32))
+                 for _ in range(3))
+    off = _time(lambda: _add_kernel(a, b, out), 1) / 1e6
+    with profiling.profile() as prof:
+        on = _time(lambda: _add_kernel(a, b, out), 1) / 1e6
+    print(f"{'profiling':<12}{'time ms':>10}   ({n}x{n} i32)")
+    print(f"{'off':<12}{off:>10.1f}")
+    print(f"{'on':<12}{on:>10.1f}")
+    print(prof.report(top=5))
+
+
+def bench_accesses(n=128):
+    """Row- and column-major copies of n x n i32, as seen by the access
+    tracer (64 KiB 8-way cache).
+    """
+    from mcl import accesses
+
+    shape = (intp(n), intp(n))
+    a, out = (Array(dtype=DType(Int32), data=memref.alloc(shape, i32))
+              for _ in range(2))
+    t0 = time.perf_counter()
+    with accesses.record() as trace:
+        for i, j in LoopNestAPI.from_tuple((n, n)):
+            out[i, j] = a[i, j].value
+        for j, i in LoopNestAPI.from_tuple((n, n)):
+            out[i, j] = a[i, j].value
+    t = time.perf_counter() - t0
+    print(f"recorded {trace.count} accesses in {t * 1e3:.1f} ms")
+    print(trace.report(size=64 * 1024, ways=8))
+
+
+def bench_reduce(n=1000):
+    """Axis reductions of an n x n i32 array."""
+    ary = Array(dtype=DType(Int32),
+                data=memref.alloc((intp(n), intp(n)), i32))
+    cases = {
+        "sum()": lambda: ary.sum(),
+        "sum(axis=0)": lambda: ary.sum(axis=0),
+        "sum(axis=1)": lambda: ary.sum(axis=1),
+        "sum(axis=1, pairwise)": lambda: ary.sum(axis=1, pairwise=True),
+        "max(axis=0)": lambda: ary.max(axis=0),
+    }
+    for name, fn in cases.items():
+        t = _time(fn, 1) / 1e6
+        print(f"{name:<24}{t:>10.2f} ms  ({n}x{n} i32)")
+
+
+def bench_loop_nest(n=512):
+    """Iterating an n x n LoopNestAPI in its traversal modes."""
+    nest = LoopNestAPI.from_tuple((n, n))
+    cases = {
+        "__iter__": lambda: sum(1 for _ in nest),
+        "stream()": lambda: sum(1 for _ in nest.stream()),
+        "stream(as_intp=True)": lambda: sum(
+            1 for _ in nest.stream(as_intp=True)),
+        "offsets()": lambda: sum(1 for _ in nest.offsets((n * 4, 4))),
+        "tiled((64, 64))": lambda: sum(1 for _ in nest.tiled((64, 64))),
+    }
+    for name, fn in cases.items():
+        t = _time(fn, 1) / 1e6
+        print(f"{name:<24}{t:>10.2f} ms  ({n}x{n})")
+
+
+def bench_fancy_getitem(rows=1_000_000, cols=8, backends=("python", "numpy")):
+    """table[idx] gathering `rows` rows of an i32 table by an index array."""
+    ntable = 4096
+    print(f"{'backend':<10}{'time ms':>10}   ({rows} rows of {cols} i32)")
+    for backend in backends:
+        prev = vm.set_memory_system(vm.make_memory_system(backend))
+        try:
+            table = Array(dtype=DType(Int32),
+                          data=memref.alloc((intp(ntable), intp(cols)), i32))
+            idx = Array(dtype=DType(Int32),
+                        data=memref.alloc((intp(rows),), i32))
+            idx.data.store_block(
+                (intp(0),), (intp(rows),),
+                vm.layout_of(i32).pack_many(
+                    [(i * 7919) % ntable for i in range(rows)]),
+            )
+            t0 = time.perf_counter()
+            table[idx]
+            t = (time.perf_counter() - t0) * 1e3
+        finally:
+            vm.set_memory_system(prev)
+        print(f"{backend:<10}{t:>10.1f}")
+
+
+def _add_kernel(a, b, out):
+    (n, m) = a.shape
+    for i in range(vm._get_machine_value(n)):
+        for j in range(vm._get_machine_value(m)):
+            out[i, j] = a[i, j].value + b[i, j].value
+
+
+def bench_tracing(n=64):
+    """A per-element kernel on n x n i32 arrays: interpreted vs replayed."""
+    from mcl import tracing
+
+    shape = (intp(n), intp(n))
+    a, b, out = (Array(dtype=DType(Int32), data=memref.alloc(shape, i32))
+                 for _ in range(3))
+    traced = tracing.trace(_add_kernel)
+    t0 = time.perf_counter()
+    traced(a, b, out)
+    first = time.perf_counter() - t0
+    cases = {
+        "interpreter": lambda: _add_kernel(a, b, out),
+        "first call (trace)": None,
+        "replay": lambda: traced(a, b, out),
+    }
+    for name, fn in cases.items():
+        t = first * 1e3 if fn is None else _time(fn, 1) / 1e6
+        print(f"{name:<22}{t:>10.2f} ms  ({n}x{n} i32)")
+
+
+def _parallel_fill(idx, ary):
+    # a little arithmetic per element so the work is not pure dispatch
+    (i, j) = idx
+    ary[i, j] = i32(sum(range(i % 16 + j % 16)))
+
+
+def bench_parallel_for(n=256, workers=(1, 2, 4)):
+    """LoopNestAPI.parallel_for filling an n x n i32 array in place."""
+    from concurrent.futures import ProcessPoolExecutor
+    import os
+
+    ary = Array(dtype=DType(Int32),
+                data=memref.alloc((intp(n), intp(n)), i32))
+    nest = LoopNestAPI.from_tuple((n, n))
+    t0 = time.perf_counter()
+    for idx in nest:
+        _parallel_fill(idx, ary)
+    serial = time.perf_counter() - t0
+    print(f"cpus: {os.cpu_count()}")
+    print(f"{'workers':<10}{'time ms':>10}{'speedup':>10}")
+    print(f"{'serial':<10}{serial * 1e3:>10.1f}{1.0:>10.2f}")
+    for w in workers:
+        with ProcessPoolExecutor(w) as pool:
+            # warm the pool so process start-up is not timed
+            nest.parallel_for(_parallel_fill, args=(ary,), executor=pool)
+            t0 = time.perf_counter()
+            nest.parallel_for(_parallel_fill, args=(ary,), executor=pool)
+            t = time.perf_counter() - t0
+        print(f"{w:<10}{t * 1e3:>10.1f}{serial / t:>10.2f}")
+
+
+def _autotime(fn, target=0.1, repeat=9) -> tuple[float, float]:
+    """Best time per call in nanoseconds over `repeat` runs of at least
+    `target` seconds each, and the spread of the runs: the median relative
+    to the best.
+    """
+    timer = timeit.Timer(fn)
+    number = 1
+    while (t := timer.timeit(number)) < target:
+        number = max(number * 2, int(number * target / max(t, 1e-9)))
+    runs = sorted([t, *timer.repeat(repeat - 1, number)])
+    best = runs[0]
+    return best / number * 1e9, runs[len(runs) // 2] / best - 1
+
+
+def _suite_shape(size: int, ndim: int) -> tuple[int, ...]:
+    side = max(2, round(size ** (1 / ndim)))
+    return (side,) * ndim
+
+
+def _suite_cases(shape: tuple[int, ...]) -> dict:
+    shape_p = tuple(map(intp, shape))
+    ary = Array(dtype=DType(Int32), data=memref.alloc(shape_p, i32))
+    data = ary.data
+    mid = tuple(intp(n // 2) for n in shape)
+    n0 = shape[0]
+    half = n0 // 2
+    row = Array(dtype=DType(Int32),
+                data=memref.alloc((intp(1), *shape_p[1:]), i32))
+    rows = Array(dtype=DType(Int32), data=memref.alloc((intp(n0),), i32))
+    rows.data.store_block(
+        (intp(0),), (intp(n0),),
+        vm.layout_of(i32).pack_many([(i * 7) % n0 for i in range(n0)]),
+    )
+    nest = LoopNestAPI.from_tuple(shape)
+
+    def iterate():
+        for _ in nest:
+            pass
+
+    return {
+        "alloc": lambda: memref.alloc(shape_p, i32),
+        "load": lambda: data.load(mid, i32),
+        "store": lambda: data.store(mid, i32(1)),
+        "getitem": lambda: ary[mid],
+        "setitem": lambda: ary.__setitem__(mid, i32(1)),
+        "slice view": lambda: ary[slice(1, n0)],
+        "slice setitem": lambda: ary.__setitem__(
+            slice(0, half), ary[slice(half, 2 * half)]),
+        "broadcast_to": lambda: Array(
+            dtype=row.dtype, data=row.data).broadcast_to(shape_p),
+        "fancy getitem": lambda: ary[rows],
+        "copy": lambda: ary.copy(),
+        "loop nest": iterate,
+    }
+
+
+def _has_numpy() -> bool:
+    return importlib.util.find_spec("numpy") is not None
+
+
+def bench_suite(sizes=(1_000, 100_000), ndims=(1, 2, 3),
+                backends=("python", "numpy"), save=None, compare=None,
+                threshold=0.10, max_noise=0.10):
+    """The core operations over a grid of sizes and dimensionalities.
+
+    Each case is the best of several timed runs; its spread (median over
+    best) is kept with it, and a case whose spread exceeds `max_noise` is
+    timed again with more runs. Results can be saved as a JSON baseline and
+    compared with one. A case is a regression if it is slower than the
+    baseline by more than `threshold` plus twice the larger spread of the
+    two measurements, counting at most `max_noise` of spread. A slowdown
+    within that allowance but beyond `threshold` is inconclusive when the
+    spread exceeds `max_noise`. Returns 1 if there are regressions, else 0.
+
+    The NumPy backend is skipped when NumPy is not installed.
+    """
+    if "numpy" in backends and not _has_numpy():
+        print("numpy is not installed; skipping its backend")
+        backends = tuple(b for b in backends if b != "numpy")
+    meta = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "sizes": list(sizes),
+        "ndims": list(ndims),
+        "backends": list(backends),
+    }
+    results = {}
+    for backend in backends:
+        prev = vm.set_memory_system(vm.make_memory_system(backend))
+        try:
+            for ndim in ndims:
+                for size in sizes:
+                    shape = _suite_shape(size, ndim)
+                    for case, fn in _suite_cases(shape).items():
+                        key = f"{backend}/{case}/{ndim}d/{size}"
+                        (ns, spread) = _autotime(fn)
+                        if spread > max_noise:
+                            # more runs make the median more stable
+                            (ns, spread) = min(
+                                (ns, spread), _autotime(fn, repeat=27),
+                                key=lambda r: r[1],
+                            )
+                        results[key] = {"ns": ns, "spread": spread}
+        finally:
+            vm.set_memory_system(prev)
+
+    baseline = {}
+    if compare is not None:
+        with open(compare) as f:
+            saved = json.load(f)
+        baseline = saved["results"]
+        for k, v in saved.get("meta", {}).items():
+            if k in meta and meta[k] != v:
+                print(f"warning: baseline {k} is {v}, this run has "
+                      f"{meta[k]}", file=sys.stderr)
+    print(f"{'case':<36}{'ns':>14}{'baseline':>14}{'ratio':>8}"
+          f"{'allowed':>9}")
+    regressions = []
+    inconclusive = []
+    for key, res in results.items():
+        line = f"{key:<36}{res['ns']:>14.0f}"
+        base = baseline.get(key)
+        if isinstance(base, float):
+            # a baseline saved before spreads were kept
+            base = {"ns": base, "spread": 0.0}
+        if base is not None:
+            ratio = res["ns"] / base["ns"]
+            noise = max(res["spread"], base["spread"])
+            allowed = threshold + 2 * min(noise, max_noise)
+            line += f"{base['ns']:>14.0f}{ratio:>8.2f}{allowed:>9.0%}"
+            if ratio > 1 + allowed:
+                line += "  REGRESSION"
+                regressions.append(key)
+            elif ratio > 1 + threshold and noise > max_noise:
+                line += "  inconclusive"
+                inconclusive.append(key)
+            elif ratio < 1 - allowed:
+                line += "  improved"
+        print(line)
+    if compare is not None:
+        print(f"{len(regressions)} regressions above {threshold:.0%} "
+              f"plus noise, {len(inconclusive)} inconclusive (spread "
+              f"above {max_noise:.0%})")
+
+    if save is not None:
+        with open(save, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+    return 1 if regressions else 0
+
+
+def main(argv):
+    benches = {
+        k[len("bench_"):]: v for k, v in globals().items()
+        if k.startswith("bench_")
+    }
+    parser = argparse.ArgumentParser(description="mcl benchmarks")
+    parser.add_argument("names", nargs="*", metavar="name",
+                        help=", ".join(benches))
+    parser.add_argument("--save", metavar="JSON",
+                        help="suite: write the results as a baseline")
+    parser.add_argument("--compare", metavar="JSON",
+                        help="suite: compare the results with a baseline")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="suite: slowdown reported as a regression")
+    parser.add_argument("--max-noise", type=float, default=0.10,
+                        help="suite: largest spread allowed for")
+    args = parser.parse_args(argv)
+    for name in args.names:
+        if name not in benches:
+            parser.error(f"unknown benchmark {name!r}")
+    status = 0
+    for name in args.names or benches:
+        print(f"== {name}")
+        if name == "suite":
+            status |= bench_suite(save=args.save, compare=args.compare,
+                                  threshold=args.threshold,
+                                  max_noise=args.max_noise)
+        else:
+            try:
+                benches[name]()
+            except ModuleNotFoundError as e:
+                # numpy is an optional dependency
+                print(f"skipped: {e}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,518 @@
+"""
+Memory access tracing and analysis.
+
+`record()` logs every element access made through `MemorySystem.read` and
+`MemorySystem.write` while its block runs:
+
+    with accesses.record() as trace:
+        for i, j in LoopNestAPI.from_tuple((n, m)):
+            out[j, i] = a[j, i].value
+    print(trace.report())
+
+Each access is one fixed-size record in a ring buffer (the oldest records
+are dropped when it is full) or, with `path`, in a file. A record holds the
+address, the access kind and size, and the `LoopNestAPI` iteration it
+belongs to. Addresses are simulated: each owner buffer is placed at its
+own page-aligned base, and every access lands at that base plus its byte
+offset.
+
+While recording, row-major `LoopNestAPI` traversals (`for idx in nest`,
+`nest.stream()`, `nest.reduce()`) are tracked. The analyses work per loop
+nest and per access stream. A stream is the k-th access of each iteration
+of a nest:
+
+- `streams()` classifies the byte stride of each stream along the
+  innermost and the next-outer loop;
+- `warnings()` flags streams that walk against the innermost stride of
+  their buffer, i.e. whose outer loop has a smaller stride than the
+  inner loop (column-major walks of row-major allocations);
+- `reuse_distances()` gives a histogram of LRU stack distances of cache
+  lines;
+- `simulate_cache()` runs a set-associative LRU cache over the trace.
+
+Bulk methods (`read_block`, `gather`, `elementwise`, ...) are not recorded.
+"""
+
+from __future__ import annotations
+
+import bisect
+import collections
+import itertools
+import os
+import struct
+import sys
+import typing as _tp
+import weakref
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from mcl import vm
+from mcl.dialects import LoopNestAPI
+from mcl.vm import MemRef
+
+# address, iteration, nest, slot, flags, itemsize
+_record = struct.Struct("<qqiHBB")
+
+# `flags` bit of a write.
+_WRITE = 1
+
+# Owner buffers are placed at multiples of this.
+_PAGE = 4096
+
+# Nest number of accesses made outside any tracked loop nest.
+_NO_NEST = -1
+
+
+@dataclass(frozen=True, slots=True)
+class Access:
+    address: int
+    iteration: int
+    nest: int
+    slot: int
+    write: bool
+    itemsize: int
+
+
+@dataclass(frozen=True, slots=True)
+class Nest:
+    """A tracked traversal of a `LoopNestAPI`, made at `site`."""
+
+    id: int
+    dims: tuple[int, ...]
+    site: str
+
+
+@dataclass(frozen=True, slots=True)
+class Stream:
+    """The `slot`-th access of each iteration of a loop nest.
+
+    Strides are the most common byte distance between the accesses of
+    consecutive iterations of the innermost loop, and of consecutive
+    iterations of the next-outer loop (None for a one-dimensional nest).
+    `kind` classifies the inner stride: "invariant" (0), "unit" (one
+    element), "short" (within a cache line), "long" or "irregular" (no
+    dominant stride).
+    """
+
+    nest: int
+    slot: int
+    owner: str
+    write: bool
+    count: int
+    itemsize: int
+    inner_stride: int | None
+    outer_stride: int | None
+    kind: str
+
+    @property
+    def against_stride(self) -> bool:
+        """Whether the outer loop walks the buffer with a smaller stride
+        than the inner loop, so that interchanging them improves locality.
+        """
+        if self.inner_stride is None or self.outer_stride is None:
+            return False
+        return 0 < abs(self.outer_stride) < abs(self.inner_stride)
+
+
+@dataclass(frozen=True, slots=True)
+class ReuseHistogram:
+    """Reuse distances of cache lines: `buckets` maps `2**n` to the number
+    of reuses with a distance less than `2**n` distinct lines; `cold`
+    counts first touches.
+    """
+
+    line: int
+    buckets: dict[int, int]
+    cold: int
+
+
+@dataclass(frozen=True, slots=True)
+class CacheStats:
+    """Result of `AccessTrace.simulate_cache`; `by_nest` maps each nest to
+    its `(hits, misses)`.
+    """
+
+    size: int
+    line: int
+    ways: int
+    hits: int
+    misses: int
+    by_nest: dict[int, tuple[int, int]]
+
+    @property
+    def miss_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.misses / total if total else 0.0
+
+
+class AccessTrace:
+    """The accesses recorded by one `record()` block."""
+
+    capacity: int
+    path: str | None
+    nests: list[Nest]
+    count: int
+    _file: _tp.BinaryIO | None
+    _owners: list[tuple[int, int, str]]
+    _bases: weakref.WeakKeyDictionary[MemRef, int]
+    _active: list[list]
+
+    def __init__(self, capacity: int = 1 << 20, path=None):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self.path = None if path is None else os.fspath(path)
+        self.nests = []
+        self.count = 0
+        self._ring = bytearray(
+            capacity * _record.size if path is None else 0
+        )
+        self._file = None
+        self._closed = False
+        # (base, end, label) of each owner, sorted by base
+        self._owners = []
+        self._bases = weakref.WeakKeyDictionary()
+        self._next_base = _PAGE
+        # [nest, iteration, next slot] of the running loop nests
+        self._active = []
+
+    @property
+    def dropped(self) -> int:
+        """The number of records overwritten in the ring."""
+        if self.path is not None:
+            return 0
+        return max(0, self.count - self.capacity)
+
+    def _base(self, root: MemRef) -> int:
+        base = self._bases.get(root)
+        if base is None:
+            base = self._bases[root] = self._next_base
+            end = base + root.size
+            self._next_base = -(-end // _PAGE) * _PAGE + _PAGE
+            label = (
+                f"{root.datatype.__name__}"
+                f"[{'x'.join(map(str, root.shape))}]@{id(root):#x}"
+            )
+            self._owners.append((base, end, label))
+        return base
+
+    def _log(self, memref: MemRef, indices, write: bool) -> None:
+        if self._closed:
+            return
+        address = self._base(memref.handle()) + memref.offset + sum(
+            map(_mul, indices, memref.strides)
+        )
+        if self._active:
+            frame = self._active[-1]
+            (nest, iteration, slot) = frame
+            frame[2] = slot + 1
+        else:
+            (nest, iteration, slot) = (_NO_NEST, self.count, 0)
+        record = _record.pack(
+            address, iteration, nest, min(slot, 0xFFFF),
+            _WRITE if write else 0, memref.itemsize,
+        )
+        if self._file is not None:
+            self._file.write(record)
+        else:
+            at = self.count % self.capacity * _record.size
+            self._ring[at : at + _record.size] = record
+        self.count += 1
+
+    def _walk(self, nest: LoopNestAPI, indices: _tp.Iterator, frame):
+        code = frame.f_code
+        site = (
+            f"{os.path.basename(code.co_filename)}:{frame.f_lineno} "
+            f"{code.co_qualname}"
+        )
+        nid = len(self.nests)
+        self.nests.append(Nest(nid, nest._get_dims(), site))
+        depth = len(self._active)
+        try:
+            for k, idx in enumerate(indices):
+                # an inner nest left by `break` is no longer running
+                del self._active[depth:]
+                self._active.append([nid, k, 0])
+                yield idx
+        finally:
+            del self._active[depth:]
+
+    def records(self) -> _tp.Iterator[Access]:
+        """The recorded accesses, oldest first."""
+        if self.path is not None:
+            if self._file is not None:
+                self._file.flush()
+            with open(self.path, "rb") as f:
+                data = f.read()
+            for fields in _record.iter_unpack(data):
+                yield _access(fields)
+            return
+        first = max(0, self.count - self.capacity)
+        for n in range(first, self.count):
+            at = n % self.capacity * _record.size
+            yield _access(_record.unpack_from(self._ring, at))
+
+    def owner(self, address: int) -> str:
+        """The label of the owner buffer containing `address`."""
+        k = bisect.bisect_right(self._owners, (address, float("inf"))) - 1
+        if k >= 0 and address < self._owners[k][1]:
+            return self._owners[k][2]
+        return "<unknown>"
+
+    def streams(self) -> list[Stream]:
+        """Classify the access streams of every loop nest."""
+        seqs: dict[tuple[int, int], dict[int, int]] = (
+            collections.defaultdict(dict)
+        )
+        first: dict[tuple[int, int], Access] = {}
+        for a in self.records():
+            if a.nest != _NO_NEST:
+                seqs[(a.nest, a.slot)][a.iteration] = a.address
+                first.setdefault((a.nest, a.slot), a)
+        streams = []
+        for (nid, slot), addrs in sorted(seqs.items()):
+            dims = self.nests[nid].dims
+            n = dims[-1]
+            inner = collections.Counter(
+                addr - addrs[k - 1]
+                for k, addr in addrs.items()
+                if k % n and k - 1 in addrs
+            )
+            outer = collections.Counter(
+                addr - addrs[k - n]
+                for k, addr in addrs.items()
+                if len(dims) > 1 and k - n in addrs
+            )
+            a = first[(nid, slot)]
+            inner_stride = _dominant(inner)
+            streams.append(Stream(
+                nest=nid,
+                slot=slot,
+                owner=self.owner(a.address),
+                write=a.write,
+                count=len(addrs),
+                itemsize=a.itemsize,
+                inner_stride=inner_stride,
+                outer_stride=_dominant(outer),
+                kind=_classify(inner, inner_stride, a.itemsize),
+            ))
+        return streams
+
+    def warnings(self) -> list[str]:
+        """Describe the streams that walk against the innermost stride."""
+        res = []
+        for s in self.streams():
+            if s.against_stride:
+                nest = self.nests[s.nest]
+                res.append(
+                    f"nest {nest.id} {nest.dims} at {nest.site}: "
+                    f"{'write' if s.write else 'read'} {s.slot} of "
+                    f"{s.owner} moves {s.inner_stride} bytes per inner "
+                    f"iteration but {s.outer_stride} per outer iteration; "
+                    f"interchange the loops"
+                )
+        return res
+
+    def reuse_distances(self, line: int = 64) -> ReuseHistogram:
+        """Histogram of the number of distinct cache lines of `line` bytes
+        touched between two accesses to the same line.
+        """
+        lines = [a.address // line for a in self.records()]
+        # Fenwick tree over time marking the last access of each line
+        tree = [0] * (len(lines) + 1)
+
+        def add(t, v):
+            t += 1
+            while t < len(tree):
+                tree[t] += v
+                t += t & -t
+
+        def prefix(t):
+            t += 1
+            res = 0
+            while t > 0:
+                res += tree[t]
+                t -= t & -t
+            return res
+
+        last: dict[int, int] = {}
+        buckets: collections.Counter[int] = collections.Counter()
+        cold = 0
+        for t, ln in enumerate(lines):
+            prev = last.get(ln)
+            if prev is None:
+                cold += 1
+            else:
+                distance = prefix(t - 1) - prefix(prev)
+                buckets[2 ** distance.bit_length()] += 1
+                add(prev, -1)
+            add(t, 1)
+            last[ln] = t
+        return ReuseHistogram(line, dict(sorted(buckets.items())), cold)
+
+    def simulate_cache(
+        self, size: int = 32 * 1024, line: int = 64, ways: int | None = 8
+    ) -> CacheStats:
+        """Replay the trace through an LRU cache of `size` bytes with
+        `line`-byte lines and `ways`-way sets (None: fully associative).
+        """
+        nlines = size // line
+        if ways is None:
+            ways = nlines
+        if nlines <= 0 or ways <= 0 or nlines % ways:
+            raise ValueError("size must be a multiple of line * ways")
+        nsets = nlines // ways
+        sets: list[collections.OrderedDict[int, None]] = [
+            collections.OrderedDict() for _ in range(nsets)
+        ]
+        hits = misses = 0
+        by_nest: dict[int, list[int]] = collections.defaultdict(
+            lambda: [0, 0]
+        )
+        for a in self.records():
+            ln = a.address // line
+            cache = sets[ln % nsets]
+            counts = by_nest[a.nest]
+            if ln in cache:
+                cache.move_to_end(ln)
+                hits += 1
+                counts[0] += 1
+            else:
+                misses += 1
+                counts[1] += 1
+                cache[ln] = None
+                if len(cache) > ways:
+                    cache.popitem(last=False)
+        return CacheStats(
+            size, line, ways, hits, misses,
+            {k: (h, m) for k, (h, m) in sorted(by_nest.items())},
+        )
+
+    def report(self, line: int = 64, **cache) -> str:
+        """A text summary: streams per nest, cache miss rates and warnings.
+
+        `cache` is passed to `simulate_cache`.
+        """
+        stats = self.simulate_cache(line=line, **cache)
+        lines = [
+            f"{self.count} accesses ({self.dropped} dropped), "
+            f"{len(self.nests)} loop nests, cache miss rate "
+            f"{stats.miss_rate:.1%}"
+        ]
+        streams = itertools.groupby(self.streams(), lambda s: s.nest)
+        for nid, group in streams:
+            nest = self.nests[nid]
+            (hits, misses) = stats.by_nest.get(nid, (0, 0))
+            rate = misses / (hits + misses) if hits + misses else 0.0
+            lines.append(
+                f"nest {nid} {nest.dims} at {nest.site}: miss rate {rate:.1%}"
+            )
+            for s in group:
+                flag = "  <- against stride" if s.against_stride else ""
+                lines.append(
+                    f"  {'W' if s.write else 'R'}{s.slot:<3} {s.kind:<10}"
+                    f"inner {s.inner_stride!s:>7}  outer {s.outer_stride!s:>7}"
+                    f"  {s.owner}{flag}"
+                )
+        hist = self.reuse_distances(line)
+        lines.append(
+            f"reuse distance (lines of {line} bytes): cold {hist.cold}, "
+            + ", ".join(f"<{k}: {v}" for k, v in hist.buckets.items())
+        )
+        lines.extend(self.warnings())
+        return "\n".join(lines)
+
+    def close(self) -> None:
+        """Stop recording; the records stay available."""
+        self._closed = True
+        self._active.clear()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _mul(i: int, s: int) -> int:
+    return i * s
+
+
+def _access(fields: tuple) -> Access:
+    (address, iteration, nest, slot, flags, itemsize) = fields
+    return Access(address, iteration, nest, slot, bool(flags & _WRITE),
+                  itemsize)
+
+
+def _dominant(deltas: collections.Counter) -> int | None:
+    if not deltas:
+        return None
+    [(delta, _)] = deltas.most_common(1)
+    return delta
+
+
+def _classify(
+    deltas: collections.Counter, stride: int | None, itemsize: int,
+    line: int = 64,
+) -> str:
+    if stride is None:
+        return "irregular"
+    if deltas[stride] < 0.9 * sum(deltas.values()):
+        return "irregular"
+    if stride == 0:
+        return "invariant"
+    if abs(stride) == itemsize:
+        return "unit"
+    if abs(stride) < line:
+        return "short"
+    return "long"
+
+
+@contextmanager
+def record(
+    capacity: int = 1 << 20, path=None
+) -> _tp.Iterator[AccessTrace]:
+    """Record the element accesses of the current memory system while the
+    block runs; yields the `AccessTrace`.
+
+    Keeps the last `capacity` accesses in memory, or every access in the
+    file at `path`.
+    """
+    trace = AccessTrace(capacity, path)
+    if trace.path is not None:
+        trace._file = open(trace.path, "wb")
+    memsys = vm.get_memory_system()
+    saved = {name: memsys.__dict__.get(name) for name in ("read", "write")}
+    nest_methods = {"__iter__": LoopNestAPI.__iter__,
+                    "stream": LoopNestAPI.stream}
+    read = memsys.read
+    write = memsys.write
+
+    def traced_read(memref, indices):
+        trace._log(memref, indices, False)
+        return read(memref, indices)
+
+    def traced_write(memref, indices, value):
+        trace._log(memref, indices, True)
+        return write(memref, indices, value)
+
+    def traced_iter(self):
+        return trace._walk(self, nest_methods["__iter__"](self),
+                           sys._getframe(1))
+
+    def traced_stream(self, as_intp=False):
+        return trace._walk(self, nest_methods["stream"](self, as_intp),
+                           sys._getframe(1))
+
+    setattr(memsys, "read", traced_read)
+    setattr(memsys, "write", traced_write)
+    setattr(LoopNestAPI, "__iter__", traced_iter)
+    setattr(LoopNestAPI, "stream", traced_stream)
+    try:
+        yield trace
+    finally:
+        for name, fn in nest_methods.items():
+            setattr(LoopNestAPI, name, fn)
+        for name, method in saved.items():
+            if method is None:
+                delattr(memsys, name)
+            else:
+                setattr(memsys, name, method)
+        trace.close()
@@ -1,15 +1,19 @@
 from __future__ import annotations
 
 import itertools
+import operator
+import os
 
 
 class LoopNestAPI:
-    dim: tuple[int, ...]
+    dim: int
     inner: LoopNestAPI | None
+    _dims: tuple[int, ...] | None
 
     def __init__(self, dim, inner=None):
         self.dim = dim
         self.inner = inner
+        self._dims = None
 
     @staticmethod
     def from_tuple(args):
@@ -21,20 +25,165 @@ class LoopNestAPI:
         return expand(*args)
 
     def __iter__(self):
-        dims = self.get_dims()
-        return iter(itertools.product(*map(lambda x: list(range(x)), dims)))
+        return itertools.product(*map(range, self._get_dims()))
 
     def get_dims(self):
-        if self.inner is None:
-            return [self.dim]
-        else:
-            return [self.dim] + self.inner.get_dims()
+        return list(self._get_dims())
 
-    def reduce(self, fn, init):
-        res = init
+    def _get_dims(self) -> tuple[int, ...]:
+        # Walk the `inner` chain once and remember the extents as ints.
+        if self._dims is None:
+            dims = []
+            nest: LoopNestAPI | None = self
+            while nest is not None:
+                dims.append(operator.index(nest.dim))
+                nest = nest.inner
+            self._dims = tuple(dims)
+        return self._dims
+
+    def stream(self, as_intp=False):
+        """Yield the index tuples in row-major order without materializing
+        anything beyond the current index.
+
+        With `as_intp=True` the tuples hold `intp` values, ready to pass to
+        `memref.load`/`store`.
+        """
+        dims = self._get_dims()
+        if 0 in dims:
+            return
+        if as_intp:
+            from mcl.machine_types import intp
+        idx = [0] * len(dims)
+        while True:
+            yield tuple(map(intp, idx)) if as_intp else tuple(idx)
+            k = len(dims) - 1
+            while k >= 0:
+                idx[k] += 1
+                if idx[k] < dims[k]:
+                    break
+                idx[k] = 0
+                k -= 1
+            else:
+                return
+
+    def offsets(self, strides, base=0):
+        """Yield the flat offsets `base + sum(i * s)` of the indices in
+        row-major order, without building index tuples for the innermost
+        dimension.
+        """
+        dims = self._get_dims()
+        strides = tuple(map(operator.index, strides))
+        base = operator.index(base)
+        *outer_dims, n = dims
+        *outer_strides, s = strides
+        for outer in itertools.product(*map(range, outer_dims)):
+            off = base + sum(map(operator.mul, outer, outer_strides))
+            if s == 0:
+                yield from itertools.repeat(off, n)
+            else:
+                yield from range(off, off + n * s, s)
+
+    def tiles(self, block):
+        """Yield `(origin, extent)` of each tile in row-major tile order.
+
+        `block` gives the tile sizes of the innermost `len(block)`
+        dimensions; the outer dimensions are tiled by 1. Edge tiles are
+        clipped to the nest.
+        """
+        dims = self._get_dims()
+        block = tuple(map(operator.index, block))
+        if len(block) > len(dims):
+            raise ValueError("block has more dimensions than the loop nest")
+        if any(b <= 0 for b in block):
+            raise ValueError("block sizes must be positive")
+        block = (1,) * (len(dims) - len(block)) + block
+        starts = [range(0, d, b) for d, b in zip(dims, block)]
+        for origin in itertools.product(*starts):
+            extent = tuple(
+                min(b, d - o) for o, b, d in zip(origin, block, dims)
+            )
+            yield origin, extent
+
+    def tiled(self, block):
+        """Yield the index tuples tile by tile (see `tiles`), for
+        cache-friendly traversal of large nests.
+        """
+        for origin, extent in self.tiles(block):
+            yield from itertools.product(
+                *[range(o, o + e) for o, e in zip(origin, extent)]
+            )
+
+    def parallel_for(self, body, workers=None, args=(), executor=None,
+                     chunks=None):
+        """Call `body(idx, *args)` for every index of the nest in a pool of
+        worker processes.
+
+        The outer dimension is split into `chunks` contiguous chunks (by
+        default `workers`, or the number of usable CPUs), one task per
+        chunk. Allocations reachable from `args` are moved to shared memory
+        first, so stores made by `body` are visible here afterwards. `body`
+        must be picklable (a module-level function). Pass an `executor` to
+        reuse a pool across calls.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        from mcl import vm
+
+        dims = self._get_dims()
+        if 0 in dims:
+            return
+        vm.share_buffers(*args)
+        if chunks is None:
+            chunks = workers or _cpu_count()
+        if executor is None:
+            with ProcessPoolExecutor(workers) as pool:
+                return self.parallel_for(
+                    body, args=args, executor=pool, chunks=chunks
+                )
+        nchunks = max(1, chunks)
+        (n, *inner) = dims
+        step = -(-n // nchunks)
+        futures = [
+            executor.submit(
+                _run_chunk, body, range(lo, min(lo + step, n)), inner, args
+            )
+            for lo in range(0, n, step)
+        ]
+        for f in futures:
+            f.result()
+
+    def reduce(self, fn, init, axis=None):
+        """Fold `fn(acc, idx)` over the nest in row-major order.
+
+        With `axis` (a tuple of dimensions) only those dimensions are folded:
+        the result is a list with one accumulator per index of the remaining
+        dimensions, in row-major order.
+        """
+        if axis is None:
+            res = init
+            for idx in self:
+                res = fn(res, idx)
+            return res
+
+        dims = self._get_dims()
+        kept = ShapeAPI(range(len(dims))).deselect(axis).to_tuple()
+        # One accumulator per kept index, also when a folded extent is 0.
+        results = dict.fromkeys(
+            itertools.product(*(range(dims[i]) for i in kept)), init
+        )
         for idx in self:
-            res = fn(res, idx)
-        return res
+            key = tuple([idx[i] for i in kept])
+            results[key] = fn(results[key], idx)
+        return list(results.values())
+
+
+def _cpu_count() -> int:
+    count = getattr(os, "process_cpu_count", os.cpu_count)()
+    return count or 1
+
+
+def _run_chunk(body, outer, inner, args):
+    for idx in itertools.product(outer, *map(range, inner)):
+        body(idx, *args)
 
 
 class ShapeAPI:
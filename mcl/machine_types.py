@@ -7,7 +7,7 @@ from mcl.vm import machine_op, machine_type, struct_type
 T = _tp.TypeVar("T")
 
 
-@machine_type(builtin=True, final=True)
+@machine_type(builtin=True, final=True, layout="i")
 class i32:
     __machine_repr__ = "i32"
 
@@ -24,7 +24,7 @@ class i32:
             return NotImplemented
 
 
-@machine_type(builtin=True, final=True)
+@machine_type(builtin=True, final=True, layout="q")
 class i64:
     __machine_repr__ = "i64"
 
@@ -41,7 +41,7 @@ class i64:
             return NotImplemented
 
 
-@machine_type(builtin=True, final=True)
+@machine_type(builtin=True, final=True, layout="n", intern=True)
 class intp:
     __machine_repr__ = "intptr"
 
@@ -89,14 +89,153 @@ class intp:
         return machine_op("cast", int, self)
 
 
+@machine_type(builtin=True, final=True, layout="f")
+class f32:
+    __machine_repr__ = "f32"
+
+    def __add__(self, other) -> f32:
+        if type(other) is f32:
+            return machine_op("float_add", f32, self, other)
+        else:
+            return NotImplemented
+
+    def __sub__(self, other) -> f32:
+        if type(other) is f32:
+            return machine_op("float_sub", f32, self, other)
+        else:
+            return NotImplemented
+
+    def __mul__(self, other) -> f32:
+        if type(other) is f32:
+            return machine_op("float_mul", f32, self, other)
+        else:
+            return NotImplemented
+
+    def __truediv__(self, other) -> f32:
+        if type(other) is f32:
+            return machine_op("float_truediv", f32, self, other)
+        else:
+            return NotImplemented
+
+    def __eq__(self, other) -> bool:
+        if type(other) is f32:
+            return machine_op("float_eq", bool, self, other)
+        else:
+            return NotImplemented
+
+    def __lt__(self, other) -> bool:
+        if type(other) is f32:
+            return machine_op("float_lt", bool, self, other)
+        else:
+            return NotImplemented
+
+
+@machine_type(builtin=True, final=True, layout="d")
+class f64:
+    __machine_repr__ = "f64"
+
+    def __add__(self, other) -> f64:
+        if type(other) is f64:
+            return machine_op("float_add", f64, self, other)
+        else:
+            return NotImplemented
+
+    def __sub__(self, other) -> f64:
+        if type(other) is f64:
+            return machine_op("float_sub", f64, self, other)
+        else:
+            return NotImplemented
+
+    def __mul__(self, other) -> f64:
+        if type(other) is f64:
+            return machine_op("float_mul", f64, self, other)
+        else:
+            return NotImplemented
+
+    def __truediv__(self, other) -> f64:
+        if type(other) is f64:
+            return machine_op("float_truediv", f64, self, other)
+        else:
+            return NotImplemented
+
+    def __eq__(self, other) -> bool:
+        if type(other) is f64:
+            return machine_op("float_eq", bool, self, other)
+        else:
+            return NotImplemented
+
+    def __lt__(self, other) -> bool:
+        if type(other) is f64:
+            return machine_op("float_lt", bool, self, other)
+        else:
+            return NotImplemented
+
+
 @machine_type(builtin=True, final=True)
 class memref[T]:
     __machine_repr__ = "memref"
 
+    if _tp.TYPE_CHECKING:
+
+        def __init__(self, v): ...
+
     @classmethod
     def alloc(cls, shape: tuple[intp, ...], type: _tp.Type[T]) -> memref[T]:
         return machine_op("memref_alloc", memref, shape, type)
 
+    @classmethod
+    def alloc_mapped(
+        cls,
+        shape: tuple[intp, ...],
+        type: _tp.Type[T],
+        path: str | None = None,
+    ) -> memref[T]:
+        """Allocate backed by a memory mapping of the file at `path`, or an
+        anonymous mapping if `path` is None. `free` closes the mapping.
+        """
+        return machine_op("memref_alloc_mapped", memref, shape, type, path)
+
+    @classmethod
+    def map_file(
+        cls,
+        path: str,
+        shape: tuple[intp, ...],
+        type: _tp.Type[T],
+        offset: intp = intp(0),
+        order: str = "C",
+    ) -> memref[T]:
+        """Map the existing file at `path` holding the elements from byte
+        `offset` on, in row-major ("C") or column-major ("F") order.
+        """
+        return machine_op(
+            "memref_map_file", memref, path, shape, type, offset, order
+        )
+
+    @classmethod
+    def from_buffer(
+        cls,
+        buffer,
+        shape: tuple[intp, ...] | None = None,
+        type: _tp.Type[T] | None = None,
+        offset: intp = intp(0),
+    ) -> memref[T]:
+        """Adopt the writable, contiguous `buffer` as storage without
+        copying. `shape` and `type` default to the buffer's own.
+        """
+        return machine_op(
+            "memref_from_buffer", memref, buffer, shape, type, offset
+        )
+
+    def __buffer__(self, flags: int) -> memoryview:
+        """Zero-copy `memoryview(m)` of the elements (C-contiguous or 1-D
+        layouts).
+        """
+        return machine_op("memref_memoryview", memoryview, self)
+
+    @property
+    def __array_interface__(self) -> dict:
+        return machine_op("memref_array_interface", dict, self)
+
     @property
     def shape(self) -> tuple[intp, ...]:
         return machine_op("memref_shape", tuple, self)
@@ -109,14 +248,98 @@ class memref[T]:
     def offset(self) -> intp:
         return machine_op("memref_offset", tuple, self)
 
+    @property
+    def c_contiguous(self) -> bool:
+        return machine_op("memref_c_contiguous", bool, self)
+
+    @property
+    def f_contiguous(self) -> bool:
+        return machine_op("memref_f_contiguous", bool, self)
+
+    @property
+    def datatype(self) -> _tp.Type[T]:
+        return machine_op("memref_datatype", type, self)
+
     def copy(self) -> memref[T]:
         return machine_op("memref_copy", memref, self)
 
+    def elementwise(self, fn: _tp.Callable, *inputs: memref) -> None:
+        """Store `fn` applied to the elements of `inputs` into `self`.
+
+        `fn` takes and returns raw values; see `vm.elementwise_op`. Inputs
+        must already have the shape of `self`.
+        """
+        return machine_op("memref_elementwise", None, fn, self, *inputs)
+
+    def free(self) -> None:
+        """Release the allocation now. Only valid on the owner."""
+        return machine_op("memref_free", None, self)
+
+    def share(self) -> None:
+        """Move the allocation into shared memory so that it can be passed
+        to other processes without copying.
+        """
+        return machine_op("memref_share", None, self)
+
+    def flush(self) -> None:
+        """Write back a mapped allocation to its file."""
+        return machine_op("memref_flush", None, self)
+
     def store(self, indices: tuple[intp, ...], value: T) -> None:
         return machine_op("memref_store", None, self, indices, value)
 
     def load(self, indices: tuple[intp, ...], restype: _tp.Type[T]) -> T:
         return machine_op("memref_load", restype, self, indices)
 
+    def load_block(
+        self, start: tuple[intp, ...], shape: tuple[intp, ...]
+    ) -> bytes:
+        """Load the block `[start, start + shape)` as packed row-major bytes.
+        """
+        return machine_op("memref_load_block", bytes, self, start, shape)
+
+    def store_block(
+        self,
+        start: tuple[intp, ...],
+        shape: tuple[intp, ...],
+        data: bytes | bytearray,
+    ) -> None:
+        """Store packed row-major bytes into the block `[start, start + shape)`.
+        """
+        return machine_op(
+            "memref_store_block", None, self, start, shape, data
+        )
+
+    def assign(self, source: memref[T]) -> None:
+        """Copy the elements of `source`, a memref of the same shape and
+        datatype; overlapping views are fine.
+        """
+        return machine_op("memref_assign", None, self, source)
+
+    def fill(self, value: T) -> None:
+        """Store `value` to every element."""
+        return machine_op("memref_fill", None, self, value)
+
+    def gather(self, indices: _tp.Sequence[tuple[int, ...]]) -> bytes:
+        """Load the elements at each index tuple (plain ints, in bounds) as
+        packed bytes.
+        """
+        return machine_op("memref_gather", bytes, self, indices)
+
+    def take(self, offsets: _tp.Sequence[int]) -> bytes:
+        """Load the whole memref moved by each offset (plain ints, in
+        elements) as packed bytes, one block after another. Every moved copy
+        must lie within the owner's elements, or IndexError is raised.
+        """
+        return machine_op("memref_take", bytes, self, offsets)
+
+    def scatter(
+        self, indices: _tp.Sequence[tuple[int, ...]], data: bytes
+    ) -> None:
+        """Store packed bytes to the elements at each index tuple (plain ints,
+        in bounds).
+        """
+        return machine_op("memref_scatter", None, self, indices, data)
+
     def view(self, shape: tuple[intp, ...], strides: tuple[intp, ...], offset: intp) -> memref[T]:
         return machine_op("memref_view", memref, self, shape, strides, offset)
@@ -1,11 +1,24 @@
 from __future__ import annotations
 
+import ast
+import math
+import os
+import struct
+import sys
 import typing as _tp
+from contextlib import contextmanager
 
 from mcl.builtins import tuple_cast
-from mcl.machine_types import i32, intp, memref
-from mcl.vm import struct_type
-from mcl.dialects import LoopNestAPI
+from mcl.machine_types import f32, f64, i32, i64, intp, memref
+from mcl.vm import (
+    _chunks,
+    _get_machine_value,
+    elementwise_op,
+    fuse_elementwise,
+    layout_of,
+    struct_type,
+)
+from mcl.dialects import LoopNestAPI, ShapeAPI
 
 
 @struct_type()
@@ -22,7 +35,9 @@ class Generic:
 
 @struct_type()
 class Number(Generic):
-    pass
+    if _tp.TYPE_CHECKING:
+        # Every concrete number has a machine `value` field.
+        value: _tp.Any
 
 
 @struct_type()
@@ -50,6 +65,59 @@ class Int32(Integer):
         return NotImplemented
 
 
+@struct_type()
+class Int64(Integer):
+    value: i64
+
+    @classmethod
+    def from_memory(cls, data: memref, index: tuple[intp, ...]) -> Int64:
+        return cls(value=data.load(index, i64))
+
+    def __eq__(self, other) -> bool:
+        if type(other) is i64:
+            return self.value == other
+        elif isinstance(other, Int64):
+            return self.value == other.value
+        return NotImplemented
+
+
+@struct_type()
+class Floating(Number):
+    pass
+
+
+@struct_type()
+class Float32(Floating):
+    value: f32
+
+    @classmethod
+    def from_memory(cls, data: memref, index: tuple[intp, ...]) -> Float32:
+        return cls(value=data.load(index, f32))
+
+    def __eq__(self, other) -> bool:
+        if type(other) is f32:
+            return self.value == other
+        elif isinstance(other, Float32):
+            return self.value == other.value
+        return NotImplemented
+
+
+@struct_type()
+class Float64(Floating):
+    value: f64
+
+    @classmethod
+    def from_memory(cls, data: memref, index: tuple[intp, ...]) -> Float64:
+        return cls(value=data.load(index, f64))
+
+    def __eq__(self, other) -> bool:
+        if type(other) is f64:
+            return self.value == other
+        elif isinstance(other, Float64):
+            return self.value == other.value
+        return NotImplemented
+
+
 @struct_type(final=True)
 class Array[T]:
     dtype: DType
@@ -67,51 +135,53 @@ class Array[T]:
     def ndim(self) -> intp:
         return intp(len(self.shape))
 
-    def __setitem__(self, idx: _Indices, value: T):
+    def _full_index(self, idx: _Indices) -> tuple:
+        # Expand `...` and pad missing trailing dimensions with full slices.
         if not isinstance(idx, tuple):
             idx = (idx,)
+        nfill = len(self.shape) - len(idx)
+        # Compare by identity: `==` on index arrays is elementwise.
+        ellipses = [k for k, i in enumerate(idx) if i is Ellipsis]
+        if len(ellipses) > 1:
+            raise IndexError("an index can only have a single ellipsis")
+        if ellipses:
+            k = ellipses[0]
+            idx = idx[:k] + (slice(None),) * (nfill + 1) + idx[k + 1:]
+        elif nfill > 0:
+            idx = idx + (slice(None),) * nfill
+        return idx
 
-        if len(idx) < len(self.shape):
-            idx = idx + (slice(None),) * (len(self.shape) - len(idx))
+    def __setitem__(self, idx: _Indices, value: T):
+        idx = self._full_index(idx)
 
         if any(isinstance(i, Array) for i in idx):
             raise ValueError("Array indexing is not supported in setitem")
         elif any(isinstance(i, slice) for i in idx):
             array_view = self.__getitem__(idx)
-            if isinstance(value, Array):
+            if isinstance(value, Expr):
                 if array_view.shape != value.shape:
                     raise ValueError("Shapes do not match")
-                for idx_ in LoopNestAPI.from_tuple(array_view.shape):
-                    array_view[idx_] = value[idx_]
+                value.materialize(out=array_view)
+            elif isinstance(value, Array):
+                if array_view.shape != value.shape:
+                    raise ValueError("Shapes do not match")
+                array_view.data.assign(value.data)
             else:
-                if isinstance(value, Integer):
+                if isinstance(value, Number):
                     value = value.value
-                for idx in LoopNestAPI.from_tuple(array_view.shape):
-                    array_view[idx] = value
+                array_view.data.fill(value)
         else:
             idx = tuple_cast(intp, idx)
             # TODO: There's no assertion that checks if idx is within bounds.
-            if isinstance(value, Integer):
+            if isinstance(value, Number):
                 value = value.value
             self.data.store(idx, value)
 
     def __getitem__(self, idx: _Indices) -> Array[T] | Generic:
-        if not isinstance(idx, tuple):
-            idx = (idx,)
-
-        if len(idx) < len(self.shape):
-            idx = idx + (slice(None),) * (len(self.shape) - len(idx))
+        idx = self._full_index(idx)
 
         if self.is_advanced(idx):
-            res_shape, subspace_shape, subspace_offset = self.fancy_shape(idx)
-            new_memref = memref.alloc(res_shape, i32)
-            res_array = Array(dtype=self.dtype, data=new_memref)
-
-            for _idx in LoopNestAPI.from_tuple(subspace_shape):
-                res_idx = tuple([slice(None)] * subspace_offset + list(_idx))
-                array_idx = tuple([i if isinstance(i, (int, slice)) else intp(i[_idx].value) for i in idx])
-                res_array[*res_idx] = self[*array_idx]
-            return res_array
+            return self.take(idx)
         elif any(isinstance(i, slice) for i in idx):
             if any(isinstance(i, Array) for i in idx):
                 raise ValueError("Singular array indexing is not supported")
@@ -124,6 +194,70 @@ class Array[T]:
             # TODO: There's no assertion that checks if idx is within bounds.
             return self.dtype.type.from_memory(self.data, idx)
 
+    def take(self, idx: tuple) -> Array[T]:
+        """Advanced indexing: gather the blocks selected by the index arrays
+        in `idx` into a new array of the same dtype.
+
+        The index arrays are read in bulk and broadcast together; the source
+        offset of each selected block is computed from them, and all blocks
+        of the sliced dimensions are copied in one `memref.take`.
+        """
+        _, subspace_shape, subspace_offset = self.fancy_shape(idx)
+        nsub = math.prod(map(int, subspace_shape))
+        itemsize = int(layout_of(self.data.datatype).size)
+        offsets = [0] * nsub
+        for i, idx_ in enumerate(idx):
+            if not isinstance(idx_, Array):
+                continue
+            n = int(self.shape[i])
+            # in elements, as `memref.take` expects
+            stride = int(self.strides[i]) // itemsize
+            values = idx_._broadcast_view(subspace_shape)._index_values(n)
+            offsets = [o + v * stride for o, v in zip(offsets, values)]
+
+        # The sliced dimensions form a block read once per selected offset.
+        block_shape, block_strides, block_offset = self.new_arrayinfo(
+            tuple(0 if isinstance(i, Array) else i for i in idx)
+        )
+        block = self.data.view(block_shape, block_strides, block_offset)
+        datatype = self.data.datatype
+        out_shape = tuple(subspace_shape) + block_shape
+        out = memref.alloc(out_shape, datatype)
+        out.store_block(
+            tuple(intp(0) for _ in out_shape), out_shape, block.take(offsets)
+        )
+        if subspace_offset > 0:
+            # The subspace dimensions go after the leading sliced ones.
+            nsub_dims = len(subspace_shape)
+            strides = out.strides
+            perm = (
+                list(range(nsub_dims, nsub_dims + subspace_offset))
+                + list(range(nsub_dims))
+                + list(range(nsub_dims + subspace_offset, len(out_shape)))
+            )
+            out = out.view(
+                tuple(out_shape[k] for k in perm),
+                tuple(strides[k] for k in perm),
+                out.offset,
+            )
+        return Array(dtype=self.dtype, data=out)
+
+    def _index_values(self, n: int) -> list[int]:
+        """The elements of an integer index array as ints, checked against a
+        dimension of length `n`; negative values count from the end.
+        """
+        if not issubclass(self.dtype.type, Integer):
+            raise IndexError("arrays used as indices must be of integer type")
+        shape = self.shape
+        values = layout_of(self.data.datatype).unpack_many(
+            self.data.load_block(tuple(intp(0) for _ in shape), shape)
+        )
+        if values and (min(values) < -n or max(values) >= n):
+            raise IndexError(f"index out of bounds for dimension of size {n}")
+        if values and min(values) < 0:
+            values = [v + n if v < 0 else v for v in values]
+        return values
+
     def broadcast_to(self, shape: tuple[intp, ...]) -> None:
         # This function can also serve as a assertion
         new_shape = self.broadcast_shapes(self.shape, shape)
@@ -144,6 +278,188 @@ class Array[T]:
 
         self.data = self.data.view(new_shape, new_strides, self.data.offset)
 
+    def apply(
+        self, binary_op: str | _tp.Callable, other, out: Array | None = None
+    ) -> Array:
+        """Elementwise `binary_op(self, other)` with broadcasting.
+
+        `binary_op` is the name of an arithmetic or comparison machine op
+        (e.g. "int_add") or a function on raw values. `other` is an Array or
+        a scalar of the same dtype. Comparison results are stored as 1/0 in
+        the operand dtype. The result is written to `out` if given.
+        """
+        if isinstance(binary_op, str):
+            binary_op = elementwise_op(binary_op)
+        other = self._as_operand(other)
+        shape = self.broadcast_shapes(self.shape, other.shape)
+        if out is None:
+            out = Array(
+                dtype=self.dtype,
+                data=memref.alloc(shape, self.data.datatype),
+            )
+        elif out.shape != shape:
+            raise ValueError("out does not have the broadcast shape")
+        lhs = self._broadcast_view(shape)
+        rhs = other._broadcast_view(shape)
+        out.data.elementwise(binary_op, lhs.data, rhs.data)
+        return out
+
+    def _as_operand(self, other) -> Array:
+        if isinstance(other, Number):
+            other = other.value
+        if not isinstance(other, Array):
+            if type(other) is not self.data.datatype:
+                raise TypeError("operands must have the same dtype")
+            scalar = memref.alloc((intp(1),), type(other))
+            scalar.store((intp(0),), other)
+            other = Array(dtype=self.dtype, data=scalar)
+        if other.dtype.type is not self.dtype.type:
+            raise TypeError("operands must have the same dtype")
+        return other
+
+    def _broadcast_view(self, shape: tuple[intp, ...]) -> Array:
+        if self.shape == shape:
+            return self
+        view: Array = Array(dtype=self.dtype, data=self.data)
+        view.broadcast_to(shape)
+        return view
+
+    def _elementwise_opname(self, name: str) -> str:
+        if issubclass(self.dtype.type, Integer):
+            return f"int_{name}"
+        return f"float_{name}"
+
+    def lazy(self) -> Expr:
+        """Start a deferred expression over this array (see `Expr`)."""
+        return Expr(
+            ("array", self), self.shape, self.dtype, self.data.datatype
+        )
+
+    def _binary(self, name: str, other) -> Array | Expr:
+        if _deferred or isinstance(other, Expr):
+            return self.lazy()._binary(name, other)
+        return self.apply(self._elementwise_opname(name), other)
+
+    def __add__(self, other) -> Array | Expr:
+        return self._binary("add", other)
+
+    def __sub__(self, other) -> Array | Expr:
+        return self._binary("sub", other)
+
+    def __mul__(self, other) -> Array | Expr:
+        return self._binary("mul", other)
+
+    def __floordiv__(self, other) -> Array | Expr:
+        return self._binary("floordiv", other)
+
+    def __truediv__(self, other) -> Array | Expr:
+        return self._binary("truediv", other)
+
+    def __eq__(self, other) -> Array | Expr:
+        """Elementwise `==`, giving an Array of 0 and 1 like NumPy.
+
+        It is not a truth value: `a == b` does not tell whether two Arrays
+        are the same object, and `in` and `list.index` over Arrays compare
+        elements. Compare identity with `is`.
+        """
+        return self._binary("eq", other)
+
+    def __ne__(self, other) -> Array | Expr:
+        return self._binary("ne", other)
+
+    # `==` is elementwise, so Arrays cannot be dict keys or set members.
+    __hash__ = None
+
+    def __bool__(self) -> bool:
+        raise ValueError(
+            "the truth value of an Array is ambiguous; use a.any() or a.all()"
+        )
+
+    def __lt__(self, other) -> Array | Expr:
+        return self._binary("lt", other)
+
+    def sum(self, axis=None, keepdims=False, pairwise=False):
+        """Sum over `axis` (an int, a tuple of ints or None for all axes).
+
+        Elements are added in row-major order of the reduced axes.
+        `pairwise=True` uses pairwise summation instead, which bounds the
+        rounding error of long floating-point axes.
+        """
+        fold = _pairwise_sum if pairwise else sum
+        return self._reduce(fold, axis, keepdims)
+
+    def prod(self, axis=None, keepdims=False):
+        return self._reduce(math.prod, axis, keepdims)
+
+    def min(self, axis=None, keepdims=False):
+        return self._reduce(min, axis, keepdims)
+
+    def max(self, axis=None, keepdims=False):
+        return self._reduce(max, axis, keepdims)
+
+    def any(self, axis=None, keepdims=False):
+        """Logical or over `axis`. Axis results are stored as 1/0."""
+        return self._reduce(any, axis, keepdims, scalar=bool)
+
+    def all(self, axis=None, keepdims=False):
+        """Logical and over `axis`. Axis results are stored as 1/0."""
+        return self._reduce(all, axis, keepdims, scalar=bool)
+
+    def _reduce(self, fold, axis, keepdims, scalar=None):
+        # Reorder the axes as a view, kept axes first, so that each result
+        # folds one contiguous run of the packed row-major elements. Blocks
+        # of many results are loaded per call.
+        ndim = len(self.shape)
+        axes = _normalize_axis(axis, ndim)
+        kept_shape = ShapeAPI(self.shape).deselect(axes).to_tuple()
+        red_shape = ShapeAPI(self.shape).select(axes).to_tuple()
+        perm_strides = (ShapeAPI(self.strides).deselect(axes).to_tuple()
+                        + ShapeAPI(self.strides).select(axes).to_tuple())
+        view = self.data.view(
+            kept_shape + red_shape, perm_strides, self.data.offset
+        )
+        datatype = self.data.datatype
+        layout = layout_of(datatype)
+
+        outer = tuple(map(int, kept_shape))
+        run = math.prod(map(int, red_shape))
+        nout = math.prod(outer)
+        if run == 0 or nout == 0:
+            results = [fold(())] * nout
+        else:
+            results = []
+            for start, block in _reduce_blocks(
+                outer + tuple(map(int, red_shape)), len(outer)
+            ):
+                values = layout.unpack_many(
+                    view.load_block(
+                        tuple_cast(intp, start), tuple_cast(intp, block)
+                    )
+                )
+                results.extend(
+                    fold(values[i : i + run])
+                    for i in range(0, len(values), run)
+                )
+
+        if keepdims:
+            out_shape = tuple(
+                intp(1) if i in axes else self.shape[i] for i in range(ndim)
+            )
+        elif not kept_shape:
+            [res] = results
+            if scalar is not None:
+                return scalar(res)
+            return self.dtype.type(value=datatype(res))
+        else:
+            out_shape = kept_shape
+        out = memref.alloc(out_shape, datatype)
+        out.store_block(
+            tuple(intp(0) for _ in out_shape),
+            out_shape,
+            layout.pack_many(results),
+        )
+        return Array(dtype=self.dtype, data=out)
+
     @classmethod
     def is_advanced(cls, idx: _Indices) -> bool:
         return any((isinstance(i, Array) and i.ndim > intp(0)) for i in idx)
@@ -184,31 +500,14 @@ class Array[T]:
 
         res_shape = [intp(0)] * res_ndim
         res_strides = [intp(0)] * res_ndim
-        res_offset = intp(0)
+        res_offset = self.data.offset
 
         curr_idx = 0
         for i, idx_ in enumerate(idx):
             if isinstance(idx_, slice):
-                if idx_.step is not None:
-                    raise ValueError("Slicing with step is not supported")
-                
-                if idx_.start is not None and idx_.start < 0:
-                    raise ValueError("Negative slicing is not supported")
-                
-                if idx_.stop is not None and idx_.stop < 0:
-                    raise ValueError("Negative slicing is not supported")
-                
-                if idx_.start is None:
-                    idx_start = intp(0)
-                else:
-                    idx_start = intp(idx_.start)
-                
-                if idx_.stop is None:
-                    idx_stop = self.shape[i]
-                else:
-                    idx_stop = intp(idx_.stop)
-                res_shape[curr_idx] = idx_stop - idx_start
-                res_strides[curr_idx] = self.strides[i]
+                idx_start, length, step = _slice_info(idx_, self.shape[i])
+                res_shape[curr_idx] = length
+                res_strides[curr_idx] = self.strides[i] * step
                 res_offset += idx_start * self.strides[i]
                 curr_idx += 1
             elif isinstance(idx_, (int, intp)):
@@ -226,31 +525,21 @@ class Array[T]:
         slice_shapes = []
 
         for i, idx_ in enumerate(idx):
-            if isinstance(idx_, (int, intp)):
+            # Integers next to index arrays are advanced indices too: a run
+            # of them forms one subspace, placed after the slices before it.
+            if isinstance(idx_, (int, intp, Array)):
                 res_ndim -= intp(1)
-                in_subspace = False
-                if subspace_offset <= 0:
-                    subspace_offset -= 1
-            elif isinstance(idx_, Array):
                 if not in_subspace:
                     in_subspace = True
                     num_subspaces += 1
-                if subspace_offset <= 0:
-                    subspace_offset += i
-                res_ndim -= intp(1)
-                array_shapes.append(idx_.shape)
+                    if num_subspaces == 1:
+                        subspace_offset = num_slices
+                if isinstance(idx_, Array):
+                    array_shapes.append(idx_.shape)
             elif isinstance(idx_, slice):
                 num_slices += 1
                 in_subspace = False
-                if idx_.start is None:
-                    idx_start = intp(0)
-                else:
-                    idx_start = intp(idx_.start)
-                if idx_.stop is None:
-                    idx_stop = self.shape[i]
-                else:
-                    idx_stop = intp(idx_.stop)
-                slice_shapes.append(idx_stop - idx_start)
+                slice_shapes.append(_slice_info(idx_, self.shape[i])[1])
             else:
                 raise ValueError("Invalid index")
 
@@ -266,8 +555,456 @@ class Array[T]:
     def copy(self) -> Array[T]:
         return Array(dtype=self.dtype, data=self.data.copy())
 
+    def transpose(self, *axes: int) -> Array[T]:
+        """A view with the dimensions permuted by `axes` (reversed by
+        default).
+        """
+        ndim = len(self.shape)
+        if len(axes) == 1 and isinstance(axes[0], tuple):
+            axes = axes[0]
+        if not axes:
+            axes = tuple(reversed(range(ndim)))
+        axes = tuple(int(a) + ndim if int(a) < 0 else int(a) for a in axes)
+        if sorted(axes) != list(range(ndim)):
+            raise ValueError("axes don't match array")
+        shape = self.shape
+        strides = self.strides
+        new_memref = self.data.view(
+            tuple(shape[a] for a in axes),
+            tuple(strides[a] for a in axes),
+            self.data.offset,
+        )
+        return Array(dtype=self.dtype, data=new_memref)
+
+    def reshape(self, *shape: _IntLike) -> Array[T]:
+        """The elements in row-major order with a new `shape`; one dimension
+        may be -1.
+
+        A view when the layout allows it (always for contiguous arrays),
+        otherwise a bulk copy.
+        """
+        if len(shape) == 1 and isinstance(shape[0], tuple):
+            shape = shape[0]
+        size = math.prod(map(int, self.shape))
+        new_shape = _infer_shape(tuple(map(int, shape)), size)
+        data = self.data
+        strides = _reshape_strides(
+            tuple(map(int, self.shape)), tuple(map(int, self.strides)),
+            new_shape, int(layout_of(data.datatype).size),
+        )
+        if strides is None:
+            data = data.copy()
+            strides = _reshape_strides(
+                tuple(map(int, self.shape)), tuple(map(int, data.strides)),
+                new_shape, int(layout_of(data.datatype).size),
+            )
+            assert strides is not None
+        new_memref = data.view(
+            tuple(map(intp, new_shape)), tuple(map(intp, strides)),
+            data.offset,
+        )
+        return Array(dtype=self.dtype, data=new_memref)
+
+    def ravel(self) -> Array[T]:
+        """The elements in row-major order as a 1-D view, or a copy if the
+        layout needs one.
+        """
+        return self.reshape(-1)
+
+    def __buffer__(self, flags: int) -> memoryview:
+        return self.data.__buffer__(flags)
+
+    @property
+    def __array_interface__(self) -> dict:
+        return self.data.__array_interface__
+
+    def save(self, path: str | os.PathLike) -> None:
+        """Write the array to `path` in the NumPy `.npy` format (row-major,
+        native byte order).
+        """
+        datatype = self.data.datatype
+        if datatype not in _npy_descr:
+            raise TypeError(f"cannot save {datatype.__name__} to .npy")
+        shape = tuple(map(_get_machine_value, self.shape))
+        with open(path, "wb") as f:
+            f.write(_npy_header(_npy_descr[datatype], False, shape))
+            # rows are copied out in blocks, never element by element
+            for start, block in _chunks(shape, _NPY_CHUNK):
+                f.write(self.data.load_block(
+                    tuple(map(intp, start)), tuple(map(intp, block))
+                ))
+
+    @classmethod
+    def load(cls, path: str | os.PathLike, mmap: bool = True) -> Array:
+        """Open the `.npy` file at `path`.
+
+        With `mmap=True` the file is mapped read-write as the array's
+        storage, in its own (C or Fortran) order, and stores write through
+        to the file. Otherwise the file is only read, and the data is copied
+        into a new row-major allocation.
+        """
+        path = os.fspath(path)
+        with open(path, "rb") as f:
+            (descr, fortran, shape, offset) = _read_npy_header(f)
+            datatype = _npy_types.get(descr)
+            if datatype is None:
+                raise TypeError(f"unsupported .npy dtype {descr!r}")
+            if not mmap:
+                nbytes = math.prod(shape) * layout_of(datatype).size
+                f.seek(offset)
+                raw = bytearray(f.read(nbytes))
+                if len(raw) < nbytes:
+                    raise ValueError(f"{path} is too small for the data")
+        shape = tuple(map(intp, shape))
+        if mmap:
+            data = memref.map_file(
+                path, shape, datatype, intp(offset), "F" if fortran else "C"
+            )
+        elif fortran:
+            # column-major is row-major of the reversed shape
+            packed = memref.from_buffer(raw, shape[::-1], datatype)
+            data = packed.view(shape, packed.strides[::-1], intp(0)).copy()
+            packed.free()
+        else:
+            data = memref.alloc(shape, datatype)
+            data.store_block((intp(0),) * len(shape), shape, raw)
+        return Array(dtype=DType(_dtypes[datatype]), data=data)
+
     def print(self) -> None:
         res = []
         for idx in LoopNestAPI.from_tuple(self.shape):
             res.append(self[idx].value)
         print(res)
+
+    # Last in the class body: the name shadows the type parameter `T`.
+    T = property(transpose)
+
+
+def _slice_info(idx: slice, n: intp) -> tuple[intp, intp, intp]:
+    """The `(start, length, step)` of the slice `idx` of a dimension of
+    length `n`, with Python semantics for negative and omitted bounds.
+    """
+    start, stop, step = idx.indices(int(n))
+    return intp(start), intp(len(range(start, stop, step))), intp(step)
+
+
+def _infer_shape(shape: tuple[int, ...], size: int) -> tuple[int, ...]:
+    unknown = [k for k, n in enumerate(shape) if n == -1]
+    if len(unknown) > 1:
+        raise ValueError("can only specify one unknown dimension")
+    if any(n < -1 for n in shape):
+        raise ValueError("negative dimensions not allowed")
+    known = math.prod(n for n in shape if n != -1)
+    if unknown:
+        if known == 0 or size % known:
+            raise ValueError(f"cannot reshape array of size {size} into "
+                             f"shape {shape}")
+        shape = tuple(size // known if n == -1 else n for n in shape)
+    elif known != size:
+        raise ValueError(f"cannot reshape array of size {size} into "
+                         f"shape {shape}")
+    return shape
+
+
+def _reshape_strides(
+    old_shape: tuple[int, ...],
+    old_strides: tuple[int, ...],
+    new_shape: tuple[int, ...],
+    itemsize: int,
+) -> tuple[int, ...] | None:
+    """Strides viewing the row-major elements of a layout with `new_shape`,
+    or None if that needs a copy.
+
+    Groups of old dimensions are matched with groups of new dimensions of
+    the same total extent. Each old group must be contiguous within itself
+    (it is then split freely); strides between groups are kept.
+    """
+    if 0 in old_shape:
+        return _contiguous_strides(new_shape, itemsize)
+    dims = [(n, s) for n, s in zip(old_shape, old_strides) if n != 1]
+    new_strides = [0] * len(new_shape)
+    oi, oj, ni, nj = 0, 1, 0, 1
+    while ni < len(new_shape) and oi < len(dims):
+        np_, op = new_shape[ni], dims[oi][0]
+        while np_ != op:
+            if np_ < op:
+                np_ *= new_shape[nj]
+                nj += 1
+            else:
+                op *= dims[oj][0]
+                oj += 1
+        for k in range(oi, oj - 1):
+            if dims[k][1] != dims[k + 1][0] * dims[k + 1][1]:
+                return None
+        new_strides[nj - 1] = dims[oj - 1][1]
+        for k in range(nj - 1, ni, -1):
+            new_strides[k - 1] = new_strides[k] * new_shape[k]
+        ni, nj = nj, nj + 1
+        oi, oj = oj, oj + 1
+    # trailing dimensions of length 1
+    last = new_strides[ni - 1] if ni > 0 else itemsize
+    for k in range(ni, len(new_shape)):
+        new_strides[k] = last
+    return tuple(new_strides)
+
+
+def _contiguous_strides(
+    shape: tuple[int, ...], itemsize: int
+) -> tuple[int, ...]:
+    strides = []
+    last = itemsize
+    for n in reversed(shape):
+        strides.append(last)
+        last *= max(n, 1)
+    return tuple(reversed(strides))
+
+
+# The `.npy` type descriptions of the machine types, in native byte order.
+_npy_descr = {
+    typ: ("<" if sys.byteorder == "little" else ">") + code
+    for typ, code in [(i32, "i4"), (i64, "i8"), (f32, "f4"), (f64, "f8")]
+}
+_npy_types = {descr: typ for typ, descr in _npy_descr.items()}
+_dtypes = {i32: Int32, i64: Int64, f32: Float32, f64: Float64}
+
+_NPY_MAGIC = b"\x93NUMPY"
+
+# Elements per block written by `Array.save`.
+_NPY_CHUNK = 1 << 20
+
+
+def _npy_header(descr: str, fortran: bool, shape: tuple[int, ...]) -> bytes:
+    """The `.npy` preamble; the data that follows is 64-byte aligned."""
+    text = (
+        f"{{'descr': '{descr}', 'fortran_order': {fortran}, "
+        f"'shape': {shape!r}, }}"
+    )
+    for version, fmt in [(1, "<H"), (2, "<I")]:
+        prefix = len(_NPY_MAGIC) + 2 + struct.calcsize(fmt)
+        # pad with spaces to the alignment, ending in a newline
+        pad = -(prefix + len(text) + 1) % 64
+        header = (text + " " * pad + "\n").encode("latin1")
+        if len(header) < 1 << (8 * struct.calcsize(fmt)):
+            break
+    return (
+        _NPY_MAGIC + bytes([version, 0]) + struct.pack(fmt, len(header))
+        + header
+    )
+
+
+def _read_npy_header(f: _tp.BinaryIO) -> tuple[str, bool, tuple, int]:
+    """Parse the preamble of an `.npy` file.
+
+    Returns `(descr, fortran_order, shape, data_offset)`.
+    """
+    magic = f.read(len(_NPY_MAGIC) + 2)
+    if len(magic) < len(_NPY_MAGIC) + 2 or not magic.startswith(_NPY_MAGIC):
+        raise ValueError(f"not an .npy file: {f.name}")
+    version = magic[-2]
+    match version:
+        case 1:
+            fmt, encoding = "<H", "latin1"
+        case 2:
+            fmt, encoding = "<I", "latin1"
+        case 3:
+            fmt, encoding = "<I", "utf8"
+        case _:
+            raise ValueError(f"unsupported .npy version {version}")
+    (length,) = struct.unpack(fmt, f.read(struct.calcsize(fmt)))
+    try:
+        header = ast.literal_eval(f.read(length).decode(encoding))
+        descr = header["descr"]
+        fortran = header["fortran_order"]
+        shape = header["shape"]
+    except (SyntaxError, ValueError, KeyError, TypeError):
+        raise ValueError(f"invalid .npy header in {f.name}") from None
+    if (
+        not isinstance(descr, str)
+        or not isinstance(fortran, bool)
+        or not isinstance(shape, tuple)
+        or not all(type(n) is int and n >= 0 for n in shape)
+    ):
+        raise ValueError(f"invalid .npy header in {f.name}")
+    return descr, fortran, shape, f.tell()
+
+
+# Set by `deferred()`: Array operators build `Expr` graphs.
+_deferred = False
+
+
+@contextmanager
+def deferred():
+    """Within the block, arithmetic and comparison operators on Arrays return
+    `Expr` graphs instead of computing.
+    """
+    global _deferred
+    prev = _deferred
+    _deferred = True
+    try:
+        yield
+    finally:
+        _deferred = prev
+
+
+class Expr:
+    """A deferred elementwise expression over Arrays and scalars, with
+    broadcasting.
+
+    Nothing is computed until `materialize()` or assignment into an Array
+    (`a[...] = b + c * d`). The whole graph is then fused into one function
+    and evaluated in a single `memref.elementwise` pass, without temporary
+    arrays. Intermediate values are never stored, so integer intermediates
+    do not overflow; only the final result is range-checked.
+    """
+
+    node: tuple
+    shape: tuple[intp, ...]
+    dtype: DType
+    datatype: type
+
+    def __init__(self, node, shape, dtype, datatype):
+        self.node = node
+        self.shape = shape
+        self.dtype = dtype
+        self.datatype = datatype
+
+    def __repr__(self) -> str:
+        return f"Expr(shape={self.shape}, dtype={self.dtype})"
+
+    def _operand(self, other) -> Expr:
+        if isinstance(other, Array):
+            other = other.lazy()
+        elif isinstance(other, Number):
+            other = other.value
+        if not isinstance(other, Expr):
+            if type(other) is not self.datatype:
+                raise TypeError("operands must have the same dtype")
+            raw = _get_machine_value(other)
+            return Expr(("const", raw), (), self.dtype, self.datatype)
+        if other.dtype.type is not self.dtype.type:
+            raise TypeError("operands must have the same dtype")
+        return other
+
+    def _binary(self, name: str, other) -> Expr:
+        other = self._operand(other)
+        if issubclass(self.dtype.type, Integer):
+            fn = elementwise_op(f"int_{name}")
+        else:
+            fn = elementwise_op(f"float_{name}")
+        shape = Array.broadcast_shapes(self.shape, other.shape)
+        return Expr((fn, self.node, other.node), shape, self.dtype,
+                    self.datatype)
+
+    def __add__(self, other) -> Expr:
+        return self._binary("add", other)
+
+    def __sub__(self, other) -> Expr:
+        return self._binary("sub", other)
+
+    def __mul__(self, other) -> Expr:
+        return self._binary("mul", other)
+
+    def __floordiv__(self, other) -> Expr:
+        return self._binary("floordiv", other)
+
+    def __truediv__(self, other) -> Expr:
+        return self._binary("truediv", other)
+
+    def __eq__(self, other) -> Expr:
+        return self._binary("eq", other)
+
+    def __ne__(self, other) -> Expr:
+        return self._binary("ne", other)
+
+    __hash__ = None
+
+    def __bool__(self) -> bool:
+        raise ValueError("the truth value of an Expr is ambiguous")
+
+    def __lt__(self, other) -> Expr:
+        return self._binary("lt", other)
+
+    def materialize(self, out: Array | None = None) -> Array:
+        """Evaluate the expression in one fused pass into `out` or a new
+        array.
+        """
+        inputs: list[Array] = []
+        index: dict[int, int] = {}
+        lowered: dict[int, tuple] = {}
+
+        def lower(node):
+            # Arrays become numbered inputs; shared subtrees stay shared.
+            res = lowered.get(id(node))
+            if res is not None:
+                return res
+            match node:
+                case ("array", ary):
+                    k = index.get(id(ary))
+                    if k is None:
+                        k = index[id(ary)] = len(inputs)
+                        inputs.append(ary)
+                    res = ("input", k)
+                case ("const", _):
+                    res = node
+                case (fn, *operands):
+                    res = (fn, *map(lower, operands))
+            lowered[id(node)] = res
+            return res
+
+        fn = fuse_elementwise(lower(self.node))
+        if out is None:
+            out = Array(
+                dtype=self.dtype,
+                data=memref.alloc(self.shape, self.datatype),
+            )
+        elif out.shape != self.shape:
+            raise ValueError("out does not have the expression shape")
+        views = [ary._broadcast_view(self.shape).data for ary in inputs]
+        out.data.elementwise(fn, *views)
+        return out
+
+
+# Base case size of `_pairwise_sum`.
+_PAIRWISE_BLOCK = 128
+
+# Elements loaded per block by `Array._reduce`.
+_REDUCE_CHUNK = 1 << 16
+
+
+def _pairwise_sum(values):
+    n = len(values)
+    if n <= _PAIRWISE_BLOCK:
+        return sum(values)
+    mid = n // 2
+    return _pairwise_sum(values[:mid]) + _pairwise_sum(values[mid:])
+
+
+def _normalize_axis(axis, ndim: int) -> tuple[int, ...]:
+    if axis is None:
+        return tuple(range(ndim))
+    if not isinstance(axis, tuple):
+        axis = (axis,)
+    axes = []
+    for ax in axis:
+        ax = int(ax)
+        if not -ndim <= ax < ndim:
+            raise ValueError(f"axis {ax} is out of bounds for {ndim} dims")
+        ax %= ndim
+        if ax in axes:
+            raise ValueError("repeated axis")
+        axes.append(ax)
+    return tuple(sorted(axes))
+
+
+def _reduce_blocks(shape: tuple[int, ...], nkept: int):
+    """Split a reordered reduction `shape` (kept axes first) along its first
+    axis into `(start, block)` pieces of about `_REDUCE_CHUNK` elements.
+    """
+    zeros = (0,) * (len(shape) - 1)
+    if nkept == 0:
+        yield (0, *zeros), shape
+        return
+    [n, *rest] = shape
+    step = max(1, _REDUCE_CHUNK // math.prod(rest))
+    for i in range(0, n, step):
+        yield (i, *zeros), (min(step, n - i), *rest)
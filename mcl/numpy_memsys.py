@@ -0,0 +1,372 @@
+"""
+A MemorySystem backend that stores allocations as typed NumPy arrays.
+
+Select it at startup with `MCL_MEMSYS=numpy` or
+`set_memory_system(make_memory_system("numpy"))`.
+"""
+
+from __future__ import annotations
+
+import operator
+import typing as _tp
+import weakref
+
+import numpy as np
+
+from mcl.vm import (
+    MemorySystem,
+    _ELEMENTWISE_CHUNK,
+    MemRef,
+    _check_take,
+    _chunks,
+    _contiguous_memref,
+    _get_machine_value,
+    layout_of,
+)
+
+_ufuncs = {
+    operator.add: np.add,
+    operator.sub: np.subtract,
+    operator.mul: np.multiply,
+    operator.floordiv: np.floor_divide,
+    operator.truediv: np.true_divide,
+    operator.eq: np.equal,
+    operator.ne: np.not_equal,
+    operator.lt: np.less,
+}
+
+_comparisons = (operator.eq, operator.ne, operator.lt)
+
+
+def _dtype(datatype: _tp.Type) -> np.dtype:
+    """The NumPy dtype with the same layout as `datatype`."""
+    fmt = layout_of(datatype).format
+    # numpy spells ssize_t as "p"
+    return np.dtype("p" if fmt == "n" else fmt)
+
+
+class NumPyMemorySystem(MemorySystem):
+    """Each owner's storage is a flat `np.uint8` array over its whole buffer;
+    owners and views are zero-copy typed `np.ndarray`s over it at their byte
+    offsets and strides. `_memmap` holds a byte view of each owner so the
+    generic methods of `MemorySystem` keep working.
+    """
+
+    _ndarrays: weakref.WeakKeyDictionary[MemRef, np.ndarray]
+    _flat: weakref.WeakKeyDictionary[MemRef, np.ndarray]
+
+    def __init__(self):
+        super().__init__()
+        self._ndarrays = weakref.WeakKeyDictionary()
+        self._flat = weakref.WeakKeyDictionary()
+
+    def _track(self, memref: MemRef, flat: np.ndarray) -> memoryview:
+        # `flat` starts at byte 0 of the buffer; `memref.offset` is from there
+        self._flat[memref] = flat
+        self._ndarrays[memref] = _strided(flat, memref)
+        return memoryview(flat)
+
+    def _new_buffer(self, memref: MemRef):
+        return self._track(memref, np.zeros(memref.size, dtype=np.uint8))
+
+    def _adopt_buffer(self, memref: MemRef, buffer):
+        return self._track(memref, np.frombuffer(buffer, dtype=np.uint8))
+
+    def ndarray(self, memref: MemRef) -> np.ndarray:
+        """Return the NumPy array that serves `memref`."""
+        try:
+            return self._ndarrays[memref]
+        except KeyError:
+            pass
+        # Views unpickled in another process, or dropped by `share`, are
+        # rebuilt over their live owner.
+        if memref.owner is None:
+            raise ValueError(f"use of freed memref {memref}")
+        arr = self._ndarrays[memref] = _strided(self._bytes(memref), memref)
+        return arr
+
+    def _bytes(self, memref: MemRef) -> np.ndarray:
+        """The flat bytes of the whole buffer of the owner of `memref`."""
+        try:
+            return self._flat[memref.handle()]
+        except KeyError:
+            raise ValueError(f"use of freed memref {memref}") from None
+
+    def share(self, memref: MemRef) -> None:
+        root = memref.handle()
+        for view in self._viewmap.get(root, ()):
+            self._ndarrays.pop(view, None)
+        super().share(root)
+
+    def _drop_buffer(self, buffer_id: int) -> None:
+        # Cached arrays export the buffer (e.g. a shared memory segment).
+        for cache in (self._ndarrays, self._flat):
+            for memref in [m for m in cache if m.buffer_id == buffer_id]:
+                del cache[memref]
+        super()._drop_buffer(buffer_id)
+
+    def free(self, memref: MemRef) -> None:
+        if memref.owner is None:
+            # Drop our exports first so a mapping can be closed.
+            for view in self._viewmap.get(memref, ()):
+                self._ndarrays.pop(view, None)
+            self._ndarrays.pop(memref, None)
+            self._flat.pop(memref, None)
+        super().free(memref)
+
+    def write[
+        T
+    ](self, memref: MemRef, indices: tuple[int, ...], value: T) -> None:
+        self.ndarray(memref)[indices] = _get_machine_value(value)
+
+    def read(self, memref: MemRef, indices: tuple[int, ...]):
+        return memref.datatype(self.ndarray(memref)[indices].item())
+
+    def read_block(
+        self,
+        memref: MemRef,
+        start: tuple[int, ...],
+        shape: tuple[int, ...],
+    ) -> bytes:
+        return self.ndarray(memref)[_block(start, shape)].tobytes()
+
+    def write_block(
+        self,
+        memref: MemRef,
+        start: tuple[int, ...],
+        shape: tuple[int, ...],
+        data: bytes | bytearray,
+    ) -> None:
+        arr = self.ndarray(memref)
+        values = np.frombuffer(data, dtype=arr.dtype)
+        if values.size != np.prod(shape, dtype=np.intp):
+            raise ValueError("data size does not match block shape")
+        arr[_block(start, shape)] = values.reshape(shape)
+
+    def assign(self, memref: MemRef, source: MemRef) -> None:
+        if memref.shape != source.shape:
+            raise ValueError("source shape does not match")
+        # numpy copies through a temporary when the operands overlap
+        self.ndarray(memref)[...] = self.ndarray(source)
+
+    def fill[T](self, memref: MemRef, value: T) -> None:
+        self.ndarray(memref)[...] = _get_machine_value(value)
+
+    def gather(
+        self, memref: MemRef, indices: _tp.Sequence[tuple[int, ...]]
+    ) -> bytes:
+        arr = self.ndarray(memref)
+        if not indices:
+            return b""
+        return arr[_index_arrays(indices, arr.shape)].tobytes()
+
+    def take(self, memref: MemRef, offsets: _tp.Sequence[int]) -> bytes:
+        flat = self._bytes(memref)
+        if not offsets or 0 in memref.shape:
+            return b""
+        _check_take(memref, offsets)
+        # byte offsets of the elements of the block in memory, then of every
+        # moved copy of them, then of each of their bytes
+        block = np.full((), memref.offset, dtype=np.intp)
+        for n, s in zip(memref.shape, memref.strides):
+            block = block[..., None] + np.arange(n, dtype=np.intp) * s
+        moved = np.asarray(offsets, dtype=np.intp) * memref.itemsize
+        starts = moved[:, None] + block.reshape(1, -1)
+        nbytes = np.arange(memref.itemsize, dtype=np.intp)
+        return flat[starts[..., None] + nbytes].tobytes()
+
+    def scatter(
+        self,
+        memref: MemRef,
+        indices: _tp.Sequence[tuple[int, ...]],
+        data: bytes,
+    ) -> None:
+        arr = self.ndarray(memref)
+        values = np.frombuffer(data, dtype=arr.dtype)
+        if values.size != len(indices):
+            raise ValueError("data size does not match number of indices")
+        if indices:
+            arr[_index_arrays(indices, arr.shape)] = values
+
+    def elementwise(
+        self, fn: _tp.Callable, out: MemRef, inputs: list[MemRef]
+    ) -> None:
+        # Native ufuncs where they match the machine op semantics exactly:
+        # Python ints never wrap and division by zero raises, so integer
+        # arithmetic is computed wide and range-checked before storing.
+        expr = getattr(fn, "__mcl_expr__", None)
+        if expr is not None:
+            return self._fused(fn, expr, out, inputs)
+        ufunc = _ufuncs.get(fn)
+        if ufunc is None or len(inputs) != 2:
+            return super().elementwise(fn, out, inputs)
+        dst = self.ndarray(out)
+        lhs, rhs = (self.ndarray(x) for x in inputs)
+        if fn in (operator.floordiv, operator.truediv) and not rhs.all():
+            raise ZeroDivisionError("division by zero")
+        if fn in _comparisons:
+            ufunc(lhs, rhs, out=dst, casting="unsafe")
+        elif lhs.dtype.kind == "f":
+            ufunc(lhs, rhs, out=dst, casting="same_kind")
+        elif lhs.dtype.itemsize < 8 and fn is not operator.truediv:
+            res = ufunc(lhs.astype(np.int64), rhs)
+            info = np.iinfo(dst.dtype)
+            if res.size and (res.min() < info.min or res.max() > info.max):
+                raise OverflowError(f"result out of range for {dst.dtype}")
+            dst[...] = res
+        else:
+            return super().elementwise(fn, out, inputs)
+
+    def _fused(
+        self, fn: _tp.Callable, expr: tuple, out: MemRef,
+        inputs: list[MemRef]
+    ) -> None:
+        # Evaluate a `fuse_elementwise` tree with ufuncs, block by block.
+        dst = self.ndarray(out)
+        if dst.dtype.kind == "i" and dst.dtype.itemsize >= 8:
+            return super().elementwise(fn, out, inputs)
+        work = np.int64 if dst.dtype.kind == "i" else dst.dtype
+        srcs = [self.ndarray(x) for x in inputs]
+        owner = out.handle()
+        chunks: _tp.Iterable[tuple[tuple[int, ...], tuple[int, ...]]]
+        if any(x.handle() is owner for x in inputs):
+            chunks = [((0,) * len(out.shape), out.shape)]
+        else:
+            chunks = _chunks(out.shape, _ELEMENTWISE_CHUNK)
+        for start, shape in chunks:
+            block = _block(start, shape)
+            args = [src[block].astype(work, copy=False) for src in srcs]
+            try:
+                res = _evaluate(expr, args, work, {})
+            except _Unsupported:
+                return super().elementwise(fn, out, inputs)
+            if dst.dtype.kind == "i" and res.size:
+                info = np.iinfo(dst.dtype)
+                if res.min() < info.min or res.max() > info.max:
+                    raise OverflowError(
+                        f"result out of range for {dst.dtype}"
+                    )
+            dst[block] = res
+
+    def view(
+        self,
+        memref: MemRef,
+        shape,
+        strides,
+        datatype,
+        itemsize,
+        size,
+        offset,
+    ) -> MemRef:
+        new_memref = super().view(
+            memref, shape, strides, datatype, itemsize, size, offset
+        )
+        flat = self._bytes(new_memref)
+        self._ndarrays[new_memref] = _strided(flat, new_memref)
+        return new_memref
+
+    def copy(self, memref: MemRef) -> MemRef:
+        new_memref = _contiguous_memref(memref.shape, memref.datatype)
+        arr = self.ndarray(memref).copy(order="C")
+        flat = arr.reshape(-1).view(np.uint8)
+        self._register(new_memref, self._track(new_memref, flat))
+        return new_memref
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def _wrapped(fn, lhs, rhs, res) -> bool:
+    """Whether the integer ufunc result `res` of `fn(lhs, rhs)` wrapped
+    around.
+    """
+    if fn is operator.add:
+        return bool((((lhs ^ res) & (rhs ^ res)) < 0).any())
+    if fn is operator.sub:
+        return bool((((lhs ^ rhs) & (lhs ^ res)) < 0).any())
+    if fn is operator.mul:
+        nonzero = lhs != 0
+        # The min // -1 also wraps, so check that case separately.
+        back = np.floor_divide(res, np.where(nonzero, lhs, 1))
+        lowest = np.iinfo(res.dtype).min
+        return bool(
+            (nonzero & (back != rhs)).any()
+            or ((lhs == -1) & (rhs == lowest)).any()
+        )
+    if fn is operator.floordiv:
+        lowest = np.iinfo(res.dtype).min
+        return bool(((lhs == lowest) & (rhs == -1)).any())
+    return False
+
+
+def _evaluate(node: tuple, args: list, work, memo: dict):
+    """Evaluate a `fuse_elementwise` tree over the blocks `args` in the
+    `work` dtype; comparisons yield 0 and 1 like the scalar ops.
+    """
+    res = memo.get(id(node))
+    if res is not None:
+        return res
+    match node:
+        case ("input", k):
+            res = args[k]
+        case ("const", raw):
+            res = np.asarray(raw, dtype=work)
+        case (fn, lhs, rhs):
+            ufunc = _ufuncs.get(fn)
+            if ufunc is None:
+                raise _Unsupported(fn)
+            lhs = _evaluate(lhs, args, work, memo)
+            rhs = _evaluate(rhs, args, work, memo)
+            if fn is operator.truediv and np.dtype(work).kind != "f":
+                raise _Unsupported(fn)
+            if fn in (operator.floordiv, operator.truediv) and not rhs.all():
+                raise ZeroDivisionError("division by zero")
+            with np.errstate(over="ignore"):
+                res = ufunc(lhs, rhs)
+                wrapped = np.dtype(work).kind == "i" and _wrapped(
+                    fn, lhs, rhs, res
+                )
+            if wrapped:
+                # The interpreter computes with Python ints, which do not
+                # wrap; let it evaluate this expression.
+                raise _Unsupported(fn)
+            if fn in _comparisons:
+                res = res.astype(work)
+        case _:
+            raise _Unsupported(node)
+    memo[id(node)] = res
+    return res
+
+
+def _strided(flat: np.ndarray, memref: MemRef) -> np.ndarray:
+    """The typed array of `memref` over the bytes `flat` of its owner."""
+    return np.ndarray(
+        memref.shape, dtype=_dtype(memref.datatype), buffer=flat,
+        offset=memref.offset, strides=memref.strides,
+    )
+
+
+def _block(start: tuple[int, ...], shape: tuple[int, ...]) -> tuple:
+    return tuple(slice(s, s + n) for s, n in zip(start, shape, strict=True))
+
+
+def _index_arrays(
+    indices: _tp.Sequence[tuple[int, ...]], shape: tuple[int, ...]
+) -> tuple:
+    """The index arrays of `indices`, which must be in bounds (no
+    wraparound of negative indices).
+    """
+    try:
+        arr = np.array(indices, dtype=np.intp)
+    except ValueError:
+        arr = None
+    if arr is None or arr.ndim != 2 or arr.shape[1] != len(shape):
+        idx = next(i for i in indices if len(i) != len(shape))
+        raise IndexError(f"index {tuple(idx)} is out of bounds for shape "
+                         f"{shape}")
+    bad = ((arr < 0) | (arr >= np.array(shape, dtype=np.intp))).any(1)
+    if bad.any():
+        idx = tuple(indices[int(bad.argmax())])
+        raise IndexError(f"index {idx} is out of bounds for shape {shape}")
+    return tuple(arr.T)
@@ -0,0 +1,305 @@
+"""
+Profiling hooks for the VM.
+
+Within a `profile()` block the following are measured:
+
+- for each `machine_op` name: the call count, the cumulative time and a
+  latency histogram;
+- for each `MemorySystem` method: the call count and the cumulative time;
+- the bytes read and written in each owner buffer;
+- all of the above attributed to the outermost `Array` method that caused
+  them.
+
+    with profiling.profile() as prof:
+        c = a + b
+    print(prof.report())
+    prof.to_json("profile.json")
+
+Hooks exist only inside the block. On entry they wrap the VM dispatcher
+(see `vm.dispatch_hook`) and replace the methods of the current memory
+system and of `Array`, and on exit they are removed. Profiling therefore
+costs nothing when it is off. Times are inclusive: an operation that runs
+other operations also counts their time. Bytes are counted once, at the
+outermost memory system call. Broadcast inputs count every element they supply.
+"""
+
+from __future__ import annotations
+
+import json
+import time
+import types
+import typing as _tp
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import wraps
+
+from mcl import vm
+from mcl.ndarray import Array
+from mcl.vm import MemRef, _nelems
+
+_clock = time.perf_counter_ns
+
+
+def _nbytes(memref: MemRef) -> int:
+    return _nelems(memref.shape) * memref.itemsize
+
+
+# The element traffic of the memory system methods that move data, as
+# `(memref, "read" | "written", nbytes)` from the result and the arguments.
+_traffic = {
+    "read": lambda res, m, idx: [(m, "read", m.itemsize)],
+    "write": lambda res, m, idx, v: [(m, "written", m.itemsize)],
+    "read_block": lambda res, m, start, shape: [(m, "read", len(res))],
+    "write_block": lambda res, m, start, shape, data: [
+        (m, "written", len(data))
+    ],
+    "gather": lambda res, m, idx: [(m, "read", len(res))],
+    "take": lambda res, m, offsets: [(m, "read", len(res))],
+    "scatter": lambda res, m, idx, data: [(m, "written", len(data))],
+    "assign": lambda res, m, src: [
+        (src, "read", _nbytes(src)),
+        (m, "written", _nbytes(m)),
+    ],
+    "fill": lambda res, m, v: [(m, "written", _nbytes(m))],
+    "elementwise": lambda res, fn, out, inputs: [
+        *((x, "read", _nbytes(x)) for x in inputs),
+        (out, "written", _nbytes(out)),
+    ],
+    "copy": lambda res, m: [
+        (m, "read", _nbytes(m)),
+        (res, "written", _nbytes(res)),
+    ],
+}
+
+# Memory system methods that are timed.
+_memsys_methods = (*_traffic, "alloc", "view", "free", "share")
+
+# Array methods that are never attributed to.
+_unattributed = {"__init__", "__repr__"}
+
+_missing = object()
+
+
+@dataclass(slots=True)
+class Stats:
+    """Counters of one operation, method or buffer.
+
+    `hist` maps `n` to the number of calls that took less than `2**n` ns.
+    """
+
+    calls: int = 0
+    ns: int = 0
+    hist: dict[int, int] = field(default_factory=dict)
+    ops: int = 0
+    bytes_read: int = 0
+    bytes_written: int = 0
+
+    def add(self, ns: int) -> None:
+        self.calls += 1
+        self.ns += ns
+        n = ns.bit_length()
+        self.hist[n] = self.hist.get(n, 0) + 1
+
+    def percentile(self, q: float) -> int:
+        """An upper bound, in ns, of the `q`-th latency percentile."""
+        seen = 0
+        for n in sorted(self.hist):
+            seen += self.hist[n]
+            if seen * 100 >= q * self.calls:
+                return 2**n
+        return 0
+
+    def as_dict(self) -> dict[str, _tp.Any]:
+        return {
+            "calls": self.calls,
+            "total_ns": self.ns,
+            "mean_ns": self.ns / self.calls if self.calls else 0.0,
+            "hist": [[2**n, self.hist[n]] for n in sorted(self.hist)],
+            "ops": self.ops,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+        }
+
+
+class Profile:
+    """The counters collected by one `profile()` block.
+
+    - `ops`: `machine_op` name -> Stats
+    - `memsys`: memory system method -> Stats
+    - `owners`: owner buffer label -> Stats (bytes only)
+    - `methods`: `Array` method -> Stats, with the ops and bytes they caused
+    """
+
+    ops: dict[str, Stats]
+    memsys: dict[str, Stats]
+    owners: dict[str, Stats]
+    methods: dict[str, Stats]
+
+    def __init__(self):
+        self.ops = {}
+        self.memsys = {}
+        self.owners = {}
+        self.methods = {}
+        # Stats of the `Array` method being run, and the memory system
+        # call depth.
+        self._method = None
+        self._depth = 0
+
+    def _hook_dispatch(self, dispatch: _tp.Callable) -> _tp.Callable:
+        ops = self.ops
+
+        def profiled_dispatch(opname, restype, args):
+            t0 = _clock()
+            try:
+                return dispatch(opname, restype, args)
+            finally:
+                ns = _clock() - t0
+                stats = ops.get(opname)
+                if stats is None:
+                    stats = ops[opname] = Stats()
+                stats.add(ns)
+                if self._method is not None:
+                    self._method.ops += 1
+
+        return profiled_dispatch
+
+    def _hook_memsys(self, name: str, fn: _tp.Callable) -> _tp.Callable:
+        traffic = _traffic.get(name)
+
+        def profiled(*args, **kwargs):
+            if self._depth:
+                return fn(*args, **kwargs)
+            self._depth += 1
+            t0 = _clock()
+            try:
+                res = fn(*args, **kwargs)
+            finally:
+                self._depth -= 1
+                ns = _clock() - t0
+                stats = self.memsys.get(name)
+                if stats is None:
+                    stats = self.memsys[name] = Stats()
+                stats.add(ns)
+            if traffic is not None:
+                for memref, kind, nbytes in traffic(res, *args, **kwargs):
+                    self._count_bytes(memref, kind, nbytes)
+            return res
+
+        return profiled
+
+    def _count_bytes(self, memref: MemRef, kind: str, nbytes: int) -> None:
+        root = memref.handle()
+        label = (
+            f"{root.datatype.__name__}[{'x'.join(map(str, root.shape))}]"
+            f"@{id(root):#x}"
+        )
+        targets = [self.owners.setdefault(label, Stats())]
+        if self._method is not None:
+            targets.append(self._method)
+        for stats in targets:
+            if kind == "read":
+                stats.bytes_read += nbytes
+            else:
+                stats.bytes_written += nbytes
+
+    def _hook_method(self, name: str, fn: _tp.Callable) -> _tp.Callable:
+        @wraps(fn)
+        def profiled(*args, **kwargs):
+            if self._method is not None:
+                return fn(*args, **kwargs)
+            stats = self.methods.get(name)
+            if stats is None:
+                stats = self.methods[name] = Stats()
+            self._method = stats
+            t0 = _clock()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._method = None
+                stats.add(_clock() - t0)
+
+        return profiled
+
+    def as_dict(self) -> dict[str, _tp.Any]:
+        return {
+            section: {
+                name: stats.as_dict()
+                for name, stats in getattr(self, section).items()
+            }
+            for section in ("ops", "memsys", "owners", "methods")
+        }
+
+    def to_json(self, path: str | None = None) -> str:
+        """Return the counters as JSON, also writing them to `path`."""
+        text = json.dumps(self.as_dict(), indent=2)
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(text)
+        return text
+
+    def report(self, top: int = 20) -> str:
+        """A text report of the `top` entries of each section by time."""
+        lines = []
+        timed = ("calls", "total ms", "mean us", "p50 us", "p99 us")
+        for title, table in [
+            ("machine ops", self.ops),
+            ("memory system", self.memsys),
+        ]:
+            lines.append(f"{title:<28}" + "".join(f"{h:>11}" for h in timed))
+            for name, s in _top(table, top, lambda s: s.ns):
+                lines.append(
+                    f"  {name:<26}{s.calls:>11}{s.ns / 1e6:>11.3f}"
+                    f"{s.ns / s.calls / 1e3:>11.3f}"
+                    f"{s.percentile(50) / 1e3:>11.3f}"
+                    f"{s.percentile(99) / 1e3:>11.3f}"
+                )
+        lines.append(f"{'Array methods':<28}" + "".join(
+            f"{h:>11}" for h in ("calls", "total ms", "ops", "read", "written")
+        ))
+        for name, s in _top(self.methods, top, lambda s: s.ns):
+            lines.append(
+                f"  {name:<26}{s.calls:>11}{s.ns / 1e6:>11.3f}{s.ops:>11}"
+                f"{s.bytes_read:>11}{s.bytes_written:>11}"
+            )
+        lines.append(f"{'bytes by owner':<40}{'read':>13}{'written':>13}")
+        for name, s in _top(
+            self.owners, top, lambda s: s.bytes_read + s.bytes_written
+        ):
+            lines.append(
+                f"  {name:<38}{s.bytes_read:>13}{s.bytes_written:>13}"
+            )
+        return "\n".join(lines)
+
+
+def _top(table: dict[str, Stats], n: int, key) -> list[tuple[str, Stats]]:
+    return sorted(table.items(), key=lambda kv: key(kv[1]), reverse=True)[:n]
+
+
+@contextmanager
+def profile() -> _tp.Iterator[Profile]:
+    """Profile the VM while the block runs; yields the `Profile`."""
+    prof = Profile()
+    memsys = vm.get_memory_system()
+    saved_memsys = {
+        name: memsys.__dict__.get(name, _missing) for name in _memsys_methods
+    }
+    saved_methods = {
+        name: fn
+        for name, fn in vars(Array).items()
+        if isinstance(fn, types.FunctionType) and name not in _unattributed
+    }
+    for name in saved_memsys:
+        setattr(memsys, name, prof._hook_memsys(name, getattr(memsys, name)))
+    for name, fn in saved_methods.items():
+        setattr(Array, name, prof._hook_method(name, fn))
+    try:
+        with vm.dispatch_hook(prof._hook_dispatch):
+            yield prof
+    finally:
+        for name, fn in saved_methods.items():
+            setattr(Array, name, fn)
+        for name, fn in saved_memsys.items():
+            if fn is _missing:
+                delattr(memsys, name)
+            else:
+                setattr(memsys, name, fn)
@@ -0,0 +1,686 @@
+"""
+A tracing execution tier for the VM.
+
+`trace(fn)` runs `fn` once in the interpreter while recording the
+`machine_op` calls it makes, for one set of argument types and shapes. The
+trace is optimized and turned into a Python closure that replays it on raw
+values and buffers:
+
+- values stay unwrapped between operations (`cast`/`tuple_cast` vanish);
+- shape, stride, offset and datatype reads of memrefs whose layout is fixed
+  by the guards are folded, and so are pure operations on constants;
+- element loads and stores become `struct` reads and writes at precomputed
+  byte offsets of buffers looked up once on entry;
+- operations whose results are not needed are dropped.
+
+Conversions of machine integers to Python ints (`range(n)` on an `intp`)
+steer the trace like plain Python values: they fold on constants and are
+otherwise guarded to produce the recorded int.
+
+Replays are guarded: a different memory system, argument types, memref
+layouts or plain Python arguments select (or record) another trace, and a
+comparison with a different outcome than when recorded falls back to the
+interpreter.
+
+Tracing sees only machine operations. A kernel must compute on data through
+machine ops; control flow may depend on shapes and comparisons. Kernels that
+read bulk bytes (`load_block`, `gather`, ...) into Python, branch on data
+after storing, or return plain Python values are not compiled and always run
+in the interpreter.
+"""
+
+from __future__ import annotations
+
+import math
+import typing as _tp
+from dataclasses import dataclass
+from functools import partial
+
+from mcl import vm
+from mcl.vm import BaseMachineType, BaseStructType, Type, _get_machine_value
+
+# Default bound on the number of recorded operations of one trace. Loops are
+# unrolled into the trace, so longer kernels are left to the interpreter.
+MAX_TRACE_OPS = 50_000
+
+# Default bound on the number of traces kept per kernel.
+MAX_TRACES = 16
+
+# Operations without side effects; dropped when their result is unused.
+_pure_ops = {
+    *vm._scalar_binops,
+    *vm._scalar_cmpops,
+    "cast",
+    "tuple_cast",
+    "memref_shape",
+    "memref_strides",
+    "memref_offset",
+    "memref_datatype",
+    "memref_load",
+    "memref_view",
+}
+
+# Reads of memref layout, constant when the memref layout is known.
+_layout_reads = {
+    "memref_shape",
+    "memref_strides",
+    "memref_offset",
+    "memref_datatype",
+}
+
+
+class _Deopt(Exception):
+    """A guard of a replay failed; run the kernel in the interpreter."""
+
+
+class _Untraceable(Exception):
+    """The recorded trace cannot be replayed faithfully."""
+
+
+@dataclass(frozen=True, slots=True)
+class _Input:
+    k: int
+
+
+@dataclass(frozen=True, slots=True)
+class _Result:
+    j: int
+
+
+@dataclass(frozen=True, slots=True)
+class _Elem:
+    j: int
+    i: int
+
+
+@dataclass(frozen=True, slots=True, eq=False)
+class _Const:
+    obj: object
+
+
+type _Ref = _Input | _Result | _Elem | _Const
+
+
+@dataclass(slots=True)
+class _Op:
+    opname: str
+    restype: _tp.Any
+    args: tuple
+    result: object
+
+
+def _is_machine_value(obj) -> bool:
+    return isinstance(type(obj), BaseMachineType)
+
+
+def _raw(obj):
+    if _is_machine_value(obj):
+        return _get_machine_value(obj)
+    if type(obj) is tuple:
+        return tuple(map(_raw, obj))
+    return obj
+
+
+def _is_index(op: _Op) -> bool:
+    # `intp.__index__`: a machine value converted to a Python int.
+    return op.opname == "cast" and type(op.result) is int
+
+
+def _is_guard(op: _Op) -> bool:
+    return op.opname in vm._scalar_cmpops or _is_index(op)
+
+
+def _unwrap(obj):
+    # Like _raw, for results at replay time.
+    if isinstance(type(obj), BaseMachineType):
+        return obj._BaseMachineType__value
+    if type(obj) is tuple:
+        return tuple(map(_unwrap, obj))
+    return obj
+
+
+def _tuple_expr(exprs) -> str:
+    return "(" + "".join(f"{e}, " for e in exprs) + ")"
+
+
+def _flatten(obj, key: list, leaves: list) -> None:
+    """Collect the machine values reachable from `obj` into `leaves` and the
+    parts of the guard key into `key`.
+    """
+    typ = type(obj)
+    if isinstance(typ, BaseMachineType):
+        leaves.append(obj)
+        v = obj._BaseMachineType__value
+        if type(v) is vm.MemRef:
+            key.append((typ, v.shape, v.strides, v.offset, v.datatype))
+        else:
+            key.append(typ)
+    elif isinstance(typ, BaseStructType):
+        key.append(typ)
+        for name in typ.__mcl_struct_field_names__:
+            _flatten(getattr(obj, name), key, leaves)
+    elif typ is tuple or typ is list:
+        key.append((typ, len(obj)))
+        for x in obj:
+            _flatten(x, key, leaves)
+    else:
+        # Plain Python values steer the trace; they must match exactly.
+        key.append((typ, obj))
+
+
+class _Recorder:
+    """Installed as the VM dispatcher while a kernel is traced."""
+
+    def __init__(self, leaves, max_ops: int):
+        self.dispatch = None
+        self.max_ops = max_ops
+        self.depth = 0
+        self.overflow = False
+        self.ops: list[_Op] = []
+        self.refs = {id(x): _Input(k) for k, x in enumerate(leaves)}
+        # Keep every recorded object alive so that ids stay unique.
+        self.keep = list(leaves)
+
+    def install(self, dispatch):
+        """A `vm.dispatch_hook`: record around `dispatch`."""
+        self.dispatch = dispatch
+        return self
+
+    def ref(self, obj):
+        if type(obj) is tuple:
+            return tuple(map(self.ref, obj))
+        r = self.refs.get(id(obj))
+        return _Const(obj) if r is None else r
+
+    def __call__(self, opname, restype, args):
+        if self.depth:
+            # Operations issued by other operations are not part of the trace.
+            return self.dispatch(opname, restype, args)
+        self.depth += 1
+        try:
+            res = self.dispatch(opname, restype, args)
+        finally:
+            self.depth -= 1
+        if self.overflow:
+            return res
+        if len(self.ops) >= self.max_ops:
+            self.overflow = True
+            return res
+        j = len(self.ops)
+        self.ops.append(_Op(opname, restype, tuple(map(self.ref, args)), res))
+        self.keep.append(res)
+        if type(res) is tuple:
+            for i, x in enumerate(res):
+                self.refs[id(x)] = _Elem(j, i)
+        elif _is_machine_value(res):
+            self.refs[id(res)] = _Result(j)
+        return res
+
+
+class _Compiler:
+    """Optimize a recorded trace and generate its replay closure."""
+
+    def __init__(self, leaves, ops: list[_Op], ret):
+        self.leaves = leaves
+        self.ops = ops
+        self.ret = ret
+        # cast results -> their operand (a ref or a tuple of refs)
+        self.alias: dict[_Ref, _tp.Any] = {}
+        # refs with a constant raw value
+        self.folded: dict[_Ref, _tp.Any] = {}
+        # memref refs -> MemRef with a fixed layout
+        self.known: dict[_Ref, vm.MemRef] = {}
+        # known memref refs -> ref owning the buffer
+        self.buffer_of: dict[_Ref, _Ref] = {}
+        self.ns: dict[str, _tp.Any] = {"_Deopt": _Deopt, "_unwrap": _unwrap}
+        self.consts: dict[_tp.Hashable, str] = {}
+
+    # -- refs ----------------------------------------------------------------
+
+    def resolve(self, ref):
+        if type(ref) is tuple:
+            return tuple(map(self.resolve, ref))
+        while True:
+            if type(ref) is _Elem:
+                target = self.alias.get(_Result(ref.j))
+                if type(target) is tuple:
+                    ref = target[ref.i]
+                    continue
+            target = self.alias.get(ref)
+            if target is None or type(target) is tuple:
+                return ref
+            ref = target
+
+    def is_static(self, ref) -> bool:
+        ref = self.resolve(ref)
+        if type(ref) is tuple:
+            return all(map(self.is_static, ref))
+        if type(ref) is _Const:
+            return True
+        if type(ref) is _Elem:
+            return _Result(ref.j) in self.folded
+        return ref in self.folded
+
+    def static_raw(self, ref):
+        ref = self.resolve(ref)
+        if type(ref) is tuple:
+            return tuple(map(self.static_raw, ref))
+        if type(ref) is _Const:
+            return _raw(ref.obj)
+        if type(ref) is _Elem:
+            return self.folded[_Result(ref.j)][ref.i]
+        return self.folded[ref]
+
+    def obj_type(self, ref):
+        match ref:
+            case _Input(k):
+                return type(self.leaves[k])
+            case _Result(j):
+                return type(self.ops[j].result)
+            case _Elem(j, i):
+                return type(self.ops[j].result[i])
+            case _Const(obj):
+                return type(obj)
+
+    def bind(self, obj, key=None) -> str:
+        """Name `obj` in the closure namespace (once per `key`, by default
+        once per object).
+        """
+        key = id(obj) if key is None else key
+        name = self.consts.get(key)
+        if name is None:
+            name = self.consts[key] = f"c{len(self.consts)}"
+            self.ns[name] = obj
+        return name
+
+    def literal(self, value) -> str:
+        if type(value) in (int, bool) or value is None:
+            return repr(value)
+        if type(value) is float and math.isfinite(value):
+            return repr(value)
+        if type(value) is tuple:
+            return _tuple_expr(map(self.literal, value))
+        return self.bind(value)
+
+    def raw_expr(self, ref) -> str:
+        if self.is_static(ref):
+            return self.literal(self.static_raw(ref))
+        ref = self.resolve(ref)
+        match ref:
+            case tuple():
+                return _tuple_expr(map(self.raw_expr, ref))
+            case _Input(k):
+                return f"a{k}"
+            case _Result(j):
+                return f"v{j}"
+            case _Elem(j, i):
+                return f"v{j}[{i}]"
+            case _:
+                raise AssertionError(ref)
+
+    def wrapped_expr(self, ref) -> str:
+        if type(ref) is tuple:
+            return _tuple_expr(map(self.wrapped_expr, ref))
+        if type(ref) is _Const:
+            return self.bind(ref.obj)
+        typ = self.obj_type(ref)
+        if isinstance(typ, BaseMachineType):
+            return f"{self.bind(typ)}({self.raw_expr(ref)})"
+        return self.raw_expr(ref)
+
+    # -- passes --------------------------------------------------------------
+
+    def fold(self) -> None:
+        for k, leaf in enumerate(self.leaves):
+            v = _get_machine_value(leaf)
+            if type(v) is vm.MemRef:
+                self.known[_Input(k)] = v
+                self.buffer_of[_Input(k)] = _Input(k)
+        for j, op in enumerate(self.ops):
+            res = _Result(j)
+            result = op.result
+            args = op.args
+            name = op.opname
+            if _is_index(op):
+                # Not a ref; nothing downstream consumes the int itself.
+                if self.is_static(args[-1]):
+                    self.folded[res] = result
+                continue
+            if not (
+                result is None
+                or type(result) is bool
+                or isinstance(result, Type)
+                or _is_machine_value(result)
+                or (type(result) is tuple
+                    and all(map(_is_machine_value, result)))
+            ):
+                # The kernel consumes raw data in Python (e.g. bytes of
+                # load_block); that dataflow is invisible to the trace.
+                raise _Untraceable(op.opname)
+            if name in ("cast", "tuple_cast"):
+                self.alias[res] = args[-1]
+                if self.is_static(args[-1]):
+                    self.folded[res] = _raw(result)
+            elif name in vm._scalar_binops or name in vm._scalar_cmpops:
+                if self.is_static(args):
+                    self.folded[res] = _raw(result)
+            elif name in _layout_reads:
+                if self.resolve(args[0]) in self.known:
+                    self.folded[res] = _raw(result)
+            elif name == "memref_view":
+                src = self.resolve(args[0])
+                if src in self.known and self.is_static(args[1:]):
+                    self.known[res] = _raw(result)
+                    self.buffer_of[res] = self.buffer_of[src]
+            elif name == "memref_alloc" and self.is_static(args[0]) or (
+                name == "memref_copy" and self.resolve(args[0]) in self.known
+            ):
+                self.known[res] = _raw(result)
+                self.buffer_of[res] = res
+
+    def fast_access(self, op: _Op) -> bool:
+        # Loads and stores on a known layout go straight to the buffer.
+        return (
+            op.opname in ("memref_load", "memref_store")
+            and self.resolve(op.args[0]) in self.known
+            and type(op.args[1]) is tuple
+        )
+
+    def liveness(self) -> list[bool]:
+        needed = [False] * len(self.ops)
+        used = set()
+
+        def use(ref):
+            ref = self.resolve(ref)
+            if type(ref) is tuple:
+                for r in ref:
+                    use(r)
+            elif type(ref) in (_Result, _Elem) and not self.is_static(ref):
+                used.add(ref.j)
+
+        for ref in _ret_refs(self.ret):
+            use(ref)
+        for j in reversed(range(len(self.ops))):
+            op = self.ops[j]
+            res = _Result(j)
+            if res in self.folded:
+                continue
+            if not (j in used or _is_guard(op) or op.opname not in _pure_ops):
+                continue
+            needed[j] = True
+            if self.fast_access(op):
+                use(self.buffer_of[self.resolve(op.args[0])])
+                use(op.args[1:])
+            elif op.opname in ("cast", "tuple_cast"):
+                use(op.args[-1])
+            else:
+                use(op.args)
+        return needed
+
+    def check_guards(self, needed: list[bool]) -> None:
+        # A failing guard falls back to running the whole kernel in the
+        # interpreter, so no effect may precede a guard.
+        effect = False
+        for j, op in enumerate(self.ops):
+            if not needed[j]:
+                continue
+            if _is_guard(op):
+                if effect:
+                    raise _Untraceable("comparison after a side effect")
+            elif op.opname not in _pure_ops:
+                effect = True
+
+    def offset_expr(self, memref_ref, index_refs) -> str:
+        memref = self.known[self.resolve(memref_ref)]
+        const = memref.offset
+        terms = []
+        for r, s in zip(index_refs, memref.strides, strict=True):
+            if s == 0:
+                continue
+            if self.is_static(r):
+                const += self.static_raw(r) * s
+            else:
+                terms.append(f"{self.raw_expr(r)} * {s}")
+        return " + ".join(terms + [str(const)])
+
+    def buffer_name(self, ref) -> str:
+        owner = self.buffer_of[self.resolve(ref)]
+        match owner:
+            case _Input(k):
+                return f"b{k}"
+            case _Result(j):
+                return f"bv{j}"
+            case _:
+                raise AssertionError(owner)
+
+    def generate(self, needed: list[bool]) -> str:
+        body = []
+        buffers = set()
+        for j, op in enumerate(self.ops):
+            if not needed[j]:
+                continue
+            name = op.opname
+            args = op.args
+            if name in vm._scalar_binops:
+                infix = vm._infix_ops[vm._scalar_binops[name]]
+                (lhs, rhs) = map(self.raw_expr, args)
+                body.append(f"v{j} = {lhs} {infix} {rhs}")
+            elif name in vm._scalar_cmpops:
+                infix = vm._infix_ops[vm._scalar_cmpops[name]]
+                (lhs, rhs) = map(self.raw_expr, args)
+                test = f"{lhs} {infix} {rhs}"
+                if op.result:
+                    test = f"not ({test})"
+                body.append(f"if {test}: raise _Deopt")
+            elif _is_index(op):
+                val = self.raw_expr(args[-1])
+                body.append(f"if {val} != {op.result!r}: raise _Deopt")
+            elif name in ("cast", "tuple_cast"):
+                body.append(f"v{j} = {self.raw_expr(args[-1])}")
+            elif self.fast_access(op):
+                memref = self.known[self.resolve(args[0])]
+                buf = self.buffer_name(args[0])
+                buffers.add(self.buffer_of[self.resolve(args[0])])
+                off = self.offset_expr(args[0], args[1])
+                layout = memref.layout
+                if name == "memref_load":
+                    fn = self.bind(
+                        layout.codec.unpack_from, ("unpack", layout)
+                    )
+                    body.append(f"v{j} = {fn}({buf}, {off})[0]")
+                else:
+                    # Layout.pack_into reports overflow like the interpreter
+                    fn = self.bind(layout.pack_into, ("pack", layout))
+                    val = self.raw_expr(args[2])
+                    body.append(f"{fn}({buf}, {off}, {val})")
+            else:
+                impl = vm._machine_op_table[name]
+                fn = self.bind(partial(impl, name, op.restype))
+                call_args = ", ".join(map(self.wrapped_expr, args))
+                body.append(f"v{j} = _unwrap({fn}({call_args}))")
+                if self.buffer_of.get(_Result(j)) == _Result(j):
+                    body.append(f"bv{j} = _buffer(v{j})")
+        body.append(f"return {self.ret_expr(self.ret)}")
+
+        params = ", ".join(f"a{k}" for k in range(len(self.leaves)))
+        head = []
+        for owner in sorted(
+            (b for b in buffers if type(b) is _Input), key=lambda b: b.k
+        ):
+            head.append(f"b{owner.k} = _buffer(a{owner.k})")
+        lines = [f"def replay({params}):"]
+        lines += [f"    {line}" for line in head + body]
+        return "\n".join(lines)
+
+    def ret_expr(self, spec) -> str:
+        match spec:
+            case None:
+                return "None"
+            case ("struct", typ, fields):
+                args = ", ".join(map(self.ret_expr, fields))
+                return f"{self.bind(typ)}({args})"
+            case ("tuple", items):
+                return _tuple_expr(map(self.ret_expr, items))
+            case _:
+                return self.wrapped_expr(spec)
+
+    def compile(self, memsys) -> tuple[str, _tp.Callable]:
+        self.fold()
+        needed = self.liveness()
+        self.check_guards(needed)
+        self.ns["_buffer"] = memsys._buffer
+        source = self.generate(needed)
+        exec(source, self.ns)
+        return source, self.ns["replay"]
+
+
+def _ret_refs(spec):
+    match spec:
+        case None:
+            return
+        case ("struct", _, fields):
+            for field in fields:
+                yield from _ret_refs(field)
+        case ("tuple", items):
+            for item in items:
+                yield from _ret_refs(item)
+        case _:
+            yield spec
+
+
+def _ret_spec(recorder: _Recorder, obj):
+    """Describe the kernel result in terms of trace refs."""
+    typ = type(obj)
+    if obj is None:
+        return None
+    if typ is tuple:
+        return ("tuple", [_ret_spec(recorder, x) for x in obj])
+    if isinstance(typ, BaseStructType):
+        return (
+            "struct",
+            typ,
+            [
+                _ret_spec(recorder, getattr(obj, name))
+                for name in typ.__mcl_struct_field_names__
+            ],
+        )
+    ref = recorder.ref(obj)
+    if type(ref) is _Const and not (
+        _is_machine_value(obj) or isinstance(obj, type)
+    ):
+        # A plain Python value computed by the kernel is not in the trace.
+        raise _Untraceable(f"returns {typ.__name__}")
+    return ref
+
+
+@dataclass
+class _Trace:
+    source: str | None
+    replay: _tp.Callable | None
+    reason: str | None = None
+
+
+_tracing = False
+
+
+class TracedKernel:
+    """A kernel function with a cache of compiled traces.
+
+    Calling it looks up the trace for the argument types and shapes, records
+    one on a miss, and replays it. `stats` counts traces recorded, replays,
+    guard failures and interpreted calls.
+    """
+
+    traces: dict[tuple, _Trace]
+
+    def __init__(self, fn, max_ops=MAX_TRACE_OPS, max_traces=MAX_TRACES):
+        self.fn = fn
+        self.max_ops = max_ops
+        self.max_traces = max_traces
+        self.traces = {}
+        self.stats = dict(traced=0, replayed=0, deopts=0, interpreted=0)
+
+    def __repr__(self) -> str:
+        return f"TracedKernel({self.fn.__qualname__})"
+
+    def __call__(self, *args):
+        if _tracing:
+            # Inside another trace, run through the interpreter so that its
+            # operations are recorded.
+            return self.fn(*args)
+        memsys = vm.get_memory_system()
+        key_parts = [id(memsys)]
+        leaves = []
+        _flatten(args, key_parts, leaves)
+        key = tuple(key_parts)
+        try:
+            trace = self.traces.get(key)
+        except TypeError:
+            # unhashable plain argument
+            self.stats["interpreted"] += 1
+            return self.fn(*args)
+        if trace is None:
+            if len(self.traces) >= self.max_traces:
+                self.stats["interpreted"] += 1
+                return self.fn(*args)
+            return self._record(key, args, leaves, memsys)
+        if trace.replay is None:
+            self.stats["interpreted"] += 1
+            return self.fn(*args)
+        raw = [x._BaseMachineType__value for x in leaves]
+        try:
+            res = trace.replay(*raw)
+        except _Deopt:
+            self.stats["deopts"] += 1
+            return self.fn(*args)
+        self.stats["replayed"] += 1
+        return res
+
+    def _record(self, key, args, leaves, memsys):
+        global _tracing
+        recorder = _Recorder(leaves, self.max_ops)
+        interned = [
+            t for t in Type.registry
+            if isinstance(t, BaseMachineType) and t.__mcl_interned__
+        ]
+        saved = [t.__mcl_interned__ for t in interned]
+        # Every value made during the trace must be a distinct object so
+        # that identity tells where it came from.
+        for t in interned:
+            t.__mcl_interned__ = None
+        vm._intp_tuple.cache_clear()
+        _tracing = True
+        try:
+            with vm.dispatch_hook(recorder.install):
+                res = self.fn(*args)
+        finally:
+            _tracing = False
+            for t, table in zip(interned, saved):
+                t.__mcl_interned__ = table
+            vm._intp_tuple.cache_clear()
+        self.stats["traced"] += 1
+        try:
+            if recorder.overflow:
+                raise _Untraceable("trace too long")
+            ret = _ret_spec(recorder, res)
+            source, replay = _Compiler(leaves, recorder.ops, ret).compile(
+                memsys
+            )
+            self.traces[key] = _Trace(source, replay)
+        except _Untraceable as e:
+            self.traces[key] = _Trace(None, None, str(e))
+        return res
+
+    def source(self, *args) -> str | None:
+        """The generated replay code for `args`, or None if not compiled."""
+        key_parts = [id(vm.get_memory_system())]
+        _flatten(args, key_parts, [])
+        trace = self.traces.get(tuple(key_parts))
+        return None if trace is None else trace.source
+
+
+def trace(fn=None, *, max_ops=MAX_TRACE_OPS, max_traces=MAX_TRACES):
+    """Decorate a kernel function to run through the tracing tier."""
+    if fn is None:
+        return partial(trace, max_ops=max_ops, max_traces=max_traces)
+    return TracedKernel(fn, max_ops, max_traces)
@@ -8,20 +8,83 @@ Only for providing an implementation that Python interpreter can evaluate.
 from __future__ import annotations
 
 import inspect
-import logging
+import itertools
+import mmap
 import operator
+import os
+import pickle
+import struct
+import sys
+import types
 import typing as _tp
-from dataclasses import dataclass
-from functools import reduce, singledispatch
+import weakref
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import (
+    cached_property,
+    lru_cache,
+    partial,
+    reduce,
+    singledispatch,
+)
+from multiprocessing import shared_memory
 
 from mcl import machine_types as _mt
 
 
+@dataclass(frozen=True)
+class Layout:
+    """In-memory layout of a machine type.
+
+    `format` is a native `struct` format character; `codec` is the
+    precompiled `struct.Struct` for one element.
+    """
+
+    format: str
+    size: int
+    align: int
+    codec: struct.Struct
+
+    @classmethod
+    def from_format(cls, format: str) -> Layout:
+        codec = struct.Struct("@" + format)
+        # alignment is the padding inserted after a leading char
+        align = struct.calcsize("@c" + format) - codec.size
+        return cls(format=format, size=codec.size, align=align, codec=codec)
+
+    def pack(self, value) -> bytes:
+        try:
+            return self.codec.pack(value)
+        except struct.error as e:
+            raise OverflowError(str(e)) from None
+
+    def pack_into(self, buffer, offset: int, value) -> None:
+        try:
+            self.codec.pack_into(buffer, offset, value)
+        except struct.error as e:
+            raise OverflowError(str(e)) from None
+
+    def unpack_from(self, buffer, offset: int):
+        return self.codec.unpack_from(buffer, offset)[0]
+
+    def pack_many(self, values: _tp.Sequence) -> bytes:
+        """Pack a run of raw values in one call."""
+        try:
+            return struct.pack(f"@{len(values)}{self.format}", *values)
+        except struct.error as e:
+            raise OverflowError(str(e)) from None
+
+    def unpack_many(self, data) -> list:
+        """Unpack a run of packed elements into raw values in one call."""
+        return _cast_view(memoryview(data).cast("B"), self.format).tolist()
+
+
 @dataclass(frozen=True)
 class TypeDescriptor:
     machine_repr: str
     final: bool
     builtin: bool
+    layout: Layout | None = None
 
 
 class Type(type):
@@ -46,13 +109,24 @@ class Type(type):
         return ty
 
 
+# Small ints that `machine_type(intern=True)` types preallocate.
+_INTERN_MIN = -8
+_INTERN_MAX = 1024
+
+
 class BaseMachineType(Type):
+    # Preallocated instances for _INTERN_MIN.._INTERN_MAX, if interned.
+    __mcl_interned__: list | None = None
+
     def __call__(cls, value):
+        if type(value) is int:
+            interned = cls.__mcl_interned__
+            if interned is not None and _INTERN_MIN <= value <= _INTERN_MAX:
+                return interned[value - _INTERN_MIN]
+        elif isinstance(type(value), BaseMachineType):
+            value = value.__value
         obj = object.__new__(cls)
-        if type(value) in cls.registry:
-            obj.__value = _get_machine_value(value)
-        else:
-            obj.__value = value
+        obj.__value = value
         return obj
 
     @classmethod
@@ -61,6 +135,9 @@ class BaseMachineType(Type):
 
 
 def _make_machine_type_methods(ns: dict) -> dict:
+    _drop_slot_descriptors(ns)
+    # A machine value is a single slot holding the raw value.
+    ns["__slots__"] = ("_BaseMachineType__value",)
     def m__repr__(self):
         v = _get_machine_value(self)
         return f"{type(self).__name__}({v})"
@@ -72,41 +149,191 @@ def _make_machine_type_methods(ns: dict) -> dict:
 _get_machine_value = BaseMachineType.get_machine_value
 
 
+def _drop_slot_descriptors(ns: dict) -> None:
+    # The decorated class's own __dict__/__weakref__ descriptors do not apply
+    # to instances of the rebuilt class (breaks vars(), copy and pickle).
+    ns.pop("__dict__", None)
+    ns.pop("__weakref__", None)
+
+
 def _final_init_subclass(self):
     raise TypeError("final type cannot be subclassed")
 
 
-def machine_type(*, final=False, builtin=False):
+def machine_type(
+    *,
+    final=False,
+    builtin=False,
+    layout: str | None = None,
+    intern=False,
+):
+    """`layout` is the native `struct` format of a scalar machine type.
+
+    With `intern=True`, constructing from a small int returns a shared
+    instance; machine values are immutable, so only identity can tell.
+    """
+
     def wrap(cls):
         ns = dict(**cls.__dict__)
         machine_repr = ns.pop("__machine_repr__")
         td = TypeDescriptor(
-            machine_repr=machine_repr, final=final, builtin=builtin
+            machine_repr=machine_repr,
+            final=final,
+            builtin=builtin,
+            layout=None if layout is None else Layout.from_format(layout),
         )
-        return BaseMachineType(
+        typ = BaseMachineType(
             cls.__name__, (), _make_machine_type_methods(ns), td=td
         )
+        if intern:
+            interned = []
+            for v in range(_INTERN_MIN, _INTERN_MAX + 1):
+                obj = object.__new__(typ)
+                obj._BaseMachineType__value = v
+                interned.append(obj)
+            typ.__mcl_interned__ = interned
+        return typ
 
     return wrap
 
 
-_machine_op_table = {}
+_machine_op_table: dict[str, _tp.Callable] = {}
+_machine_op_specializers: dict[str, _tp.Callable] = {}
 
 
-def machine_op[T](opname: str, restype: _tp.Type[T], *args) -> T:
+@_tp.overload
+def machine_op(opname: str, restype: None, *args) -> None: ...
+@_tp.overload
+def machine_op[T](opname: str, restype: _tp.Type[T], *args) -> T: ...
+def machine_op(opname, restype, *args):
     """
     Note: bool is implicit in the system. It is too foundational in Python to
           have an override.
     """
+    return _dispatch(opname, restype, args)
+
+
+def _table_dispatch(opname, restype, args):
     return _machine_op_table[opname](opname, restype, *args)
 
 
+def _specialized_dispatch(opname, restype, args):
+    key = (opname, restype, *map(type, args))
+    try:
+        fn = _checked_cache[key]
+    except KeyError:
+        fn = _checked_cache[key] = specialize_machine_op(
+            opname, restype, *map(type, args)
+        )
+    return fn(*args)
+
+
+def _unchecked_dispatch(opname, restype, args):
+    key = (opname, restype, *map(type, args))
+    try:
+        fn = _unchecked_cache[key]
+    except KeyError:
+        fn = _unchecked_cache[key] = specialize_machine_op(
+            opname, restype, *map(type, args), checked=False
+        )
+    return fn(*args)
+
+
+_checked_cache: dict[tuple, _tp.Callable] = {}
+_unchecked_cache: dict[tuple, _tp.Callable] = {}
+
+_dispatch_modes = {
+    "table": _table_dispatch,
+    "specialized": _specialized_dispatch,
+    "unchecked": _unchecked_dispatch,
+}
+_dispatch_mode = "table"
+# Wrappers of the mode dispatcher, innermost first; see `dispatch_hook`.
+_dispatch_hooks: list[_tp.Callable[[_tp.Callable], _tp.Callable]] = []
+_dispatch = _table_dispatch
+
+
+def _install_dispatch() -> None:
+    global _dispatch
+    dispatch = _dispatch_modes[_dispatch_mode]
+    for hook in _dispatch_hooks:
+        dispatch = hook(dispatch)
+    _dispatch = dispatch
+
+
+def set_dispatch_mode(mode: str) -> str:
+    """Select how `machine_op` resolves operations. Returns the previous mode.
+
+    - "table": look up `_machine_op_table` on every call (the reference).
+    - "specialized": resolve each `(opname, restype, *argtypes)` once into a
+      cached callable. Type checks run once at resolution time.
+    - "unchecked": like "specialized" but skip the type checks entirely.
+
+    Installed `dispatch_hook`s stay in place around the new mode.
+    """
+    global _dispatch_mode
+    if mode not in _dispatch_modes:
+        raise KeyError(mode)
+    prev = _dispatch_mode
+    _dispatch_mode = mode
+    _install_dispatch()
+    return prev
+
+
+@contextmanager
+def dispatch_mode(mode: str):
+    prev = set_dispatch_mode(mode)
+    try:
+        yield
+    finally:
+        set_dispatch_mode(prev)
+
+
+@contextmanager
+def dispatch_hook(hook: _tp.Callable[[_tp.Callable], _tp.Callable]):
+    """Wrap the dispatcher while the block runs.
+
+    `hook(dispatch)` returns the dispatcher to use around `dispatch`; it is
+    called again with the new inner dispatcher whenever the mode changes.
+    Hooks installed later wrap earlier ones.
+    """
+    _dispatch_hooks.append(hook)
+    _install_dispatch()
+    try:
+        yield
+    finally:
+        _dispatch_hooks.remove(hook)
+        _install_dispatch()
+
+
+def specialize_machine_op(
+    opname: str, restype: _tp.Type, *argtypes: type, checked: bool = True
+) -> _tp.Callable:
+    """Resolve a machine operation for fixed argument types.
+
+    The returned callable takes the operands of the operation (without the
+    opname and restype) and is only valid for operands of `argtypes`.
+    """
+    specializer = _machine_op_specializers.get(opname)
+    if specializer is None:
+        return partial(_machine_op_table[opname], opname, restype)
+    return specializer(restype, argtypes, checked)
+
+
 def _reg_op(fn):
     name = fn.__name__.lstrip("_")
     _machine_op_table[name] = fn
     return fn
 
 
+def _reg_specializer(opname: str):
+    def wrap(fn):
+        _machine_op_specializers[opname] = fn
+        return fn
+
+    return wrap
+
+
 def _binop[T](op, restype: _tp.Type[T], *args) -> T:
     (lhs, rhs) = args
     assert type(lhs) is type(rhs)
@@ -149,11 +376,114 @@ def _int_eq[T](opname: str, restype: _tp.Type[T], *args) -> T:
     return _cmpop(operator.eq, restype, *args)
 
 
+@_reg_op
+def _int_ne[T](opname: str, restype: _tp.Type[T], *args) -> T:
+    return _cmpop(operator.ne, restype, *args)
+
+
 @_reg_op
 def _int_lt[T](opname: str, restype: _tp.Type[T], *args) -> T:
     return _cmpop(operator.lt, restype, *args)
 
 
+@_reg_op
+def _float_add[T](opname: str, restype: _tp.Type[T], *args) -> T:
+    return _binop(operator.add, restype, *args)
+
+
+@_reg_op
+def _float_sub[T](opname: str, restype: _tp.Type[T], *args) -> T:
+    return _binop(operator.sub, restype, *args)
+
+
+@_reg_op
+def _float_mul[T](opname: str, restype: _tp.Type[T], *args) -> T:
+    return _binop(operator.mul, restype, *args)
+
+
+@_reg_op
+def _float_truediv[T](opname: str, restype: _tp.Type[T], *args) -> T:
+    return _binop(operator.truediv, restype, *args)
+
+
+@_reg_op
+def _float_eq[T](opname: str, restype: _tp.Type[T], *args) -> T:
+    return _cmpop(operator.eq, restype, *args)
+
+
+@_reg_op
+def _float_ne[T](opname: str, restype: _tp.Type[T], *args) -> T:
+    return _cmpop(operator.ne, restype, *args)
+
+
+@_reg_op
+def _float_lt[T](opname: str, restype: _tp.Type[T], *args) -> T:
+    return _cmpop(operator.lt, restype, *args)
+
+
+# Raw operators behind the arithmetic machine ops. Used by the specialized
+# dispatch to skip the generic `_binop`/`_cmpop` layer.
+_scalar_binops = {
+    "int_add": operator.add,
+    "int_sub": operator.sub,
+    "int_mul": operator.mul,
+    "int_floordiv": operator.floordiv,
+    "float_add": operator.add,
+    "float_sub": operator.sub,
+    "float_mul": operator.mul,
+    "float_truediv": operator.truediv,
+}
+_scalar_cmpops = {
+    "int_eq": operator.eq,
+    "int_ne": operator.ne,
+    "int_lt": operator.lt,
+    "float_eq": operator.eq,
+    "float_ne": operator.ne,
+    "float_lt": operator.lt,
+}
+
+
+def _specialize_binop(op):
+    def specialize(restype, argtypes, checked):
+        if checked:
+            (lhs, rhs) = argtypes
+            assert lhs is rhs
+            assert lhs is restype
+
+        def binop(lhs, rhs):
+            obj = object.__new__(restype)
+            obj._BaseMachineType__value = op(
+                lhs._BaseMachineType__value, rhs._BaseMachineType__value
+            )
+            return obj
+
+        return binop
+
+    return specialize
+
+
+def _specialize_cmpop(op):
+    def specialize(restype, argtypes, checked):
+        if checked:
+            (lhs, rhs) = argtypes
+            assert lhs is rhs
+
+        def cmpop(lhs, rhs):
+            return restype(
+                op(lhs._BaseMachineType__value, rhs._BaseMachineType__value)
+            )
+
+        return cmpop
+
+    return specialize
+
+
+for _name, _op in _scalar_binops.items():
+    _reg_specializer(_name)(_specialize_binop(_op))
+for _name, _op in _scalar_cmpops.items():
+    _reg_specializer(_name)(_specialize_cmpop(_op))
+
+
 @_reg_op
 def _memref_alloc[T](opname: str, restype: _tp.Type[T], *args) -> T:
     [shape, typ] = args
@@ -164,13 +494,104 @@ def _memref_alloc[T](opname: str, restype: _tp.Type[T], *args) -> T:
     return restype(memref)
 
 
+@_reg_op
+def _memref_alloc_mapped(
+    opname: str, restype: type[_mt.memref], *args
+) -> _mt.memref:
+    [shape, typ, path] = args
+    assert restype is _mt.memref
+    assert type(shape) is tuple
+    mv_shape = tuple(map(_get_machine_value, shape))
+    memref = _the_memsys.alloc_mapped(mv_shape, typ, path)
+    return restype(memref)
+
+
+@_reg_op
+def _memref_map_file(
+    opname: str, restype: type[_mt.memref], *args
+) -> _mt.memref:
+    [path, shape, typ, offset, order] = args
+    assert restype is _mt.memref
+    assert type(shape) is tuple
+    mv_shape = tuple(map(_get_machine_value, shape))
+    memref = _the_memsys.map_file(
+        path, mv_shape, typ, _get_machine_value(offset), order
+    )
+    return restype(memref)
+
+
+@_reg_op
+def _memref_share(opname: str, restype: None, *args) -> None:
+    [obj] = args
+    memref: MemRef = _get_machine_value(obj)
+    _the_memsys.share(memref)
+
+
+def share_buffers(*objs) -> None:
+    """Move every allocation reachable from `objs` into shared memory.
+
+    Walks memrefs, struct instances (e.g. `Array`) and tuples/lists.
+    """
+    for obj in objs:
+        if type(obj) is _mt.memref:
+            obj.share()
+        elif isinstance(obj, (tuple, list)):
+            share_buffers(*obj)
+        elif isinstance(type(obj), BaseStructType):
+            share_buffers(*obj.__mcl_struct_fields__.values())
+
+
+@_reg_op
+def _memref_flush(opname: str, restype: None, *args) -> None:
+    [obj] = args
+    memref: MemRef = _get_machine_value(obj)
+    _the_memsys.flush(memref)
+
+
+@_reg_op
+def _memref_from_buffer(
+    opname: str, restype: type[_mt.memref], *args
+) -> _mt.memref:
+    [buffer, shape, typ, offset] = args
+    assert restype is _mt.memref
+    if shape is not None:
+        shape = tuple(map(_get_machine_value, shape))
+    memref = _the_memsys.adopt(
+        buffer, shape, typ, _get_machine_value(offset)
+    )
+    return restype(memref)
+
+
+@_reg_op
+def _memref_memoryview(
+    opname: str, restype: type[memoryview], *args
+) -> memoryview:
+    [obj] = args
+    memref: MemRef = _get_machine_value(obj)
+    return _the_memsys.element_view(memref)
+
+
+@_reg_op
+def _memref_array_interface(
+    opname: str, restype: type[dict], *args
+) -> dict[str, _tp.Any]:
+    [obj] = args
+    memref: MemRef = _get_machine_value(obj)
+    return _the_memsys.array_interface(memref)
+
+
+@lru_cache(maxsize=4096)
+def _intp_tuple(values: tuple[int, ...]) -> tuple:
+    # Shapes and strides repeat across memrefs and calls; share the tuples.
+    return tuple(map(_mt.intp, values))
+
+
 @_reg_op
 def _memref_shape[T](opname: str, restype: _tp.Type[T], *args) -> T:
     [obj] = args
     assert restype is tuple
     memref: MemRef = _get_machine_value(obj)
-    shape = tuple(map(_mt.intp, memref.shape))
-    return shape
+    return _intp_tuple(memref.shape)
 
 
 @_reg_op
@@ -178,8 +599,21 @@ def _memref_strides[T](opname: str, restype: _tp.Type[T], *args) -> T:
     [obj] = args
     assert restype is tuple
     memref: MemRef = _get_machine_value(obj)
-    strides = tuple(map(_mt.intp, memref.strides))
-    return strides
+    return _intp_tuple(memref.strides)
+
+
+@_reg_op
+def _memref_c_contiguous(opname: str, restype: type[bool], *args) -> bool:
+    [obj] = args
+    memref: MemRef = _get_machine_value(obj)
+    return memref.c_contiguous
+
+
+@_reg_op
+def _memref_f_contiguous(opname: str, restype: type[bool], *args) -> bool:
+    [obj] = args
+    memref: MemRef = _get_machine_value(obj)
+    return memref.f_contiguous
 
 
 @_reg_op
@@ -209,6 +643,105 @@ def _memref_load[T](opname: str, restype: _tp.Type[T], *args) -> T:
     return restype(_the_memsys.read(memref, indices))
 
 
+@_reg_specializer("memref_store")
+def _specialize_memref_store(restype, argtypes, checked):
+    if checked:
+        [_, indices, _] = argtypes
+        assert indices is tuple
+
+    def store(obj, indices, val):
+        _the_memsys.write(
+            obj._BaseMachineType__value,
+            tuple([i._BaseMachineType__value for i in indices]),
+            val,
+        )
+
+    return store
+
+
+@_reg_specializer("memref_load")
+def _specialize_memref_load(restype, argtypes, checked):
+    if checked:
+        [_, indices] = argtypes
+        assert indices is tuple
+
+    def load(obj, indices):
+        value = _the_memsys.read(
+            obj._BaseMachineType__value,
+            tuple([i._BaseMachineType__value for i in indices]),
+        )
+        if type(value) is restype:
+            return value
+        return restype(value)
+
+    return load
+
+
+@_reg_op
+def _memref_load_block(
+    opname: str, restype: type[bytes], *args
+) -> bytes | bytearray:
+    [obj, start, shape] = args
+    assert restype is bytes
+    assert type(start) is tuple
+    assert type(shape) is tuple
+    memref: MemRef = _get_machine_value(obj)
+    start = tuple(map(_get_machine_value, start))
+    shape = tuple(map(_get_machine_value, shape))
+    return _the_memsys.read_block(memref, start, shape)
+
+
+@_reg_op
+def _memref_store_block(opname: str, restype: None, *args) -> None:
+    [obj, start, shape, data] = args
+    assert type(start) is tuple
+    assert type(shape) is tuple
+    memref: MemRef = _get_machine_value(obj)
+    start = tuple(map(_get_machine_value, start))
+    shape = tuple(map(_get_machine_value, shape))
+    _the_memsys.write_block(memref, start, shape, data)
+
+
+@_reg_op
+def _memref_assign(opname: str, restype: None, *args) -> None:
+    [obj, src] = args
+    memref: MemRef = _get_machine_value(obj)
+    source: MemRef = _get_machine_value(src)
+    if memref.datatype is not source.datatype:
+        raise TypeError("memrefs must have the same datatype")
+    _the_memsys.assign(memref, source)
+
+
+@_reg_op
+def _memref_fill(opname: str, restype: None, *args) -> None:
+    [obj, value] = args
+    memref: MemRef = _get_machine_value(obj)
+    _the_memsys.fill(memref, value)
+
+
+@_reg_op
+def _memref_gather(opname: str, restype: type[bytes], *args) -> bytes:
+    [obj, indices] = args
+    assert restype is bytes
+    memref: MemRef = _get_machine_value(obj)
+    return _the_memsys.gather(memref, indices)
+
+
+@_reg_op
+def _memref_take(opname: str, restype: type[bytes], *args) -> bytes:
+    [obj, offsets] = args
+    assert restype is bytes
+    memref: MemRef = _get_machine_value(obj)
+    return _the_memsys.take(memref, offsets)
+
+
+@_reg_op
+def _memref_scatter(opname: str, restype: None, *args) -> None:
+    [obj, indices, data] = args
+    memref: MemRef = _get_machine_value(obj)
+    _the_memsys.scatter(memref, indices, data)
+
+
 @_reg_op
 def _memref_view[T](opname: str, restype: _tp.Type[T], *args) -> T:
     [obj, new_shape, new_strides, offset] = args
@@ -224,7 +757,7 @@ def _memref_view[T](opname: str, restype: _tp.Type[T], *args) -> T:
         strides=new_strides,
         datatype=memref.datatype,
         itemsize=memref.itemsize,
-        size=reduce(operator.mul, new_shape) * memref.itemsize,
+        size=_nelems(new_shape) * memref.itemsize,
         offset=offset
     )
     return restype(new_memref)
@@ -238,6 +771,118 @@ def _memref_copy[T](opname: str, restype: _tp.Type[T], *args) -> T:
     return restype(new_memref)
 
 
+@_reg_op
+def _memref_datatype(opname: str, restype: type[type], *args) -> type:
+    [obj] = args
+    assert restype is type
+    memref: MemRef = _get_machine_value(obj)
+    return memref.datatype
+
+
+@_reg_op
+def _memref_elementwise(opname: str, restype: None, *args) -> None:
+    [fn, obj, *inputs] = args
+    out: MemRef = _get_machine_value(obj)
+    in_memrefs = [_get_machine_value(x) for x in inputs]
+    for x in in_memrefs:
+        if x.shape != out.shape:
+            raise ValueError("elementwise operands must match the output shape")
+    _the_memsys.elementwise(fn, out, in_memrefs)
+
+
+def elementwise_op(opname: str) -> _tp.Callable:
+    """Return the raw scalar function of an arithmetic or comparison machine
+    op, for use with `memref.elementwise`.
+    """
+    fn = _scalar_binops.get(opname) or _scalar_cmpops.get(opname)
+    if fn is None:
+        raise TypeError(f"no elementwise kernel for {opname!r}")
+    return fn
+
+
+_infix_ops = {
+    operator.add: "+",
+    operator.sub: "-",
+    operator.mul: "*",
+    operator.floordiv: "//",
+    operator.truediv: "/",
+    operator.eq: "==",
+    operator.ne: "!=",
+    operator.lt: "<",
+}
+
+
+def fuse_elementwise(expr: tuple) -> _tp.Callable:
+    """Compile an expression tree into one function for `memref.elementwise`.
+
+    Nodes are `("input", k)` for the k-th input element, `("const", raw)`
+    and `(fn, *operands)` with `fn` a raw scalar function (see
+    `elementwise_op`). Subtrees shared by identity are computed once per
+    element. The tree is kept as `__mcl_expr__` on the result so that
+    backends can evaluate it natively, and a variant mapping whole columns
+    as `__mcl_block__`.
+    """
+    ns: dict[str, _tp.Any] = {}
+    lines: list[str] = []
+    names: dict[int, str] = {}
+    ninputs = 0
+
+    def emit(node) -> str:
+        nonlocal ninputs
+        cached = names.get(id(node))
+        if cached is not None:
+            return cached
+        name: str
+        match node:
+            case ("input", k):
+                ninputs = max(ninputs, k + 1)
+                name = f"x{k}"
+            case ("const", value):
+                name = f"k{len(ns)}"
+                ns[name] = value
+            case (fn, *operands):
+                args = [emit(x) for x in operands]
+                name = f"t{len(lines)}"
+                sym = _infix_ops.get(fn)
+                if sym is not None and len(args) == 2:
+                    lines.append(f"{name} = {args[0]} {sym} {args[1]}")
+                else:
+                    ns[f"f{len(lines)}"] = fn
+                    call = f"f{len(lines)}({', '.join(args)})"
+                    lines.append(f"{name} = {call}")
+        names[id(node)] = name
+        return name
+
+    result = emit(expr)
+    params = ", ".join(f"x{k}" for k in range(ninputs))
+    body = "".join(f"\n    {line}" for line in lines)
+    exec(f"def fused({params}):{body}\n    return {result}", ns)
+    fused = ns["fused"]
+    fused.__mcl_expr__ = expr
+    # The same loop over whole blocks of columns, for `elementwise`; it
+    # saves a Python call per element.
+    cols = ", ".join(f"c{k}" for k in range(ninputs))
+    inner = "".join(f"\n        {line}" for line in lines)
+    exec(
+        f"def fused_block({cols}):\n"
+        f"    res = []\n"
+        f"    append = res.append\n"
+        f"    for ({params},) in zip({cols}):{inner}\n"
+        f"        append({result})\n"
+        f"    return res",
+        ns,
+    )
+    fused.__mcl_block__ = ns["fused_block"]
+    return fused
+
+
+@_reg_op
+def _memref_free(opname: str, restype: None, *args) -> None:
+    [obj] = args
+    memref: MemRef = _get_machine_value(obj)
+    _the_memsys.free(memref)
+
+
 @_reg_op
 def _tuple_cast[T](opname: str, restype: _tp.Type[T], *args) -> T:
     [resty, tup] = args
@@ -251,68 +896,59 @@ def _cast[T](opname: str, restype: _tp.Type[T], *args) -> T:
     return restype(_get_machine_value(v0))
 
 
-def _from_bytes[T](restype: _tp.Type[T], raw: bytes) -> T:
-    match restype:
-        case _mt.i32:
-            return restype(int.from_bytes(raw, signed=True))
-        case _:
-            raise TypeError(restype)
-    raise AssertionError
+def layout_of(typ: _tp.Type) -> Layout:
+    """Return the memory layout of the machine type `typ`."""
+    td = getattr(typ, "__mcl_type_descriptor__", None)
+    if td is None or td.layout is None:
+        raise TypeError(f"invalid type {typ}")
+    return td.layout
 
 
-def _to_bytes[T](value: T) -> bytes:
-    mv = _get_machine_value(value)
-    out: bytes
-    match type(value):
-        case _mt.i32:
-            out = mv.to_bytes(4, signed=True)
-        case _:
-            raise TypeError(f"invalid type {type(value)}")
+class BaseStructType(Type):
+    # Instances are built by the generated __init__ (see `struct_type`);
+    # skip the Python-level Type.__call__.
+    __call__ = type.__call__
 
-    return out
+    __mcl_struct_field_names__: tuple[str, ...] = ()
 
 
-def _sizeof(restype: _tp.Type) -> int:
-    match restype:
-        case _mt.i32:
-            out = 4
-        case _:
-            raise TypeError(f"invalid type {restype}")
+def _struct_field_names(cls) -> tuple[str, ...]:
+    """Base class fields first, then the fields annotated on `cls`."""
+    names = {}
+    for base in reversed(cls.__bases__):
+        names.update(
+            dict.fromkeys(getattr(base, "__mcl_struct_field_names__", ()))
+        )
+    names.update(dict.fromkeys(inspect.get_annotations(cls)))
+    return tuple(names)
 
-    return out
 
+def _make_struct_init(fields: tuple[str, ...]):
+    args = "".join(f", {f}" for f in fields)
+    body = "".join(f"\n    self.{f} = {f}" for f in fields) or "\n    pass"
+    ns: dict[str, _tp.Any] = {}
+    exec(f"def __init__(self{args}):{body}", ns)
+    return ns["__init__"]
 
-class BaseStructType(Type):
-    def __call__(cls, *args, **kwargs):
-        hints = _tp.get_type_hints(cls)
-        params = []
-        for name, annotation in hints.items():
-            params.append(
-                inspect.Parameter(
-                    name,
-                    kind=inspect.Parameter.POSITIONAL_OR_KEYWORD,
-                    annotation=annotation,
-                )
-            )
-        bound = inspect.Signature(params).bind(*args, **kwargs)
-        fields = {k: v for k, v in bound.arguments.items()}
 
-        obj = object.__new__(cls)
-        # TODO add type check
-        obj.__mcl_struct_fields__ = fields
-        return obj
+def _make_struct_methods(ns: dict, fields: tuple[str, ...], bases: tuple):
+    _drop_slot_descriptors(ns)
 
+    if "__init__" in ns:
+        raise TypeError("struct_type must not define __init__")
+    # TODO add type check
+    ns["__init__"] = _make_struct_init(fields)
+    ns["__mcl_struct_field_names__"] = fields
+    inherited: set[str] = set()
+    for base in bases:
+        inherited.update(getattr(base, "__mcl_struct_field_names__", ()))
+    ns["__slots__"] = tuple(f for f in fields if f not in inherited)
 
-def _make_struct_methods(ns: dict):
-    def m__getattr__(self, k):
-        fields = self.__mcl_struct_fields__
-        if k not in fields:
-            raise AttributeError(k)
-        return fields[k]
+    def m__mcl_struct_fields__(self) -> dict:
+        names = type(self).__mcl_struct_field_names__
+        return {k: getattr(self, k) for k in names}
 
-    if "__getattr__" in ns:
-        raise TypeError("struct_type must not define __getattr__")
-    ns["__getattr__"] = m__getattr__
+    ns["__mcl_struct_fields__"] = property(m__mcl_struct_fields__)
 
     def m__repr__(self) -> str:
         params = [f"{k}={v}" for k, v in self.__mcl_struct_fields__.items()]
@@ -324,22 +960,44 @@ def _make_struct_methods(ns: dict):
     return ns
 
 
+@_tp.dataclass_transform()
 def struct_type(*, final=False, builtin=False):
+    """Build a struct class from the annotated fields of `cls` and its struct
+    bases. Field names are resolved once here: instances are slotted and
+    constructed by a generated `__init__(self, *fields)`.
+    """
+
     def wrap(cls):
         ns = dict(**cls.__dict__)
         machine_repr = "struct"
         td = TypeDescriptor(
             machine_repr=machine_repr, final=final, builtin=builtin
         )
+        fields = _struct_field_names(cls)
         return BaseStructType(
-            cls.__name__, cls.__bases__, _make_struct_methods(ns), td=td
+            cls.__name__,
+            cls.__bases__,
+            _make_struct_methods(ns, fields, cls.__bases__),
+            td=td,
         )
 
     return wrap
 
 
-@dataclass(frozen=True)
+# Ids of allocations, unique in this process.
+_buffer_ids = itertools.count()
+
+
+@dataclass(frozen=True, eq=False)
 class MemRef:
+    """An owner of an allocation, or a view of one.
+
+    A view's `owner` is always the root owner and its `offset` is in bytes
+    from the start of the root's buffer, so nothing walks a chain of views.
+    `buffer_id` is the id of the allocation, shared by its views; memory
+    systems key their buffers by it. MemRefs hash by identity.
+    """
+
     shape: tuple[int, ...]
     strides: tuple[int, ...]
     datatype: _tp.Type
@@ -347,6 +1005,18 @@ class MemRef:
     size: int
     owner: MemRef | None = None
     offset: int = 0
+    buffer_id: int = field(init=False, repr=False)
+
+    def __post_init__(self):
+        owner = self.owner
+        if owner is None:
+            buffer_id = next(_buffer_ids)
+        else:
+            if owner.owner is not None:
+                owner = owner.owner
+                object.__setattr__(self, "owner", owner)
+            buffer_id = owner.buffer_id
+        object.__setattr__(self, "buffer_id", buffer_id)
 
     def __repr__(self) -> str:
         buf = [f"<{hex(id(self))} shape={self.shape} strides={self.strides}"]
@@ -359,10 +1029,198 @@ class MemRef:
         if id(self) == id(value):
             return True        
 
+    __hash__ = object.__hash__
+
+    @cached_property
+    def layout(self) -> Layout:
+        return layout_of(self.datatype)
+
+    # Memrefs are immutable, so the contiguity flags are computed once.
+    @cached_property
+    def c_contiguous(self) -> bool:
+        return _is_c_contiguous(self.shape, self.strides, self.itemsize)
+
+    @cached_property
+    def f_contiguous(self) -> bool:
+        return _is_f_contiguous(self.shape, self.strides, self.itemsize)
+
     def handle(self) -> MemRef:
-        if self.owner:
-            return self.owner.handle()
-        return self
+        owner = self.owner
+        return self if owner is None else owner
+
+    def __reduce__(self):
+        # A view pickles its fields; an owner pickles a token of its shared
+        # storage so another process attaches to the same buffer.
+        fields = (self.shape, self.strides, self.datatype, self.itemsize,
+                  self.size)
+        if self.owner is not None:
+            return (MemRef, fields + (self.owner, self.offset))
+        token = _the_memsys.export(self)
+        return (_attach_memref, (token, *fields, self.offset))
+
+
+def _attach_memref(token, shape, strides, datatype, itemsize, size, offset):
+    memref = MemRef(shape, strides, datatype, itemsize, size, None, offset)
+    return _the_memsys.attach(token, memref)
+
+
+@dataclass(frozen=True, slots=True)
+class Allocation:
+    """A live allocation as recorded by its `MemorySystem`.
+
+    `site` holds the innermost frames outside the VM that made the
+    allocation, as `"file:line function"`, when sites are recorded (see
+    `MemorySystem.record_sites`).
+    """
+
+    serial: int
+    shape: tuple[int, ...]
+    dtype: str
+    nbytes: int
+    site: tuple[str, ...] = ()
+
+
+@dataclass(frozen=True, slots=True)
+class AllocationGroup:
+    """Live allocations sharing a key; `views` counts their live views."""
+
+    key: _tp.Any
+    count: int
+    nbytes: int
+    views: int
+
+
+@dataclass(frozen=True, slots=True)
+class AllocationDiff:
+    """The change of an `AllocationGroup` between two snapshots."""
+
+    key: _tp.Any
+    count: int
+    count_diff: int
+    nbytes: int
+    nbytes_diff: int
+
+
+# How `MemorySnapshot` groups allocations.
+_allocation_keys = {
+    "site": lambda a: a.site[0] if a.site else "<unknown>",
+    "traceback": lambda a: a.site or ("<unknown>",),
+    "shape": lambda a: a.shape,
+    "dtype": lambda a: a.dtype,
+    "shape_dtype": lambda a: (a.shape, a.dtype),
+}
+
+
+@dataclass(frozen=True)
+class MemorySnapshot:
+    """The live allocations of a `MemorySystem` at one point in time.
+
+    `views` maps the serial of each allocation to its number of live views.
+    """
+
+    allocations: tuple[Allocation, ...]
+    views: dict[int, int]
+    live_bytes: int
+    peak_bytes: int
+
+    def statistics(self, key: str = "site") -> list[AllocationGroup]:
+        """Group the allocations by `key`, largest first.
+
+        `key` is one of "site", "traceback", "shape", "dtype" and
+        "shape_dtype".
+        """
+        keyfn = _allocation_keys[key]
+        groups: dict[_tp.Any, tuple[int, int, int]] = {}
+        for a in self.allocations:
+            (count, nbytes, views) = groups.get(keyfn(a), (0, 0, 0))
+            groups[keyfn(a)] = (
+                count + 1, nbytes + a.nbytes, views + self.views[a.serial]
+            )
+        return sorted(
+            (AllocationGroup(k, *v) for k, v in groups.items()),
+            key=lambda g: (g.nbytes, g.count),
+            reverse=True,
+        )
+
+    def compare_to(
+        self, old: MemorySnapshot, key: str = "site"
+    ) -> list[AllocationDiff]:
+        """What changed since `old`, the largest growth first; unchanged
+        groups are left out.
+        """
+        before = {g.key: g for g in old.statistics(key)}
+        diffs = []
+        for g in self.statistics(key):
+            prev = before.pop(g.key, None)
+            (count, nbytes) = (prev.count, prev.nbytes) if prev else (0, 0)
+            diffs.append(AllocationDiff(
+                g.key, g.count, g.count - count, g.nbytes, g.nbytes - nbytes
+            ))
+        for g in before.values():
+            diffs.append(AllocationDiff(g.key, 0, -g.count, 0, -g.nbytes))
+        return sorted(
+            (d for d in diffs if d.count_diff or d.nbytes_diff),
+            key=lambda d: (d.nbytes_diff, d.count_diff),
+            reverse=True,
+        )
+
+    def report(
+        self,
+        top: int = 10,
+        key: str = "site",
+        baseline: MemorySnapshot | None = None,
+    ) -> str:
+        """A text report of the `top` largest groups of live allocations,
+        or of the largest growth since `baseline`.
+        """
+        lines = [
+            f"live {self.live_bytes} bytes in {len(self.allocations)} "
+            f"allocations, peak {self.peak_bytes} bytes"
+        ]
+        if baseline is None:
+            lines.append(f"{'bytes':>12}{'count':>8}{'views':>8}  {key}")
+            for g in self.statistics(key)[:top]:
+                lines.append(
+                    f"{g.nbytes:>12}{g.count:>8}{g.views:>8}  {g.key}"
+                )
+        else:
+            lines.append(
+                f"{'bytes':>12}{'+bytes':>12}{'count':>8}{'+count':>8}"
+                f"  {key}"
+            )
+            for d in self.compare_to(baseline, key)[:top]:
+                lines.append(
+                    f"{d.nbytes:>12}{d.nbytes_diff:>+12}{d.count:>8}"
+                    f"{d.count_diff:>+8}  {d.key}"
+                )
+        return "\n".join(lines)
+
+
+# Number of frames kept in `Allocation.site`.
+_SITE_DEPTH = 4
+
+
+def _alloc_site() -> tuple[str, ...]:
+    # Skip the frames of the VM itself, so sites name the caller (an Array
+    # method, a dialect or user code).
+    here = os.path.dirname(__file__)
+    internal = {
+        __file__,
+        _mt.__file__,
+        os.path.join(here, "numpy_memsys.py"),
+        os.path.join(here, "profiling.py"),
+    }
+    site: list[str] = []
+    frame: types.FrameType | None = sys._getframe(1)
+    while frame is not None and len(site) < _SITE_DEPTH:
+        code = frame.f_code
+        if code.co_filename not in internal:
+            site.append(
+                f"{os.path.basename(code.co_filename)}:{frame.f_lineno} "
+                f"{code.co_qualname}"
+            )
+        frame = frame.f_back
+    return tuple(site)
 
 
 class MemorySystem:
@@ -370,61 +1228,538 @@ class MemorySystem:
 
     To provide safe memory operation, all memory manipulation must go through
     this class. No pointer arithmetic.
+
+    This is the reference backend. Alternative backends subclass it and must
+    keep `_memmap` mapping the `buffer_id` of each owner to a
+    byte-addressable buffer, so that the generic methods remain valid; they
+    override whichever of `alloc`, `read`, `write`, `view`, `copy` and the
+    bulk methods they can serve natively. See `make_memory_system`.
+
+    Owners and views are only weakly referenced. An allocation is released
+    when its owner MemRef and every view of it become unreachable, or
+    explicitly with `free`.
     """
 
-    _memmap: dict[MemRef, bytearray]
-    _viewmap: dict[MemRef, list[MemRef]]
-    _last_addr: int
+    _memmap: dict[int, bytearray]
+    _viewmap: weakref.WeakKeyDictionary[MemRef, weakref.WeakSet[MemRef]]
+    _finalizers: weakref.WeakKeyDictionary[MemRef, weakref.finalize]
+    _mappings: weakref.WeakKeyDictionary[MemRef, mmap.mmap]
+    _mapped_paths: weakref.WeakKeyDictionary[MemRef, str]
+    _shared: weakref.WeakKeyDictionary[MemRef, shared_memory.SharedMemory]
+    _adopted: weakref.WeakSet[MemRef]
+    _attached: weakref.WeakValueDictionary[tuple[str, str], MemRef]
+    _allocations: weakref.WeakKeyDictionary[MemRef, Allocation]
+    _serials: itertools.count
+    live_bytes: int
+    live_allocations: int
+    peak_bytes: int
+    # Record the call site of each allocation (costs a stack walk).
+    record_sites: bool = False
 
     def __init__(self):
         self._memmap = {}
-        self._viewmap = {}
+        self._viewmap = weakref.WeakKeyDictionary()
+        self._finalizers = weakref.WeakKeyDictionary()
+        self._mappings = weakref.WeakKeyDictionary()
+        self._mapped_paths = weakref.WeakKeyDictionary()
+        self._shared = weakref.WeakKeyDictionary()
+        self._adopted = weakref.WeakSet()
+        self._attached = weakref.WeakValueDictionary()
+        self._allocations = weakref.WeakKeyDictionary()
+        self._serials = itertools.count()
+        self.live_bytes = 0
+        self.live_allocations = 0
+        self.peak_bytes = 0
 
     def alloc(self, shape: tuple[int, ...], datatype: _tp.Type) -> MemRef:
-        itemsize = _sizeof(datatype)
-        nbytes = reduce(operator.mul, shape) * itemsize
-        assert nbytes != 0
-        # compute strides
-        strides = []
-        last = itemsize
-        for s in reversed(shape):
-            strides.append(last)
-            last *= s
-        strides.reverse()
-        assert last == nbytes
-        memref = MemRef(
-            shape=shape,
-            strides=tuple(strides),
-            datatype=datatype,
-            itemsize=itemsize,
-            size=nbytes,
+        memref = _contiguous_memref(shape, datatype)
+        self._register(memref, self._new_buffer(memref))
+        return memref
+
+    def alloc_mapped(
+        self,
+        shape: tuple[int, ...],
+        datatype: _tp.Type,
+        path: str | os.PathLike | None = None,
+    ) -> MemRef:
+        """Allocate a row-major owner backed by `mmap`.
+
+        With `path=None` the mapping is anonymous. Otherwise the file at
+        `path` is mapped, created or grown (sparse, zero-filled) to fit, and
+        its existing contents are kept. Pages are loaded and written back by
+        the OS on demand, so the allocation may exceed physical memory.
+        """
+        memref = _contiguous_memref(shape, datatype)
+        if path is None:
+            mapping = mmap.mmap(-1, memref.size)
+        else:
+            path = os.fspath(path)
+            mapping = _map_file(path, memref.size)
+            self._mapped_paths[memref] = path
+        self._mappings[memref] = mapping
+        self._register(memref, self._adopt_buffer(memref, mapping))
+        return memref
+
+    def map_file(
+        self,
+        path: str | os.PathLike,
+        shape: tuple[int, ...],
+        datatype: _tp.Type,
+        offset: int = 0,
+        order: str = "C",
+    ) -> MemRef:
+        """Map the existing file at `path` as an owner whose elements start at
+        byte `offset`, in row-major ("C") or column-major ("F") `order`.
+
+        Nothing is read up front. Stores are written back to the file.
+        """
+        path = os.fspath(path)
+        memref = _contiguous_memref(shape, datatype, order, offset)
+        nbytes = offset + memref.size
+        if os.path.getsize(path) < nbytes:
+            raise ValueError(f"{path} is too small for the mapped data")
+        mapping = _map_file(path, nbytes, create=False)
+        self._mapped_paths[memref] = path
+        self._mappings[memref] = mapping
+        self._register(memref, self._adopt_buffer(memref, mapping))
+        return memref
+
+    def share(self, memref: MemRef) -> None:
+        """Make the allocation of `memref` visible to other processes.
+
+        Its contents move into `multiprocessing.shared_memory` (file
+        mappings are already shareable). Afterwards a pickled memref attaches
+        to the same storage in the receiving process, so stores there are
+        seen here without copying.
+
+        Owners of adopted buffers (`adopt`) raise BufferError: their storage
+        belongs to the caller and cannot move; share a copy instead.
+        """
+        root = memref.handle()
+        buffer = self._buffer(root)
+        if root in self._shared or root in self._mapped_paths:
+            return
+        if root in self._adopted:
+            raise BufferError(
+                f"memref {root} is backed by an adopted buffer, which cannot"
+                " move to shared memory; share a copy() instead"
+            )
+        # The elements keep their offset, so views of the owner stay valid.
+        (start, stop) = (root.offset, root.offset + root.size)
+        # Segments cannot be empty.
+        shm = shared_memory.SharedMemory(create=True, size=max(stop, 1))
+        segment = shm.buf
+        assert segment is not None
+        segment[start:stop] = memoryview(buffer).cast("B")[start:stop]
+        mapping = self._mappings.pop(root, None)
+        del buffer
+        self._memmap[root.buffer_id] = self._adopt_buffer(root, shm.buf)
+        self._shared[root] = shm
+        self._attached[("shm", shm.name)] = root
+        weakref.finalize(
+            root, self._release_shared, root.buffer_id, shm, os.getpid()
         )
-        buffer = bytearray(nbytes)
-        self._memmap[memref] = buffer
+        if mapping is not None:
+            _close_mapping(mapping)
+
+    def export(self, memref: MemRef) -> tuple[str, str]:
+        """Return the token another process uses to `attach` to the shared
+        allocation owned by `memref`.
+        """
+        self._buffer(memref)
+        if memref in self._shared:
+            return ("shm", self._shared[memref].name)
+        if memref in self._mapped_paths:
+            return ("file", self._mapped_paths[memref])
+        raise pickle.PicklingError(
+            f"memref {memref} is not shared; call share() first"
+        )
+
+    def attach(self, token: tuple[str, str], memref: MemRef) -> MemRef:
+        """Register the owner `memref` over the shared storage named by
+        `token`. Returns the already attached owner if there is one.
+        """
+        existing = self._attached.get(token)
+        if existing is not None:
+            return existing
+        (kind, name) = token
+        buffer: memoryview | mmap.mmap | None
+        match kind:
+            case "shm":
+                shm = _attach_shared(name)
+                buffer = shm.buf
+                self._shared[memref] = shm
+                weakref.finalize(
+                    memref, self._release_shared, memref.buffer_id, shm, None
+                )
+            case "file":
+                buffer = _map_file(
+                    name, memref.offset + memref.size, create=False
+                )
+                self._mappings[memref] = buffer
+                self._mapped_paths[memref] = name
+            case _:
+                raise ValueError(f"invalid token {token}")
+        self._register(memref, self._adopt_buffer(memref, buffer))
+        self._attached[token] = memref
+        return memref
+
+    def flush(self, memref: MemRef) -> None:
+        """Write back dirty pages of a mapped allocation to its file.
+
+        A no-op for allocations that are not mapped.
+        """
+        self._buffer(memref)
+        mapping = self._mappings.get(memref.handle())
+        if mapping is not None:
+            mapping.flush()
+
+    def adopt(
+        self,
+        buffer,
+        shape: tuple[int, ...] | None = None,
+        datatype: _tp.Type | None = None,
+        offset: int = 0,
+    ) -> MemRef:
+        """Register the writable, C-contiguous `buffer` (any object with the
+        buffer protocol) as the storage of a new row-major owner, without
+        copying.
+
+        `shape` and `datatype` default to those of the buffer's own format,
+        as for a NumPy array. The elements start at byte `offset`. The
+        exporter stays locked (e.g. a bytearray cannot be resized) while the
+        owner is alive.
+        """
+        view = memoryview(buffer)
+        if view.readonly:
+            raise TypeError("cannot adopt a read-only buffer")
+        if not view.c_contiguous:
+            raise BufferError("cannot adopt a non-contiguous buffer")
+        if datatype is None:
+            datatype = _type_of_format(view.format)
+        if shape is None:
+            if view.itemsize != layout_of(datatype).size:
+                raise TypeError("datatype does not match the buffer format")
+            shape = view.shape or ()
+        view = view.cast("B")
+        memref = _contiguous_memref(shape, datatype, "C", offset)
+        if offset < 0 or offset + memref.size > len(view):
+            raise ValueError("buffer is too small for the adopted shape")
+        self._register(memref, self._adopt_buffer(memref, view))
+        self._adopted.add(memref)
         return memref
 
+    def element_view(self, memref: MemRef) -> memoryview:
+        """A writable memoryview of the elements of `memref`, sharing its
+        storage, with its shape and format.
+
+        memoryview cannot express general strides: C-contiguous memrefs
+        and one-dimensional strided views are supported, other layouts
+        raise BufferError (see `array_interface`). Nor can it have zeros in
+        a multi-dimensional shape, so only one-dimensional empty memrefs
+        are supported.
+        """
+        buf = memoryview(self._buffer(memref)).cast("B")
+        fmt = memref.layout.format
+        (shape, strides) = (memref.shape, memref.strides)
+        (offset, itemsize) = (memref.offset, memref.itemsize)
+        nbytes = _nelems(shape) * itemsize
+        if nbytes == 0:
+            if len(shape) != 1:
+                raise BufferError(
+                    f"memref {memref} is empty; memoryview cannot have the"
+                    " shape, use __array_interface__"
+                )
+            return _cast_view(buf[offset:offset], fmt)
+        if memref.c_contiguous:
+            return _cast_view(buf[offset : offset + nbytes], fmt, shape)
+        if len(shape) == 1 and strides[0] and strides[0] % itemsize == 0:
+            [n] = shape
+            [stride] = strides
+            last = offset + (n - 1) * stride
+            (lo, hi) = (min(offset, last), max(offset, last) + itemsize)
+            step = stride // itemsize
+            flat = _cast_view(buf[lo:hi], fmt)
+            return flat[::step] if step >= 0 else flat[::-1][::-step]
+        raise BufferError(
+            f"memref {memref} is not contiguous; use __array_interface__"
+        )
+
+    def array_interface(self, memref: MemRef) -> dict[str, _tp.Any]:
+        """The NumPy `__array_interface__` (version 3) of `memref`.
+
+        The data is the owner's byte buffer at the memref's offset, so any
+        layout is exported without copying.
+        """
+        buf = memoryview(self._buffer(memref)).cast("B")
+        return {
+            "version": 3,
+            "shape": memref.shape,
+            "typestr": _typestr(memref.datatype),
+            "data": buf,
+            "offset": memref.offset,
+            "strides": memref.strides,
+        }
+
+    def _register(self, memref: MemRef, buffer) -> None:
+        """Track `buffer` as the storage of the new owner `memref`."""
+        self._memmap[memref.buffer_id] = buffer
+        self._finalizers[memref] = weakref.finalize(
+            memref, self._release, memref.buffer_id, memref.size
+        )
+        self._allocations[memref] = Allocation(
+            next(self._serials),
+            memref.shape,
+            memref.datatype.__name__,
+            memref.size,
+            _alloc_site() if self.record_sites else (),
+        )
+        self.live_bytes += memref.size
+        self.live_allocations += 1
+        self.peak_bytes = max(self.peak_bytes, self.live_bytes)
+
+    def _release(self, buffer_id: int, nbytes: int) -> None:
+        self._memmap.pop(buffer_id, None)
+        self.live_bytes -= nbytes
+        self.live_allocations -= 1
+
+    def _release_shared(
+        self,
+        buffer_id: int,
+        shm: shared_memory.SharedMemory,
+        creator_pid: int | None,
+    ) -> None:
+        # Finalizers also run at exit, while the owner is still alive; drop
+        # our references to the segment's buffer first so it can be closed.
+        self._drop_buffer(buffer_id)
+        _release_shared(shm, creator_pid)
+
+    def _drop_buffer(self, buffer_id: int) -> None:
+        """Forget the storage of the buffer `buffer_id`.
+
+        Backends that keep their own objects over the storage override this
+        to drop them too.
+        """
+        self._memmap.pop(buffer_id, None)
+
+    def reset_peak(self) -> None:
+        """Restart `peak_bytes` from the current live bytes."""
+        self.peak_bytes = self.live_bytes
+
+    def snapshot(self) -> MemorySnapshot:
+        """Take a `MemorySnapshot` of the live allocations."""
+        allocations = []
+        views = {}
+        for memref, info in list(self._allocations.items()):
+            allocations.append(info)
+            views[info.serial] = len(self._viewmap.get(memref, ()))
+        return MemorySnapshot(
+            tuple(allocations), views, self.live_bytes, self.peak_bytes
+        )
+
+    def leak_report(self, top: int = 10, key: str = "site") -> str:
+        """Report the `top` largest groups of live allocations."""
+        return self.snapshot().report(top, key)
+
+    def _buffer(self, memref: MemRef):
+        """Return the buffer of the owner of `memref`."""
+        try:
+            return self._memmap[memref.buffer_id]
+        except KeyError:
+            raise ValueError(f"use of freed memref {memref}") from None
+
+    def free(self, memref: MemRef) -> None:
+        """Release the allocation owned by `memref` now.
+
+        Views of it become invalid; using them raises ValueError. A mapped
+        allocation is flushed and its mapping closed.
+        """
+        if memref.owner is not None:
+            raise ValueError("only the owner of an allocation can be freed")
+        if memref.buffer_id not in self._memmap:
+            raise ValueError(f"double free of memref {memref}")
+        del self._memmap[memref.buffer_id]
+        self._viewmap.pop(memref, None)
+        self._allocations.pop(memref, None)
+        self._finalizers.pop(memref)()
+        mapping = self._mappings.pop(memref, None)
+        if mapping is not None:
+            mapping.flush()
+            _close_mapping(mapping)
+
+    def _new_buffer(self, memref: MemRef):
+        """Return a zeroed byte-addressable buffer for the new owner `memref`.
+
+        Backends override this to change the storage of allocations.
+        """
+        return bytearray(memref.size)
+
+    def _adopt_buffer(self, memref: MemRef, buffer):
+        """Return the byte-addressable buffer to use for the new owner
+        `memref` whose storage is the existing writable `buffer`.
+
+        Backends override this to wrap foreign storage.
+        """
+        return buffer
+
     def write[
         T
     ](self, memref: MemRef, indices: tuple[int, ...], value: T) -> None:
-        logging.debug("write %s indices=%s value=%s", memref, indices, value)
-        buffer = self._memmap[memref.handle()]
-        offset = sum(
-            i * s for i, s in zip(indices, memref.strides, strict=True)
+        buffer = self._buffer(memref)
+        offset = memref.offset
+        for i, s in zip(indices, memref.strides, strict=True):
+            offset += i * s
+        memref.layout.pack_into(buffer, offset, _get_machine_value(value))
+
+    def read(self, memref: MemRef, indices: tuple[int, ...]):
+        buffer = self._buffer(memref)
+        offset = memref.offset
+        for i, s in zip(indices, memref.strides, strict=True):
+            offset += i * s
+        return memref.datatype(memref.layout.unpack_from(buffer, offset))
+
+    def read_block(
+        self,
+        memref: MemRef,
+        start: tuple[int, ...],
+        shape: tuple[int, ...],
+    ) -> bytes | bytearray:
+        """Read the block `[start, start + shape)` of `memref`.
+
+        Returns the elements packed in row-major order. A contiguous run is
+        a block whose leading extents are 1.
+        """
+        buffer = self._buffer(memref)
+        return _pack_block(buffer, memref, start, shape)
+
+    def write_block(
+        self,
+        memref: MemRef,
+        start: tuple[int, ...],
+        shape: tuple[int, ...],
+        data: bytes | bytearray,
+    ) -> None:
+        """Write packed row-major `data` into the block `[start, start + shape)`
+        of `memref`.
+        """
+        buffer = self._buffer(memref)
+        itemsize = memref.itemsize
+        view = memoryview(data).cast("B")
+        if len(view) != _nelems(shape) * itemsize:
+            raise ValueError("data size does not match block shape")
+        pos = 0
+        for off, n, stride in _block_runs(memref, start, shape):
+            nbytes = n * itemsize
+            _write_run(
+                buffer, off, n, stride, itemsize, view[pos : pos + nbytes]
+            )
+            pos += nbytes
+
+    def assign(self, memref: MemRef, source: MemRef) -> None:
+        """Copy the elements of `source` into `memref` (same shape).
+
+        The source is read in full before anything is written, so views
+        that overlap in the same owner copy correctly.
+        """
+        if memref.shape != source.shape:
+            raise ValueError("source shape does not match")
+        zeros = (0,) * len(memref.shape)
+        data = _pack_block(self._buffer(source), source, zeros, source.shape)
+        self.write_block(memref, zeros, memref.shape, data)
+
+    def fill[T](self, memref: MemRef, value: T) -> None:
+        """Store `value` to every element of `memref`; each innermost run is
+        one write of the repeated element bytes.
+        """
+        buffer = self._buffer(memref)
+        itemsize = memref.itemsize
+        pattern = memref.layout.pack(_get_machine_value(value))
+        zeros = (0,) * len(memref.shape)
+        for off, n, stride in _block_runs(memref, zeros, memref.shape):
+            _write_run(buffer, off, n, stride, itemsize, pattern * n)
+
+    def gather(
+        self, memref: MemRef, indices: _tp.Sequence[tuple[int, ...]]
+    ) -> bytes:
+        """Read the elements at each index tuple, packed in order."""
+        buffer = self._buffer(memref)
+        _check_indices(memref, indices)
+        n = memref.itemsize
+        return b"".join(
+            [buffer[off : off + n] for off in _offsets(memref, indices)]
         )
-        offset += memref.offset
-        value_bytes = _to_bytes(value)
-        buffer[offset : offset + len(value_bytes)] = value_bytes
-
-    def read(self, memref: MemRef, indices: tuple[int, ...]) -> bytes:
-        logging.debug("read %s indices=%s", memref, indices)
-        buffer = self._memmap[memref.handle()]
-        offset = sum(
-            i * s for i, s in zip(indices, memref.strides, strict=True)
+
+    def take(self, memref: MemRef, offsets: _tp.Sequence[int]) -> bytes:
+        """Read all of `memref` moved by each element offset in `offsets`,
+        packed in order. Used to gather whole rows or blocks at once.
+        """
+        buffer = self._buffer(memref)
+        itemsize = memref.itemsize
+        zeros = (0,) * len(memref.shape)
+        runs = list(_block_runs(memref, zeros, memref.shape))
+        if not runs:
+            return b""
+        _check_take(memref, offsets)
+        offsets = [o * itemsize for o in offsets]
+        if len(runs) == 1:
+            [(base, n, stride)] = runs
+            if stride == itemsize or n == 1:
+                nbytes = n * itemsize
+                return b"".join(
+                    [buffer[base + o : base + o + nbytes] for o in offsets]
+                )
+        return b"".join(
+            [
+                _read_run(buffer, off + o, n, stride, itemsize)
+                for o in offsets
+                for off, n, stride in runs
+            ]
         )
-        offset += memref.offset
+
+    def scatter(
+        self,
+        memref: MemRef,
+        indices: _tp.Sequence[tuple[int, ...]],
+        data: bytes,
+    ) -> None:
+        """Write packed `data` to the elements at each index tuple, in order."""
+        buffer = self._buffer(memref)
         n = memref.itemsize
-        raw_bytes = buffer[offset : offset + n]
-        return _from_bytes(memref.datatype, raw_bytes)
+        view = memoryview(data).cast("B")
+        if len(view) != len(indices) * n:
+            raise ValueError("data size does not match number of indices")
+        _check_indices(memref, indices)
+        pos = 0
+        for off in _offsets(memref, indices):
+            buffer[off : off + n] = view[pos : pos + n]
+            pos += n
+
+    def elementwise(
+        self, fn: _tp.Callable, out: MemRef, inputs: list[MemRef]
+    ) -> None:
+        """Store `fn(*elements)` of `inputs` into `out`, element by element.
+
+        `fn` works on raw values and every input has the shape of `out`
+        (broadcast inputs are zero-stride views). Elements are moved in
+        packed blocks of rows and `fn` is mapped over whole blocks. Inputs
+        that share storage with `out` are read in full before writing.
+        """
+        layout = out.layout
+        in_layouts = [x.layout for x in inputs]
+        block = getattr(fn, "__mcl_block__", None)
+        owner = out.handle()
+        chunks: _tp.Iterable[tuple[tuple[int, ...], tuple[int, ...]]]
+        if any(x.handle() is owner for x in inputs):
+            chunks = [((0,) * len(out.shape), out.shape)]
+        else:
+            chunks = _chunks(out.shape, _ELEMENTWISE_CHUNK)
+        for start, shape in chunks:
+            columns = [
+                lay.unpack_many(self.read_block(x, start, shape))
+                for x, lay in zip(inputs, in_layouts)
+            ]
+            values = block(*columns) if block else list(map(fn, *columns))
+            self.write_block(out, start, shape, layout.pack_many(values))
 
     def view(
         self, 
@@ -436,36 +1771,379 @@ class MemorySystem:
         size,
         offset
     ) -> MemRef:
+        owner = memref.handle()
         new_memref = MemRef(
             shape=shape,
             strides=strides,
             datatype=datatype,
             itemsize=itemsize,
             size=size,
-            owner=memref.owner or memref,
+            owner=owner,
             offset=offset
         )
-        self._viewmap.setdefault(memref, []).append(new_memref)
+        if owner not in self._viewmap:
+            self._viewmap[owner] = weakref.WeakSet()
+        self._viewmap[owner].add(new_memref)
         return new_memref
 
     def copy(
         self, 
         memref: MemRef
     ) -> MemRef:
-        
-        new_memref = MemRef(
-            shape=memref.shape,
-            strides=memref.strides,
-            datatype=memref.datatype,
-            itemsize=memref.itemsize,
-            size=memref.size,
-            owner=None,
-            offset=memref.offset
-        )
-        # Copy the buffer
-        # TODO: In case of a view, we don't need to copy the entire buffer
-        buffer = self._memmap[memref]
-        self._memmap[new_memref] = buffer.copy()
+        """Copy the elements reachable from `memref` into a new owner.
+
+        Only the bytes the view covers are copied, packed into a contiguous
+        row-major layout with zero offset. A contiguous view is a single
+        memcpy; otherwise it is a strided gather.
+        """
+        new_memref = _contiguous_memref(memref.shape, memref.datatype)
+        buffer = self._buffer(memref)
+        if memref.c_contiguous:
+            (start, stop) = (memref.offset, memref.offset + new_memref.size)
+            data = bytearray(memoryview(buffer)[start:stop])
+        else:
+            zeros = (0,) * len(memref.shape)
+            data = _pack_block(buffer, memref, zeros, memref.shape)
+        self._register(new_memref, data)
         return new_memref
 
-_the_memsys = MemorySystem()
+
+def _map_file(path: str, nbytes: int, create: bool = True) -> mmap.mmap:
+    flags = os.O_RDWR | os.O_CREAT if create else os.O_RDWR
+    fd = os.open(path, flags, 0o644)
+    try:
+        if os.fstat(fd).st_size < nbytes:
+            os.ftruncate(fd, nbytes)
+        return mmap.mmap(fd, nbytes)
+    finally:
+        os.close(fd)
+
+
+def _cast_view(view: memoryview, fmt: str, shape=None) -> memoryview:
+    # typeshed only accepts literal formats
+    cast: _tp.Callable[..., memoryview] = view.cast
+    return cast(fmt) if shape is None else cast(fmt, shape)
+
+
+def _close_mapping(mapping: mmap.mmap) -> None:
+    try:
+        mapping.close()
+    except BufferError:
+        # Still exported (e.g. a live memoryview); the mapping is unmapped
+        # once the last export goes away.
+        pass
+
+
+def _attach_shared(name: str) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before 3.13 attaching registers with the resource tracker. A
+        # tracker of this process alone would unlink the segment when the
+        # process exits; unregistering afterwards would instead drop the
+        # creator's registration from a tracker inherited from it (fork,
+        # spawn and forkserver children all share it). So do not register.
+        from multiprocessing import resource_tracker
+
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+# Segments whose buffer was still exported when their owner died.
+_unclosed_shared: list[shared_memory.SharedMemory] = []
+
+
+def _release_shared(
+    shm: shared_memory.SharedMemory, creator_pid: int | None
+) -> None:
+    # Only the creating process removes the name; forked children and
+    # attached processes just unmap.
+    if creator_pid == os.getpid():
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+    _unclosed_shared.append(shm)
+    for shm in list(_unclosed_shared):
+        try:
+            shm.close()
+        except BufferError:
+            # The owner's byte views die right after its finalizer runs;
+            # retry on the next release.
+            continue
+        _unclosed_shared.remove(shm)
+
+
+def _is_c_contiguous(
+    shape: tuple[int, ...], strides: tuple[int, ...], itemsize: int
+) -> bool:
+    expected = itemsize
+    for n, s in zip(reversed(shape), reversed(strides)):
+        if n != 1 and s != expected:
+            return False
+        expected *= n
+    return True
+
+
+def _is_f_contiguous(
+    shape: tuple[int, ...], strides: tuple[int, ...], itemsize: int
+) -> bool:
+    return _is_c_contiguous(shape[::-1], strides[::-1], itemsize)
+
+
+# Array interface kind of the `struct` format characters.
+_format_kinds = {
+    **dict.fromkeys("bhilqn", "i"),
+    **dict.fromkeys("BHILQN", "u"),
+    **dict.fromkeys("efd", "f"),
+    "?": "b",
+}
+
+
+def _typestr(datatype: _tp.Type) -> str:
+    """The `__array_interface__` type string of a machine type."""
+    layout = layout_of(datatype)
+    endian = "<" if sys.byteorder == "little" else ">"
+    return f"{endian}{_format_kinds[layout.format]}{layout.size}"
+
+
+def _type_of_format(fmt: str) -> _tp.Type:
+    """The machine type of a native `struct` format (buffer protocol)."""
+    char = fmt.lstrip("@=")
+    if char == "n":
+        return _mt.intp
+    kind = _format_kinds.get(char) if len(char) == 1 else None
+    if kind is not None:
+        size = struct.calcsize(char)
+        for typ in (_mt.i32, _mt.i64, _mt.f32, _mt.f64):
+            layout = layout_of(typ)
+            if (_format_kinds[layout.format], layout.size) == (kind, size):
+                return typ
+    raise TypeError(f"no machine type for buffer format {fmt!r}")
+
+
+def _contiguous_memref(
+    shape: tuple[int, ...],
+    datatype: _tp.Type,
+    order: str = "C",
+    offset: int = 0,
+) -> MemRef:
+    """Describe a new row-major ("C") or column-major ("F") owner of
+    `shape`.
+    """
+    itemsize = layout_of(datatype).size
+    nbytes = _nelems(shape) * itemsize
+    # compute strides
+    strides = []
+    last = itemsize
+    match order:
+        case "C":
+            for s in reversed(shape):
+                strides.append(last)
+                last *= s
+            strides.reverse()
+        case "F":
+            for s in shape:
+                strides.append(last)
+                last *= s
+        case _:
+            raise ValueError(f"invalid order {order!r}")
+    assert last == nbytes
+    return MemRef(
+        shape=shape,
+        strides=tuple(strides),
+        datatype=datatype,
+        itemsize=itemsize,
+        size=nbytes,
+        offset=offset,
+    )
+
+
+def _nelems(shape: tuple[int, ...]) -> int:
+    return reduce(operator.mul, shape, 1)
+
+
+# Elements per block in `MemorySystem.elementwise`.
+_ELEMENTWISE_CHUNK = 1 << 16
+
+
+def _chunks(
+    shape: tuple[int, ...], target: int
+) -> _tp.Iterator[tuple[tuple[int, ...], tuple[int, ...]]]:
+    """Split `shape` along the leading axis into `(start, shape)` blocks of
+    about `target` elements.
+    """
+    if not shape:
+        yield (), ()
+        return
+    [n, *rest] = shape
+    step = max(1, target // max(1, _nelems(tuple(rest))))
+    zeros = (0,) * len(rest)
+    for i in range(0, n, step):
+        yield (i, *zeros), (min(step, n - i), *rest)
+
+
+def _check_indices(
+    memref: MemRef, indices: _tp.Sequence[tuple[int, ...]]
+) -> None:
+    shape = memref.shape
+    for idx in indices:
+        if len(idx) != len(shape) or not all(
+            0 <= i < n for i, n in zip(idx, shape)
+        ):
+            raise IndexError(
+                f"index {tuple(idx)} is out of bounds for shape {shape}"
+            )
+
+
+def _check_take(memref: MemRef, offsets: _tp.Sequence[int]) -> None:
+    """Check that every moved copy of the (non-empty) `memref` stays within
+    the elements of its owner.
+    """
+    if not offsets:
+        return
+    itemsize = memref.itemsize
+    (lo, hi) = (memref.offset, memref.offset + itemsize)
+    for n, s in zip(memref.shape, memref.strides):
+        (lo, hi) = (lo + min(0, (n - 1) * s), hi + max(0, (n - 1) * s))
+    root = memref.handle()
+    first = lo + min(offsets) * itemsize
+    last = hi + max(offsets) * itemsize
+    if first < root.offset or last > root.offset + root.size:
+        raise IndexError("take offset is out of bounds of the allocation")
+
+
+def _offsets(
+    memref: MemRef, indices: _tp.Sequence[tuple[int, ...]]
+) -> list[int]:
+    strides = memref.strides
+    base = memref.offset
+    return [
+        base + sum(map(operator.mul, idx, strides)) for idx in indices
+    ]
+
+
+def _collapse(
+    shape: tuple[int, ...], strides: tuple[int, ...]
+) -> tuple[list[int], list[int]]:
+    """Merge adjacent dimensions that are laid out back-to-back in memory."""
+    out_shape = [1]
+    out_strides = [0]
+    for n, s in zip(shape, strides, strict=True):
+        if n == 1:
+            continue
+        if out_strides[-1] == n * s or out_shape[-1] == 1:
+            out_shape[-1] *= n
+            out_strides[-1] = s
+        else:
+            out_shape.append(n)
+            out_strides.append(s)
+    return out_shape, out_strides
+
+
+def _block_runs(
+    memref: MemRef, start: tuple[int, ...], shape: tuple[int, ...]
+) -> _tp.Iterator[tuple[int, int, int]]:
+    """Yield `(byte_offset, count, stride)` for each innermost run of a block
+    in row-major order.
+    """
+    base = memref.offset + sum(
+        map(operator.mul, start, memref.strides)
+    )
+    if _nelems(shape) == 0:
+        return
+    (*outer_shape, inner), (*outer_strides, inner_stride) = _collapse(
+        shape, memref.strides
+    )
+    for idx in itertools.product(*map(range, outer_shape)):
+        off = base + sum(map(operator.mul, idx, outer_strides))
+        yield off, inner, inner_stride
+
+
+def _pack_block(
+    buffer, memref: MemRef, start: tuple[int, ...], shape: tuple[int, ...]
+) -> bytearray:
+    """Gather a block of `memref` from its owner's `buffer` into packed
+    row-major bytes.
+    """
+    itemsize = memref.itemsize
+    total = _nelems(shape) * itemsize
+    runs = _block_runs(memref, start, shape)
+    first = next(runs, None)
+    if first is None:
+        return bytearray()
+    (off, n, stride) = first
+    if n * itemsize == total and (stride == itemsize or n == 1):
+        # The whole block is one contiguous run: a single memcpy.
+        return bytearray(memoryview(buffer)[off : off + total])
+    out = bytearray(total)
+    pos = 0
+    for off, n, stride in itertools.chain([first], runs):
+        nbytes = n * itemsize
+        out[pos : pos + nbytes] = _read_run(buffer, off, n, stride, itemsize)
+        pos += nbytes
+    return out
+
+
+def _strided_slice(start: int, n: int, step: int) -> slice:
+    stop = start + step * (n - 1) + (1 if step > 0 else -1)
+    return slice(start, stop if stop >= 0 else None, step)
+
+
+def _read_run(buffer, off: int, n: int, stride: int, itemsize: int):
+    if stride == itemsize or n == 1:
+        return buffer[off : off + n * itemsize]
+    if stride == 0:
+        return bytes(buffer[off : off + itemsize]) * n
+    out = bytearray(n * itemsize)
+    for j in range(itemsize):
+        out[j::itemsize] = buffer[_strided_slice(off + j, n, stride)]
+    return out
+
+
+def _write_run(buffer, off: int, n: int, stride: int, itemsize: int, data):
+    if stride == itemsize or n == 1:
+        buffer[off : off + n * itemsize] = data
+    elif stride == 0:
+        # Every element aliases the same location; the last write wins.
+        buffer[off : off + itemsize] = data[-itemsize:]
+    else:
+        for j in range(itemsize):
+            buffer[_strided_slice(off + j, n, stride)] = data[j::itemsize]
+
+
+def make_memory_system(name: str) -> MemorySystem:
+    """Create a memory system backend by name: "python" or "numpy"."""
+    match name:
+        case "python":
+            return MemorySystem()
+        case "numpy":
+            from mcl.numpy_memsys import NumPyMemorySystem
+
+            return NumPyMemorySystem()
+        case _:
+            raise ValueError(f"unknown memory system {name!r}")
+
+
+def get_memory_system() -> MemorySystem:
+    """Return the active memory system."""
+    return _the_memsys
+
+
+def set_memory_system(memsys: MemorySystem) -> MemorySystem:
+    """Install `memsys` as the active memory system. Returns the previous one.
+
+    MemRefs are only valid in the memory system that created them, so this is
+    meant to be called at startup, before any allocation.
+    """
+    global _the_memsys
+    prev = _the_memsys
+    _the_memsys = memsys
+    return prev
+
+
+_the_memsys = make_memory_system(os.environ.get("MCL_MEMSYS", "python"))
@@ -1,11 +1,24 @@
 # pytest me
+import itertools
+import math
+import json
 import pytest
 import logging
-from mcl.machine_types import i32, i64, intp, memref
+from mcl.machine_types import f64, i32, i64, intp, memref
 from mcl.vm import Type
-from mcl.ndarray import Array, DType, Int32
+from mcl.ndarray import Array, DType, Float64, Int32, Int64
+from mcl import vm
 
 
+@pytest.fixture(autouse=True, params=["python", "numpy"])
+def memsys(request):
+    """Run every test against each MemorySystem backend."""
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    prev = vm.set_memory_system(vm.make_memory_system(request.param))
+    yield vm._the_memsys
+    vm.set_memory_system(prev)
+
 
 def test_i32():
     a = i32(321)
@@ -30,6 +43,24 @@ def test_i64():
     assert c == i64(444)
 
 
+def test_machine_value_repr():
+    a = i32(3)
+    assert not hasattr(a, "__dict__")
+    with pytest.raises(AttributeError):
+        a.other = 1
+    # small intp values are shared, others are not
+    assert intp(7) is intp(7)
+    assert intp(10**6) is not intp(10**6)
+    assert intp(10**6) == intp(10**6)
+    assert i32(7) is not i32(7)
+    assert intp(i32(7)) is not i32(7)
+    assert vm._get_machine_value(intp(i32(7))) == 7
+
+    data = memref.alloc((intp(3), intp(4)), i32)
+    assert data.shape is data.shape
+    assert data.strides == (intp(16), intp(4))
+
+
 def test_final():
     with pytest.raises(TypeError, match="final type cannot be subclassed"):
         class sub_i32(i32):
@@ -187,6 +218,60 @@ def test_array_slice_setitem():
             assert ary_2[1, i, j] == i32(100)
 
 
+def test_array_slice_setitem_bulk():
+    # overlapping views of one buffer, in both directions
+    a = _iota((intp(10),))
+    a[slice(1, 10)] = a[slice(0, 9)]
+    assert _values(a) == [0, 0, 1, 2, 3, 4, 5, 6, 7, 8]
+    a = _iota((intp(10),))
+    a[slice(0, 9)] = a[slice(1, 10)]
+    assert _values(a) == [1, 2, 3, 4, 5, 6, 7, 8, 9, 9]
+
+    # strided fill and a strided (transposed) source
+    b = _iota((intp(3), intp(4)))
+    b[slice(None), 1] = i32(-1)
+    assert _values(b) == [0, -1, 2, 3, 4, -1, 6, 7, 8, -1, 10, 11]
+    sq = _iota((intp(3), intp(3)))
+    (s0, s1) = sq.strides
+    t = Array(dtype=sq.dtype,
+              data=sq.data.view(sq.shape, (s1, s0), intp(0)))
+    sq[slice(None)] = t
+    assert _values(sq) == [0, 3, 6, 1, 4, 7, 2, 5, 8]
+
+    with pytest.raises(TypeError, match="same datatype"):
+        a[slice(0, 2)] = Array(
+            dtype=DType(Int64), data=memref.alloc((intp(2),), i64))
+
+
+def test_struct_type():
+    from mcl.vm import struct_type
+
+    x = Int32(i32(5))
+    assert x.value == i32(5)
+    assert Int32(value=i32(5)) == x
+    assert repr(x) == "Int32(value=i32(5))"
+    assert x.__mcl_struct_fields__ == {"value": i32(5)}
+    assert not hasattr(x, "__dict__")
+    with pytest.raises(TypeError):
+        Int32()
+    with pytest.raises(AttributeError):
+        x.other = 1
+
+    @struct_type()
+    class Pair(Int32):
+        other: i64
+
+    p = Pair(i32(1), other=i64(2))
+    assert (p.value, p.other) == (i32(1), i64(2))
+    assert Pair.__mcl_struct_field_names__ == ("value", "other")
+
+    with pytest.raises(TypeError, match="must not define __init__"):
+        @struct_type()
+        class Bad:
+            def __init__(self):
+                pass
+
+
 def test_array_copy():
     shape = (intp(3), intp(4))
     i32_dtype = DType(Int32)
@@ -256,4 +341,1077 @@ def test_array_fancy_getitem():
     assert fancy_slice_3.shape == (intp(2), intp(3), intp(6))
 
     # Check contents
+    from mcl.machine_types import f64
+    from mcl.ndarray import Float64
+
+    flat = list(range(4 * 5 * 6))
+    rows = [0, 1, 2, 2, 1, 0]
+    assert _values(fancy_slice) == [
+        v for r in rows for v in flat[r * 30 : r * 30 + 30]
+    ]
+    assert _values(fancy_slice_2) == [
+        flat[i * 30 + r * 6 + k] for i in (1, 2) for r in rows
+        for k in range(6)
+    ]
+    assert _values(fancy_slice_3) == [
+        flat[r * 6 + k] for r in rows for k in range(6)
+    ]
+    # two index arrays broadcast together; a negative index counts from
+    # the end
+    col = Array(dtype=i32_dtype, data=memref.alloc((intp(1),), i32))
+    col[0] = i32(-1)
+    picked = ary[1, idx_ary, col]
+    assert picked.shape == (intp(2), intp(3))
+    assert _values(picked) == [30 + r * 6 + 5 for r in rows]
+    # slicing a slice keeps the parent offset
+    assert ary[slice(1, 3)][slice(1, 2)][0, 0, 0] == i32(60)
+
+    with pytest.raises(IndexError, match="out of bounds"):
+        ary[idx_ary + i32(2)]
+    # the result has the source dtype
+    f = Array(dtype=DType(Float64), data=memref.alloc((intp(3),), f64))
+    f[2] = f64(0.5)
+    assert f[idx_ary].data.datatype is f64
+    assert _values(f[idx_ary], f64) == [0.0, 0.0, 0.5, 0.5, 0.0, 0.0]
+
+
+@pytest.mark.parametrize("mode", ["table", "specialized", "unchecked"])
+def test_dispatch_mode(mode):
+    from mcl.vm import dispatch_mode
+
+    with dispatch_mode(mode):
+        a = intp(7)
+        assert a + intp(3) == intp(10)
+        assert a - intp(3) == intp(4)
+        assert a * intp(3) == intp(21)
+        assert a // intp(2) == intp(3)
+        assert intp(1) < a
+        assert i32(1) + i32(2) == i32(3)
+
+        data = memref.alloc((intp(2), intp(3)), i32)
+        data.store((intp(1), intp(2)), i32(42))
+        got = data.load((intp(1), intp(2)), i32)
+        assert type(got) is i32
+        assert got == i32(42)
+        assert data.shape == (intp(2), intp(3))
+
+
+def test_specialize_machine_op():
+    from mcl.vm import specialize_machine_op
+
+    add = specialize_machine_op("int_add", intp, intp, intp)
+    assert add(intp(2), intp(3)) == intp(5)
+
+    lt = specialize_machine_op("int_lt", bool, intp, intp)
+    assert lt(intp(2), intp(3)) is True
+
+    with pytest.raises(AssertionError):
+        specialize_machine_op("int_add", intp, intp, i32)
+    # unchecked resolution skips the type checks
+    specialize_machine_op("int_add", intp, intp, i32, checked=False)
+
+
+def test_memref_block_ops():
+    from mcl.vm import layout_of
+
+    shape = (intp(3), intp(4))
+    data = memref.alloc(shape, i32)
+    for i in range(3):
+        for j in range(4):
+            data.store((intp(i), intp(j)), i32(i * 10 + j))
+
+    def packed(*values):
+        return layout_of(i32).pack_many(values)
+
+    # whole array is a single contiguous run
+    got = data.load_block((intp(0), intp(0)), shape)
+    assert got == packed(*[i * 10 + j for i in range(3) for j in range(4)])
+
+    # strided block
+    got = data.load_block((intp(1), intp(1)), (intp(2), intp(2)))
+    assert got == packed(11, 12, 21, 22)
+
+    # transposed view walks against the row-major layout
+    (s0, s1) = data.strides
+    transposed = data.view((intp(4), intp(3)), (s1, s0), intp(0))
+    got = transposed.load_block((intp(0), intp(0)), (intp(2), intp(3)))
+    assert got == packed(0, 10, 20, 1, 11, 21)
+
+    # broadcast view repeats the same element
+    bcast = data.view((intp(2), intp(3)), (intp(0), intp(0)), intp(4))
+    assert bcast.load_block((intp(0), intp(0)), bcast.shape) == packed(1) * 6
+
+    transposed.store_block(
+        (intp(1), intp(0)), (intp(1), intp(3)), packed(-1, -2, -3)
+    )
+    assert data.load((intp(0), intp(1)), i32) == i32(-1)
+    assert data.load((intp(1), intp(1)), i32) == i32(-2)
+    assert data.load((intp(2), intp(1)), i32) == i32(-3)
+
+    # gather / scatter
+    assert data.gather([(2, 3), (0, 0), (2, 3)]) == packed(23, 0, 23)
+    data.scatter([(0, 3), (1, 0)], packed(7, 8))
+    assert data.load((intp(0), intp(3)), i32) == i32(7)
+    assert data.load((intp(1), intp(0)), i32) == i32(8)
+
+    with pytest.raises(ValueError, match="data size"):
+        data.scatter([(0, 0)], packed(1, 2))
+
+    # out-of-bounds indices and offsets never reach neighbouring memory
+    for bad in [(3, 0), (0, -1), (0,), (0, 0, 0)]:
+        with pytest.raises(IndexError, match="out of bounds"):
+            data.gather([(0, 0), bad])
+        with pytest.raises(IndexError, match="out of bounds"):
+            data.scatter([bad], packed(1))
+    # take moves whole blocks by element offsets
+    row = data.view((intp(4),), (intp(4),), intp(16))
+    assert row.take([-4, 4]) == data.load_block(
+        (intp(0), intp(0)), (intp(1), intp(4))) + data.load_block(
+        (intp(2), intp(0)), (intp(1), intp(4)))
+    for bad in [[-5], [5], [4, 5]]:
+        with pytest.raises(IndexError, match="out of bounds"):
+            row.take(bad)
+
+
+def test_array_copy_view():
+    shape = (intp(6), intp(5))
+    ary = Array(dtype=DType(Int32), data=memref.alloc(shape, i32))
+    for i in range(6):
+        for j in range(5):
+            ary[i, j] = i32(i * 10 + j)
+
+    # contiguous rows
+    rows = ary[slice(2, 4)].copy()
+    assert rows.shape == (intp(2), intp(5))
+    assert rows.strides == (intp(20), intp(4))
+    assert rows.data.offset == intp(0)
+    # strided column block
+    block = ary[slice(1, 5), slice(3, 5)].copy()
+    assert block.shape == (intp(4), intp(2))
+    assert block.strides == (intp(8), intp(4))
+    # broadcast view is materialized
+    bcast = Array(dtype=DType(Int32), data=ary[slice(0, 1)].data)
+    bcast.broadcast_to((intp(3), intp(5)))
+    bcast = bcast.copy()
+    assert bcast.strides == (intp(20), intp(4))
+
+    for i in range(2):
+        for j in range(5):
+            assert rows[i, j] == i32((i + 2) * 10 + j)
+    for i in range(4):
+        for j in range(2):
+            assert block[i, j] == i32((i + 1) * 10 + j + 3)
+    for i in range(3):
+        for j in range(5):
+            assert bcast[i, j] == i32(j)
+
+    # only the covered bytes are allocated, and writes do not alias
+    copied = vm._get_machine_value(block.data)
+    assert copied.size == 4 * 2 * 4
+    assert copied.owner is None
+    block[0, 0] = i32(-1)
+    assert ary[1, 3] == i32(13)
+
+
+def test_memref_free(memsys):
+    data = memref.alloc((intp(3), intp(4)), i32)
+    view = data.view((intp(4),), (intp(4),), intp(16))
+    live = memsys.live_allocations
+
+    with pytest.raises(ValueError, match="only the owner"):
+        view.free()
+
+    data.free()
+    assert memsys.live_allocations == live - 1
+    with pytest.raises(ValueError, match="freed memref"):
+        data.load((intp(0), intp(0)), i32)
+    with pytest.raises(ValueError, match="freed memref"):
+        view.load((intp(0),), i32)
+    with pytest.raises(ValueError, match="double free"):
+        data.free()
+
+
+def test_memref_buffer_ids(memsys):
+    from mcl.vm import _get_machine_value
+
+    (a, b) = (memref.alloc((intp(3), intp(4)), i32) for _ in range(2))
+    row = a.view((intp(4),), (intp(4),), intp(16))
+    elem = row.view((intp(2),), (intp(8),), intp(20))
+    (ma, mb, mrow, melem) = map(_get_machine_value, (a, b, row, elem))
+    # views point straight at the root and share its buffer id
+    assert melem.owner is ma and melem.handle() is ma
+    assert ma.buffer_id == mrow.buffer_id == melem.buffer_id
+    assert ma.buffer_id != mb.buffer_id
+    assert set(memsys._memmap) >= {ma.buffer_id, mb.buffer_id}
+    # identity hashing, independent of the fields
+    assert hash(ma) == object.__hash__(ma)
+    elem.store((intp(1),), i32(5))
+    assert a.load((intp(1), intp(3)), i32) == i32(5)
+    buffer_id = mb.buffer_id
+    del b, mb
+    assert buffer_id not in memsys._memmap
+
+
+def test_memory_reclamation(memsys):
+    shape = (intp(4), intp(5))
+    before = (memsys.live_bytes, memsys.live_allocations)
+
+    # soak: temporaries from copies, views and fancy indexing are released
+    for _ in range(20):
+        ary = Array(dtype=DType(Int32), data=memref.alloc(shape, i32))
+        ary[1] = i32(3)
+        ary[slice(0, 2)].copy()
+        idx = Array(dtype=DType(Int32),
+                    data=memref.alloc((intp(2),), i32))
+        ary[idx]
+    del ary, idx
+    assert (memsys.live_bytes, memsys.live_allocations) == before
+
+    # a view keeps its owner alive
+    data = memref.alloc(shape, i32)
+    data.store((intp(2), intp(1)), i32(7))
+    view = data.view((intp(5),), (intp(4),), intp(40))
+    del data
+    assert memsys.live_allocations == before[1] + 1
+    assert view.load((intp(1),), i32) == i32(7)
+    del view
+    assert (memsys.live_bytes, memsys.live_allocations) == before
+
+
+def test_memory_accounting(memsys):
+    shape = (intp(4), intp(5))
+    memsys.record_sites = True
+    base = memsys.snapshot()
+    assert base.allocations == ()
+
+    ary = Array(dtype=DType(Int32), data=memref.alloc(shape, i32))
+    rows = [ary[i] for i in range(3)]
+    tmp = ary.copy()
+    assert memsys.peak_bytes == memsys.live_bytes == 160
+    del tmp
+    assert (memsys.live_bytes, memsys.peak_bytes) == (80, 160)
+    memsys.reset_peak()
+    assert memsys.peak_bytes == 80
+
+    snap = memsys.snapshot()
+    [info] = snap.allocations
+    assert (info.shape, info.dtype, info.nbytes) == ((4, 5), "i32", 80)
+    assert info.site[0].startswith("test.py:")
+    assert "test_memory_accounting" in info.site[0]
+    assert snap.views == {info.serial: 3}
+    [group] = snap.statistics("shape_dtype")
+    assert (group.key, group.count, group.nbytes, group.views) == (
+        ((4, 5), "i32"), 1, 80, 3)
+
+    # growth is attributed to the Array method that allocated
+    ary.copy()
+    kept = ary.copy()
+    diffs = memsys.snapshot().compare_to(snap)
+    assert [(d.count, d.count_diff, d.nbytes_diff) for d in diffs] == [
+        (1, 1, 80)]
+    assert "Array.copy" in diffs[0].key
+    report = memsys.snapshot().report(baseline=snap)
+    assert "+80" in report and "Array.copy" in report
+    assert "i32" in memsys.leak_report(key="dtype")
+
+    del ary, rows, kept
+    assert memsys.snapshot().compare_to(base) == []
+
+
+def test_memref_alloc_mapped(tmp_path):
+    shape = (intp(4), intp(6))
+    path = tmp_path / "data.bin"
+
+    data = memref.alloc_mapped(shape, i32, str(path))
+    assert path.stat().st_size == 4 * 6 * 4
+    ary = Array(dtype=DType(Int32), data=data)
+    ary[1] = i32(5)
+    ary[2, 3] = i32(-7)
+    # views stay zero-copy over the mapping
+    row = ary[2]
+    row[0] = i32(9)
+    assert ary[2, 0] == i32(9)
+    assert row[3] == i32(-7)
+    data.flush()
+    del ary, row
+    data.free()
+
+    # reopening the file keeps its contents
+    data = memref.alloc_mapped(shape, i32, str(path))
+    ary = Array(dtype=DType(Int32), data=data)
+    assert ary[1, 5] == i32(5)
+    assert ary[2, 3] == i32(-7)
+    assert ary[2, 0] == i32(9)
+    assert ary.copy()[2, 0] == i32(9)
+
+    anon = memref.alloc_mapped(shape, i32)
+    anon.store((intp(3), intp(5)), i32(1))
+    assert anon.load((intp(3), intp(5)), i32) == i32(1)
+    anon.flush()
+
+
+def test_array_npy(tmp_path, monkeypatch):
+    from mcl.ndarray import _npy_header
+
+    a = _iota((intp(3), intp(4)), start=-5)
+    path = tmp_path / "a.npy"
+    a.save(path)
+    raw = path.read_bytes()
+    assert raw.startswith(b"\x93NUMPY\x01\x00")
+    assert (len(raw) - 48) % 64 == 0 and raw[-49:-48] == b"\n"
+
+    copied = Array.load(path, mmap=False)
+    assert copied.shape == a.shape and _values(copied) == _values(a)
+    mapped = Array.load(path)
+    assert mapped.dtype.type is Int32 and _values(mapped) == _values(a)
+    # stores into a mapped array reach the file
+    mapped[2, 3] = i32(99)
+    mapped.data.flush()
+    assert Array.load(path, mmap=False)[2, 3] == i32(99)
+    assert copied[2, 3] == i32(6)
+
+    # a strided view is saved in row-major order
+    col = a[slice(None), 1]
+    col.save(path)
+    assert _values(Array.load(path)) == [-4, 0, 4]
+
+    # Fortran order maps with column-major strides
+    fpath = tmp_path / "f.npy"
+    fpath.write_bytes(
+        _npy_header("<i4", True, (2, 3))
+        + vm.layout_of(i32).pack_many([0, 3, 1, 4, 2, 5]))
+    f = Array.load(fpath)
+    assert f.strides == (intp(4), intp(8))
+    assert _values(f) == [0, 1, 2, 3, 4, 5]
+    assert _values(Array.load(fpath, mmap=False)) == [0, 1, 2, 3, 4, 5]
+
+    # views and fancy indexing of mapped arrays, past the header, in both
+    # orders
+    rows = Array(dtype=DType(Int32), data=memref.alloc((intp(2),), i32))
+    rows[0] = i32(1)
+    a.save(tmp_path / "c.npy")
+    c = Array.load(tmp_path / "c.npy")
+    assert _values(c[slice(1, None), slice(1, None)]) == [0, 1, 2, 4, 5, 6]
+    assert _values(c[rows]) == [-1, 0, 1, 2, -5, -4, -3, -2]
+    assert _values(c[slice(None), rows]) == [-4, -5, 0, -1, 4, 3]
+    assert _values(f[slice(1, None), slice(1, None)]) == [4, 5]
+    assert _values(f[rows]) == [3, 4, 5, 0, 1, 2]
+    assert _values(f[slice(None), rows]) == [1, 0, 4, 3]
+
+    # copying loads only read the file, and never create one
+    fpath.chmod(0o444)
+    (tmp_path / "c.npy").chmod(0o444)
+    monkeypatch.setattr(vm, "_map_file", None)
+    assert _values(Array.load(fpath, mmap=False)) == [0, 1, 2, 3, 4, 5]
+    assert _values(Array.load(tmp_path / "c.npy", mmap=False)) == \
+        list(range(-5, 7))
+    monkeypatch.undo()
+    with pytest.raises(FileNotFoundError):
+        Array.load(tmp_path / "missing.npy", mmap=False)
+    with pytest.raises(FileNotFoundError):
+        Array.load(tmp_path / "missing.npy")
+    assert not (tmp_path / "missing.npy").exists()
+
+    bad = tmp_path / "bad.npy"
+    bad.write_bytes(b"not numpy")
+    with pytest.raises(ValueError, match="not an .npy file"):
+        Array.load(bad)
+    bad.write_bytes(_npy_header("<c16", False, (2,)) + bytes(32))
+    with pytest.raises(TypeError, match="unsupported .npy dtype"):
+        Array.load(bad)
+    bad.write_bytes(_npy_header("<i4", False, (20,)))
+    with pytest.raises(ValueError, match="too small"):
+        Array.load(bad)
+
+    np = pytest.importorskip("numpy")
+    a.save(path)
+    assert np.load(path).tolist() == [
+        list(range(-5, -1)), list(range(-1, 3)), list(range(3, 7))]
+    np.save(path, np.arange(6, dtype=np.float64).reshape(2, 3).T)
+    t = Array.load(path)
+    assert t.dtype.type is Float64
+    assert _values(t, f64) == [0.0, 3.0, 1.0, 4.0, 2.0, 5.0]
+
+
+def test_buffer_export_import():
+    a = _iota((intp(3), intp(4)))
+    m = memoryview(a)
+    assert (m.shape, m.format) == ((3, 4), "i")
+    assert m.tolist() == [list(range(4)), list(range(4, 8)),
+                          list(range(8, 12))]
+    # views share storage; one-dimensional strided views work too
+    assert memoryview(a[1]).tolist() == [4, 5, 6, 7]
+    col = memoryview(a[slice(None), 2])
+    assert col.tolist() == [2, 6, 10]
+    col[1] = -1
+    assert a[1, 2] == i32(-1)
+    with pytest.raises(BufferError, match="not contiguous"):
+        memoryview(a[slice(None), slice(1, 3)])
+    with pytest.raises(BufferError, match="not contiguous"):
+        memoryview(a.data.view((intp(3),), (intp(0),), intp(4)))
+    # memoryview cannot have zeros in a multi-dimensional shape
+    assert memoryview(a[slice(2, 2), 1]).tolist() == []
+    empty = a[slice(2, 2)]
+    assert empty.shape == (intp(0), intp(4))
+    with pytest.raises(BufferError, match="empty"):
+        memoryview(empty)
+    assert empty.__array_interface__["shape"] == (0, 4)
+
+    info = a[slice(1, 3)].__array_interface__
+    assert (info["shape"], info["strides"], info["offset"]) == (
+        (2, 4), (16, 4), 16)
+    assert info["typestr"][1:] == "i4" and info["version"] == 3
+
+    # adopt external buffers without copying
+    raw = bytearray(24)
+    data = memref.from_buffer(raw, (intp(2), intp(2)), i32, intp(8))
+    data.store((intp(1), intp(0)), i32(7))
+    assert memoryview(raw)[16:20].cast("i")[0] == 7
+    with pytest.raises(BufferError):
+        raw.extend(b"x")
+    with pytest.raises(TypeError, match="read-only"):
+        memref.from_buffer(b"abcd", (intp(1),), i32)
+    with pytest.raises(ValueError, match="too small"):
+        memref.from_buffer(raw, (intp(4), intp(2)), i32)
+    # views of an owner that starts at an offset
+    data.store((intp(1), intp(1)), i32(8))
+    part = Array(dtype=DType(Int32), data=data)[slice(1, None), 1]
+    assert _values(part) == [8]
+    # the storage belongs to `raw`, so it cannot move to shared memory
+    with pytest.raises(BufferError, match="adopted"):
+        data.share()
+    assert _values(part) == [8] and part[0] == i32(8)
+
+    np = pytest.importorskip("numpy")
+    n = np.asarray(a)
+    n[0, 0] = 100
+    assert a[0, 0] == i32(100)
+    (s0, s1) = a.strides
+    t = Array(dtype=a.dtype, data=a.data.view(
+        (intp(4), intp(3)), (s1, s0), intp(0)))
+    assert np.asarray(t).tolist() == np.asarray(a).T.tolist()
+    ext = np.arange(6, dtype=np.float64).reshape(2, 3)
+    adopted = memref.from_buffer(ext)
+    assert adopted.shape == (intp(2), intp(3)) and adopted.datatype is f64
+    adopted.store((intp(0), intp(1)), f64(9.5))
+    assert ext[0, 1] == 9.5
+    with pytest.raises(BufferError, match="non-contiguous"):
+        memref.from_buffer(ext.T)
+
+
+def test_array_views():
+    a = _iota((intp(3), intp(4)))
+    rows = [list(range(4 * r, 4 * r + 4)) for r in range(3)]
+    # stepped and negative slices, against Python's list semantics
+    for idx in [slice(None, None, 2), slice(None, None, -1),
+                slice(-1, 0, -2), slice(-3, None), slice(1, -1, 3)]:
+        v = a[slice(None), idx]
+        assert v.shape == (intp(3), intp(len(rows[0][idx])))
+        assert _values(v) == [x for r in rows for x in r[idx]]
+    v = a[slice(None, None, -2), slice(None, None, -1)]
+    v[0, 0] = i32(-1)
+    assert a[2, 3] == i32(-1) and not v.data.c_contiguous
+    a[2, 3] = i32(11)
+
+    t = a.T
+    assert (t.shape, t.data.f_contiguous) == ((intp(4), intp(3)), True)
+    assert _values(t) == [rows[r][c] for c in range(4) for r in range(3)]
+    assert _values(a.transpose(1, 0)) == _values(t)
+    with pytest.raises(ValueError, match="axes"):
+        a.transpose(0, 0)
+
+    # contiguous reshapes are views
+    r = a.reshape(intp(2), intp(-1), intp(2))
+    assert r.shape == (intp(2), intp(3), intp(2)) and r.data.c_contiguous
+    r[1, 0, 0] = i32(99)
+    assert a[1, 2] == i32(99)
+    a[1, 2] = i32(6)
+    assert _values(a.ravel()) == list(range(12))
+    # so are splits of a strided dimension
+    col = a[slice(None), slice(None, None, 2)].reshape((intp(6),))
+    col[1] = i32(-2)
+    assert a[0, 2] == i32(-2)
+    a[0, 2] = i32(2)
+    # a transposed array needs a copy to be raveled
+    flat = t.ravel()
+    assert _values(flat) == _values(t)
+    flat[0] = i32(50)
+    assert a[0, 0] == i32(0)
+    with pytest.raises(ValueError, match="cannot reshape"):
+        a.reshape(intp(5), intp(-1))
+
+
+def test_layouts():
+    from mcl.machine_types import f32, f64
+    from mcl.vm import layout_of
+
+    assert layout_of(i32).size == 4
+    assert layout_of(i64).size == 8
+    assert layout_of(intp).size == layout_of(intp).align
+    assert layout_of(f64).size == 8
+    with pytest.raises(TypeError, match="invalid type"):
+        layout_of(memref)
+
+    shape = (intp(2), intp(3))
+    for ty, values in [
+        (i64, [2**40, -1, 0, 7, 2**62, -(2**63)]),
+        (intp, [0, 1, 2, 3, 4, -5]),
+        (f64, [0.5, -1.25, 3.0, 1e300, 0.0, 2.5]),
+        (f32, [0.5, -1.25, 3.0, 4.0, 0.0, 2.5]),
+    ]:
+        data = memref.alloc(shape, ty)
+        assert data.strides == (intp(3 * layout_of(ty).size),
+                                intp(layout_of(ty).size))
+        for k, v in enumerate(values):
+            data.store((intp(k // 3), intp(k % 3)), ty(v))
+        got = data.load((intp(1), intp(2)), ty)
+        assert type(got) is ty
+        assert got == ty(values[5])
+        packed = data.load_block((intp(0), intp(0)), shape)
+        assert layout_of(ty).unpack_many(packed) == values
+
+    with pytest.raises(OverflowError):
+        memref.alloc(shape, i32).store((intp(0), intp(0)), i32(2**31))
+
+
+def test_array_float64():
+    from mcl.machine_types import f64
+    from mcl.ndarray import Float64
+
+    ary = Array(dtype=DType(Float64),
+                data=memref.alloc((intp(2), intp(2)), f64))
+    ary[0] = f64(1.5)
+    ary[1, 1] = Float64(value=f64(-2.0))
+    assert ary[0, 1] == f64(1.5)
+    assert ary[1, 1] == f64(-2.0)
+    assert ary[1, 1].value / f64(4.0) == f64(-0.5)
+
+
+def _iota(shape, start=0):
+    ary = Array(dtype=DType(Int32), data=memref.alloc(shape, i32))
+    c = start
+    for idx in itertools.product(*map(range, shape)):
+        ary[idx] = i32(c)
+        c += 1
+    return ary
+
+
+def _values(ary, ty=i32):
+    from mcl.vm import layout_of
+
+    zeros = tuple(intp(0) for _ in ary.shape)
+    return layout_of(ty).unpack_many(ary.data.load_block(zeros, ary.shape))
+
+
+def test_array_elementwise():
+    a = _iota((intp(3), intp(4)))
+    b = _iota((intp(4),), start=1)
+    col = _iota((intp(3), intp(1)), start=-1)
+
+    expect_a = list(range(12))
+    expect_b = [1, 2, 3, 4] * 3
+    assert _values(a + b) == [x + y for x, y in zip(expect_a, expect_b)]
+    assert _values(a - b) == [x - y for x, y in zip(expect_a, expect_b)]
+    assert _values(a * b) == [x * y for x, y in zip(expect_a, expect_b)]
+    assert _values(a // b) == [x // y for x, y in zip(expect_a, expect_b)]
+    assert _values(a == b) == [int(x == y) for x, y in zip(expect_a, expect_b)]
+    assert _values(a != b) == [int(x != y) for x, y in zip(expect_a, expect_b)]
+    assert _values(a < b) == [int(x < y) for x, y in zip(expect_a, expect_b)]
+    # broadcasting a column and a scalar
+    assert _values(a + col) == [x + (x // 4 - 1) for x in expect_a]
+    assert _values(a * i32(-2)) == [x * -2 for x in expect_a]
+    assert (a + b).shape == (intp(3), intp(4))
+
+    # explicit output and in-place update through overlapping storage
+    out = _iota((intp(3), intp(4)))
+    assert a.apply("int_add", i32(1), out=out) is out
+    assert _values(out) == [x + 1 for x in expect_a]
+    out.apply("int_mul", out, out=out)
+    assert _values(out) == [(x + 1) ** 2 for x in expect_a]
+    # a general function on raw values
+    got = a.apply(lambda x, y: max(x, y), i32(5))
+    assert _values(got) == [max(x, 5) for x in expect_a]
+
+    with pytest.raises(ValueError, match="broadcast shape"):
+        a.apply("int_add", b, out=b)
+    with pytest.raises(ValueError, match="not broadcastable"):
+        a + _iota((intp(3),))
+    with pytest.raises(OverflowError):
+        a + i32(2**31 - 1)
+    with pytest.raises(ZeroDivisionError):
+        a // i32(0)
+    with pytest.raises(TypeError, match="same dtype"):
+        a + i64(1)
+
+    # == is elementwise, so Arrays are unhashable and not truth-tested
+    with pytest.raises(TypeError, match="unhashable"):
+        {a}
+    assert isinstance(a == a, Array)
+    with pytest.raises(ValueError, match="ambiguous"):
+        bool(a == b)
+    with pytest.raises(ValueError, match="ambiguous"):
+        a != b or a
+    assert _values((a.lazy() != b).materialize()) == _values(a != b)
+    with pytest.raises(ValueError, match="ambiguous"):
+        bool(a.lazy() == b)
+
+    # true division of float arrays; integers have floor division only
+    x = Array(dtype=DType(Float64), data=memref.alloc((intp(3),), f64))
+    for k, v in enumerate([1.0, -3.0, 4.5]):
+        x[k] = f64(v)
+    y = x[slice(None, None, -1)]
+    assert _values(x / y, f64) == [1.0 / 4.5, 1.0, 4.5]
+    assert _values(x / f64(2.0), f64) == [0.5, -1.5, 2.25]
+    assert _values((x.lazy() / y).materialize(), f64) == _values(x / y, f64)
+    with pytest.raises(TypeError, match="int_truediv"):
+        a / b
+
+
+def test_array_lazy():
+    from mcl.ndarray import Expr, deferred
+
+    a = _iota((intp(3), intp(4)))
+    b = _iota((intp(4),), start=1)
+    c = _iota((intp(3), intp(1)), start=-1)
+
+    expr = a.lazy() + b * c
+    assert isinstance(expr, Expr)
+    assert expr.shape == (intp(3), intp(4))
+    assert _values(expr.materialize()) == _values(a + b * c)
+    # intermediates are not stored, so they may leave the dtype range
+    big = (a.lazy() + i32(2**31 - 1)) - i32(2**31 - 1)
+    assert _values(big.materialize()) == list(range(12))
+    # not even the range of the wider integers used for evaluation
+    x = Array(dtype=DType(Int32), data=memref.alloc((intp(2),), i32))
+    x[slice(None)] = i32(2**30)
+    wide = (x.lazy() * x * x) // (x.lazy() * x)
+    assert _values(wide.materialize()) == [2**30] * 2
+    # comparisons yield 0 and 1, and shared subtrees are fine
+    t = a.lazy() * i32(2)
+    assert _values(((t < b) + (t == a)).materialize()) == _values(
+        (a * i32(2) < b) + (a * i32(2) == a))
+
+    # assignment evaluates into the target, also over its own storage
+    out = _iota((intp(3), intp(4)))
+    out[slice(None)] = a + b.lazy() * c
+    assert _values(out) == _values(a + b * c)
+    with deferred():
+        step = out + out
+        assert isinstance(step, Expr)
+        out[slice(None)] = step
+    assert _values(out) == _values((a + b * c) * i32(2))
+    d = _iota((intp(3), intp(4)), start=2)
+    with deferred():
+        out[...] = b + c * d
+    assert _values(out) == _values(b + c * d)
+    out[...] = a
+    assert _values(out) == _values(a)
+    out[..., 1] = i32(-1)
+    assert _values(out[1, ...]) == [4, -1, 6, 7]
+    assert _values(out[..., 1]) == [-1] * 3
+    with pytest.raises(IndexError, match="single ellipsis"):
+        out[..., ...]
+
+    with pytest.raises(ValueError, match="Shapes do not match"):
+        b[slice(None)] = a.lazy() + a
+    with pytest.raises(TypeError, match="same dtype"):
+        a.lazy() + i64(1)
+    with pytest.raises(OverflowError):
+        (a.lazy() + i32(2**31 - 1)).materialize()
+    with pytest.raises(ZeroDivisionError):
+        (a.lazy() // (b - b)).materialize()
+
+
+def test_array_reductions():
+    from mcl.dialects import LoopNestAPI
+
+    shape = (intp(2), intp(3), intp(4))
+    a = _iota(shape, start=-5)
+    nest = LoopNestAPI.from_tuple((2, 3, 4))
+
+    def ref(fn, init, axis):
+        return nest.reduce(
+            lambda acc, idx: fn(acc, vm._get_machine_value(a[idx].value)),
+            init, axis,
+        )
+
+    for axis in [(0,), (1,), (2,), (0, 2), (1, 2)]:
+        assert _values(a.sum(axis=axis)) == ref(
+            lambda x, y: x + y, 0, axis)
+        small = a // i32(8)
+        assert _values(small.prod(axis=axis)) == nest.reduce(
+            lambda acc, idx: acc * vm._get_machine_value(small[idx].value),
+            1, axis,
+        )
+        assert _values(a.max(axis=axis)) == ref(max, -(2**31), axis)
+        assert _values(a.min(axis=axis)) == ref(min, 2**31, axis)
+        assert _values(a.any(axis=axis)) == ref(
+            lambda x, y: int(x or y != 0), 0, axis)
+        assert _values(a.all(axis=axis)) == ref(
+            lambda x, y: int(x and y != 0), 1, axis)
+
+    assert a.sum() == i32(sum(range(-5, 19)))
+    assert a.sum(pairwise=True) == i32(sum(range(-5, 19)))
+    assert a.max() == i32(18)
+    assert a.any() is True
+    assert a.all() is False
+    assert a.sum(axis=-1).shape == (intp(2), intp(3))
+    assert a.sum(axis=1, keepdims=True).shape == (intp(2), intp(1), intp(4))
+    assert a.sum(keepdims=True).shape == (intp(1), intp(1), intp(1))
+    # reductions over views and broadcasts
+    assert _values(a[1, slice(1, 3)].sum(axis=0)) == [
+        (12 + 4 + j) - 5 + (12 + 8 + j) - 5 for j in range(4)
+    ]
+    b = _iota((intp(4),))
+    b.broadcast_to((intp(3), intp(4)))
+    assert _values(b.sum(axis=0)) == [0, 3, 6, 9]
+    # folding an empty axis leaves the initial value at every kept index
+    add = lambda acc, idx: acc + 1
+    assert LoopNestAPI.from_tuple((3, 0)).reduce(add, 0, axis=(1,)) == [0] * 3
+    assert LoopNestAPI.from_tuple((0, 2)).reduce(add, 0, axis=(1,)) == []
+    empty = _iota((intp(3), intp(0)))
+    assert _values(empty.sum(axis=1)) == [0] * 3
+    assert _values(empty.prod(axis=1)) == [1] * 3
+
+    with pytest.raises(ValueError, match="repeated axis"):
+        a.sum(axis=(1, 1))
+    with pytest.raises(ValueError, match="out of bounds"):
+        a.sum(axis=3)
+
+
+def test_pairwise_sum():
+    from mcl.machine_types import f64
+    from mcl.ndarray import Float64
+
+    n = 1000
+    ary = Array(dtype=DType(Float64), data=memref.alloc((intp(n),), f64))
+    for i in range(n):
+        ary[i] = f64(0.1)
+    total = ary.sum(pairwise=True)
+    assert isinstance(total, Float64)
+    got = vm._get_machine_value(total.value)
+    assert abs(got - math.fsum([0.1] * n)) < 1e-12
+    assert _values(ary[slice(0, 8)].copy().sum(axis=0, keepdims=True),
+                   f64) == [sum([0.1] * 8)]
+
+
+def test_loop_nest_iteration():
+    from mcl.dialects import LoopNestAPI
+
+    dims = (intp(3), intp(2), intp(4))
+    nest = LoopNestAPI.from_tuple(dims)
+    expect = list(itertools.product(range(3), range(2), range(4)))
+    assert list(nest) == expect
+    assert nest.get_dims() == [3, 2, 4]
+    assert list(nest.stream()) == expect
+    assert list(nest.stream(as_intp=True))[5] == (intp(0), intp(1), intp(1))
+    assert list(LoopNestAPI.from_tuple((2, 0)).stream()) == []
+
+    strides = (32, 16, 4)
+    assert list(nest.offsets(strides, base=8)) == [
+        8 + i * 32 + j * 16 + k * 4 for i, j, k in expect
+    ]
+    assert list(nest.offsets((0, 16, 0))) == [j * 16 for _, j, _ in expect]
+
+
+def test_loop_nest_tiled():
+    from mcl.dialects import LoopNestAPI
+
+    nest = LoopNestAPI.from_tuple((5, 7))
+    tiles = list(nest.tiles((2, 4)))
+    assert tiles[:3] == [((0, 0), (2, 4)), ((0, 4), (2, 3)), ((2, 0), (2, 4))]
+    assert tiles[-1] == ((4, 4), (1, 3))
+
+    order = list(nest.tiled((2, 4)))
+    assert sorted(order) == list(nest)
+    assert order[:9] == [(0, 0), (0, 1), (0, 2), (0, 3),
+                         (1, 0), (1, 1), (1, 2), (1, 3), (0, 4)]
+
+    # outer dimensions are tiled by 1
+    nest3 = LoopNestAPI.from_tuple((2, 3, 3))
+    assert list(nest3.tiles((2, 2)))[:2] == [
+        ((0, 0, 0), (1, 2, 2)), ((0, 0, 2), (1, 2, 1))
+    ]
+    with pytest.raises(ValueError, match="more dimensions"):
+        list(nest.tiles((1, 1, 1)))
+
+
+def _fill_body(idx, ary):
+    (i, j) = idx
+    ary[i, j] = i32(10 * i + j)
+
+
+def test_loop_nest_parallel_for(tmp_path):
+    import pickle
+    from mcl.dialects import LoopNestAPI
+
+    data = memref.alloc((intp(5), intp(4)), i32)
+    data.store((intp(1), intp(1)), i32(3))
+    ary = Array(dtype=DType(Int32), data=data)
+    view = ary[1]
+    with pytest.raises(pickle.PicklingError, match="not shared"):
+        pickle.dumps(ary)
+
+    # sharing keeps contents and views
+    data.share()
+    assert view[1] == i32(3)
+    # within one process a pickled owner attaches to itself
+    assert vm._get_machine_value(pickle.loads(pickle.dumps(data))) is \
+        vm._get_machine_value(data)
+    assert pickle.loads(pickle.dumps(view))[1] == i32(3)
+
+    LoopNestAPI.from_tuple((5, 4)).parallel_for(_fill_body, 2, args=(ary,))
+    assert _values(ary) == [10 * i + j for i in range(5) for j in range(4)]
+    assert view[3] == i32(13)
+
+    # file mappings are shared through their path
+    mapped = Array(dtype=DType(Int32), data=memref.alloc_mapped(
+        (intp(3), intp(2)), i32, str(tmp_path / "data.bin")))
+    LoopNestAPI.from_tuple((3, 2)).parallel_for(_fill_body, 2, args=(mapped,))
+    assert _values(mapped) == [0, 1, 10, 11, 20, 21]
+
+    # stores into adopted buffers would be lost with a shared copy
+    raw = bytearray(3 * 2 * 4)
+    ext = Array(dtype=DType(Int32), data=memref.from_buffer(
+        raw, (intp(3), intp(2)), i32))
+    with pytest.raises(BufferError, match="adopted"):
+        LoopNestAPI.from_tuple((3, 2)).parallel_for(
+            _fill_body, 2, args=(ext,))
+    copied = Array(dtype=DType(Int32), data=ext.data.copy())
+    LoopNestAPI.from_tuple((3, 2)).parallel_for(_fill_body, 2, args=(copied,))
+    assert _values(copied) == [0, 1, 10, 11, 20, 21]
+    assert bytes(raw) == bytes(len(raw))
+    # empty allocations can be shared too
+    memref.alloc((intp(0), intp(2)), i32).share()
+
+
+def test_loop_nest_parallel_for_spawn():
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from mcl.dialects import LoopNestAPI
+
+    ary = Array(dtype=DType(Int32), data=memref.alloc((intp(4), intp(3)), i32))
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(2, mp_context=ctx) as pool:
+        LoopNestAPI.from_tuple((4, 3)).parallel_for(
+            _fill_body, args=(ary,), executor=pool, chunks=3)
+        # a second call attaches to the segment again in the same workers
+        ary[0, 0] = i32(-1)
+        LoopNestAPI.from_tuple((1, 3)).parallel_for(
+            _fill_body, args=(ary,), executor=pool)
+    assert _values(ary) == [10 * i + j for i in range(4) for j in range(3)]
+
+
+_SHARED_AT_EXIT = """
+from mcl.machine_types import i32, intp, memref
+from mcl import vm
+
+class Holder:
     pass
+
+# a cycle keeps the memref alive until the interpreter shuts down
+h = Holder()
+h.cycle = h
+h.memsys = vm._the_memsys
+h.data = memref.alloc((intp(4),), i32)
+h.view = h.data.view((intp(2),), (intp(4),), intp(4))
+h.data.share()
+h.view.store((intp(1),), i32(5))
+assert h.data.load((intp(2),), i32) == i32(5)
+"""
+
+
+def test_shared_memory_exit(memsys):
+    import os
+    import subprocess
+    import sys
+
+    name = "numpy" if type(memsys).__name__.startswith("NumPy") else "python"
+    env = dict(os.environ, MCL_MEMSYS=name,
+               PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.run([sys.executable, "-c", _SHARED_AT_EXIT], env=env,
+                          capture_output=True, text=True)
+    assert proc.returncode == 0 and proc.stderr == ""
+
+
+def test_profiling(memsys):
+    from mcl import profiling
+
+    a = _iota((intp(3), intp(4)))
+    b = _iota((intp(4),), start=1)
+    add = Array.__add__
+    with profiling.profile() as prof:
+        c = a + b
+        a[1, 2]
+    assert _values(c) == _values(a + b)
+    assert Array.__add__ is add and "elementwise" not in vars(memsys)
+
+    assert prof.ops["memref_elementwise"].calls == 1
+    assert sum(prof.ops["memref_elementwise"].hist.values()) == 1
+    assert prof.memsys["elementwise"].calls == 1
+    # both inputs are read in full; b is broadcast over the rows
+    add_stats = prof.methods["__add__"]
+    assert add_stats.calls == 1 and add_stats.ops > 0
+    assert (add_stats.bytes_read, add_stats.bytes_written) == (96, 48)
+    assert prof.methods["__getitem__"].bytes_read == 4
+    assert "apply" not in prof.methods
+    assert {s.bytes_written for s in prof.owners.values()} == {0, 48}
+
+    data = json.loads(prof.to_json())
+    assert data["methods"]["__add__"]["bytes_written"] == 48
+    assert data["ops"]["memref_elementwise"]["calls"] == 1
+    report = prof.report()
+    assert "memref_elementwise" in report and "__add__" in report
+
+    # dispatch modes can change inside the block and are still profiled
+    with profiling.profile() as prof:
+        with vm.dispatch_mode("unchecked"):
+            assert vm.set_dispatch_mode("unchecked") == "unchecked"
+            a[1, 2]
+        assert vm._dispatch is not vm._table_dispatch
+    assert prof.ops["memref_load"].calls == 1
+    assert vm._dispatch is vm._table_dispatch
+
+
+def test_access_trace(tmp_path):
+    from mcl import accesses
+    from mcl.dialects import LoopNestAPI
+
+    a = _iota((intp(8), intp(16)))
+    out = _iota((intp(8), intp(16)))
+    with accesses.record() as trace:
+        for i, j in LoopNestAPI.from_tuple((8, 16)):
+            out[i, j] = a[i, j].value
+        for j, i in LoopNestAPI.from_tuple((16, 8)):
+            out[i, j] = a[i, j].value
+        a[0, 0]
+    assert LoopNestAPI.__iter__ is not trace._walk
+    assert trace.count == 2 * 2 * 128 + 1 and trace.dropped == 0
+    assert [n.dims for n in trace.nests] == [(8, 16), (16, 8)]
+    assert "test_access_trace" in trace.nests[0].site
+
+    streams = trace.streams()
+    assert [(s.nest, s.slot, s.write, s.kind) for s in streams] == [
+        (0, 0, False, "unit"), (0, 1, True, "unit"),
+        (1, 0, False, "long"), (1, 1, True, "long"),
+    ]
+    assert [(s.inner_stride, s.outer_stride) for s in streams] == [
+        (4, 64), (4, 64), (64, 4), (64, 4)]
+    assert [s.against_stride for s in streams] == [False, False, True, True]
+    [w0, w1] = trace.warnings()
+    assert w0.startswith("nest 1 (16, 8)") and "interchange" in w0
+
+    # 2 buffers of 8 lines; row-major hits 15 of 16 accesses per line
+    hist = trace.reuse_distances(line=64)
+    assert hist.cold == 16
+    stats = trace.simulate_cache(size=1024, line=64, ways=None)
+    assert stats.by_nest[0] == (256 - 16, 16)
+    assert stats.hits + stats.misses == trace.count
+    # four lines: only the row-major walk keeps its lines cached
+    tiny = trace.simulate_cache(size=256, line=64, ways=None)
+    assert (tiny.by_nest[0][1], tiny.by_nest[1][1]) == (16, 256)
+    assert "against stride" in trace.report()
+
+    # a small ring keeps the newest records; a file keeps everything
+    with accesses.record(capacity=10) as ring:
+        for (i,) in LoopNestAPI.from_tuple((20,)):
+            a[0, i % 16]
+    assert (ring.count, ring.dropped) == (20, 10)
+    assert [r.iteration for r in ring.records()] == list(range(10, 20))
+    path = tmp_path / "trace.bin"
+    with accesses.record(path=path) as logged:
+        for (i,) in LoopNestAPI.from_tuple((20,)):
+            a[0, i % 16]
+    assert path.stat().st_size == 20 * 24
+    assert len(list(logged.records())) == 20
+    assert logged.streams()[0].kind == "unit"
+
+
+def test_tracing():
+    from mcl import tracing
+
+    @tracing.trace
+    def add_rows(a, out):
+        # Data flows through machine ops; loop bounds come from the shape.
+        (n, m) = a.shape
+        for j in range(m):
+            out[j] = a[0, j].value + a[1, j].value
+        return out[0]
+
+    a = _iota((intp(2), intp(3)))
+    out = Array(dtype=DType(Int32), data=memref.alloc((intp(3),), i32))
+    assert add_rows(a, out) == i32(3)
+    assert _values(out) == [3, 5, 7]
+    assert add_rows.stats["traced"] == 1
+    src = add_rows.source(a, out)
+    assert "def replay" in src and "memref_shape" not in src
+
+    # replays see new data
+    a[0, 0] = i32(10)
+    assert add_rows(a, out) == i32(13)
+    assert _values(out) == [13, 5, 7]
+    assert add_rows.stats["replayed"] == 1
+
+    # another shape is another trace
+    b = _iota((intp(2), intp(2)), start=1)
+    out2 = Array(dtype=DType(Int32), data=memref.alloc((intp(2),), i32))
+    add_rows(b, out2)
+    assert _values(out2) == [4, 6]
+    assert add_rows.stats["traced"] == 2
+
+    from mcl.dialects import LoopNestAPI
+
+    @tracing.trace
+    def double(a, out):
+        for idx in LoopNestAPI.from_tuple(a.shape):
+            out[idx] = a[idx].value + a[idx].value
+
+    d = _iota((intp(2), intp(3)))
+    out3 = Array(dtype=DType(Int32), data=memref.alloc(d.shape, i32))
+    double(d, out3)
+    double(d, out3)
+    assert _values(out3) == [0, 2, 4, 6, 8, 10]
+    assert double.stats["replayed"] == 1
+    assert double.source(d, out3) is not None
+
+    @tracing.trace
+    def head(n, a, out):
+        # A loop bound passed as an argument is guarded.
+        for j in range(n):
+            out[j] = a[j].value
+
+    e = _iota((intp(3),), start=1)
+    out4 = Array(dtype=DType(Int32), data=memref.alloc((intp(3),), i32))
+    head(intp(2), e, out4)
+    head(intp(2), e, out4)
+    assert "!= 2: raise _Deopt" in head.source(intp(2), e, out4)
+    head(intp(3), e, out4)
+    assert _values(out4) == [1, 2, 3]
+    assert head.stats["deopts"] == 1
+
+    @tracing.trace
+    def first_unless_equal(a, out):
+        # The comparison is recorded as a guard.
+        if a[0].value == a[1].value:
+            out[0] = i32(0)
+        else:
+            out[0] = a[0].value
+
+    c = _iota((intp(2),))
+    out1 = Array(dtype=DType(Int32), data=memref.alloc((intp(1),), i32))
+    first_unless_equal(c, out1)
+    c[0] = i32(-4)
+    first_unless_equal(c, out1)
+    assert _values(out1) == [-4]
+    c[0] = i32(1)
+    first_unless_equal(c, out1)
+    assert _values(out1) == [0]
+    assert first_unless_equal.stats["deopts"] == 1
+
+    # bulk reads into Python are not traced
+    total = tracing.trace(lambda a: a.sum())
+    assert total(a) == i32(25)
+    a[1, 1] = i32(0)
+    assert total(a) == i32(21)
+    assert total.source(a) is None
+    assert total.stats["interpreted"] == 1